@@ -5,6 +5,7 @@ import json
 import os
 import sys
 from shapeworld import Dataset, util
+from shapeworld.dataset import LoadedDataset
 from models.TFMacros.tf_macros import Model
 
 
@@ -22,8 +23,11 @@ if __name__ == '__main__':
 
     parser.add_argument('-b', '--batch-size', type=util.parse_int_with_factor, default=64, help='Batch size')
     parser.add_argument('-i', '--iterations', type=util.parse_int_with_factor, default=100, help='Number of iterations')
+    parser.add_argument('-E', '--epoch', action='store_true', help='Evaluate on one epoch of the loaded data instead of a number of iterations')
     parser.add_argument('-q', '--query', default=None, help='Additional values to query (separated by commas)')
     parser.add_argument('-s', '--serialize', default=None, help='Values to serialize (separated by commas)')
+    parser.add_argument('--prefetch', type=int, default=0, help='Number of batches to prefetch in background processes')
+    parser.add_argument('--workers', type=int, default=0, help='Number of background processes generating batches')
 
     parser.add_argument('--model-dir', help='TensorFlow model directory, storing the model computation graph and parameters')
     parser.add_argument('--report-file', default=None, help='CSV file reporting the evaluation results')
@@ -43,6 +47,8 @@ if __name__ == '__main__':
 
     # dataset
     dataset = Dataset.create(dtype=args.type, name=args.name, variant=args.variant, language=args.language, config=args.config, **args.config_values)
+    # epochs are only defined for the fixed instances of a loaded dataset
+    assert not args.epoch or isinstance(dataset, LoadedDataset), 'Epoch evaluation requires a loaded dataset'
 
     # information about dataset and model
     if args.verbosity >= 1:
@@ -138,47 +144,77 @@ if __name__ == '__main__':
             sys.stdout.flush()
 
         train = {name: 0.0 for name in query}
-        for _ in range(args.iterations):
-            generated = dataset.generate(n=args.batch_size, mode='train')
-            queried = model(query=query, data=generated)
-            train = {name: value + queried[name] for name, value in train.items()}
-        train = {name: value / args.iterations for name, value in train.items()}
+        if args.epoch:
+            batches = dataset.epoch(n=args.batch_size, mode='train')
+        else:
+            batches = dataset.iterate(n=args.batch_size, mode='train', iterations=args.iterations, prefetch=args.prefetch, workers=args.workers)
+        num_instances = 0
+        for generated in batches:
+            queried = model(query=query, data=dataset.float_worlds(batch=generated))
+            # weighted by batch size, as the final batch of an epoch may be smaller
+            batch_size = len(next(iter(generated.values())))
+            train = {name: value + queried[name] * batch_size for name, value in train.items()}
+            num_instances += batch_size
+        train = {name: value / num_instances for name, value in train.items()}
         sys.stdout.write('         train: ')
         for name in query:
             sys.stdout.write('{}={:.3f} '.format(name, train[name]))
+        if not args.epoch and (args.workers > 0 or args.prefetch > 0):
+            statistics = batches.statistics()
+            sys.stdout.write(' (queue depth: {:.1f} mean, {} max, blocked: {:.1f}s)'.format(statistics['mean_queue_depth'], statistics['max_queue_depth'], statistics['wait_time']))
         sys.stdout.write('\n')
         sys.stdout.flush()
         if serialize:
             dataset.serialize(path=None, generated=generated, additional={name: (train[name], serialize[name]) for name in serialize})
 
         validation = {name: 0.0 for name in query}
-        for _ in range(args.iterations):
-            generated = dataset.generate(n=args.batch_size, mode='validation')
-            queried = model(query=query, data=generated)
-            validation = {name: value + queried[name] for name, value in validation.items()}
-        validation = {name: value / args.iterations for name, value in validation.items()}
+        if args.epoch:
+            batches = dataset.epoch(n=args.batch_size, mode='validation')
+        else:
+            batches = dataset.iterate(n=args.batch_size, mode='validation', iterations=args.iterations, prefetch=args.prefetch, workers=args.workers)
+        num_instances = 0
+        for generated in batches:
+            queried = model(query=query, data=dataset.float_worlds(batch=generated))
+            batch_size = len(next(iter(generated.values())))
+            validation = {name: value + queried[name] * batch_size for name, value in validation.items()}
+            num_instances += batch_size
+        validation = {name: value / num_instances for name, value in validation.items()}
         sys.stdout.write('         validation: ')
         for name in query:
             sys.stdout.write('{}={:.3f} '.format(name, validation[name]))
+        if not args.epoch and (args.workers > 0 or args.prefetch > 0):
+            statistics = batches.statistics()
+            sys.stdout.write(' (queue depth: {:.1f} mean, {} max, blocked: {:.1f}s)'.format(statistics['mean_queue_depth'], statistics['max_queue_depth'], statistics['wait_time']))
         sys.stdout.write('\n')
         sys.stdout.flush()
         if serialize:
             dataset.serialize(path=None, generated=generated, additional={name: (validation[name], serialize[name]) for name in serialize})
 
         test = {name: 0.0 for name in query}
-        for _ in range(args.iterations):
-            generated = dataset.generate(n=args.batch_size, mode='test')
-            queried = model(query=query, data=generated)
-            test = {name: value + queried[name] for name, value in test.items()}
-        test = {name: value / args.iterations for name, value in test.items()}
+        if args.epoch:
+            batches = dataset.epoch(n=args.batch_size, mode='test')
+        else:
+            batches = dataset.iterate(n=args.batch_size, mode='test', iterations=args.iterations, prefetch=args.prefetch, workers=args.workers)
+        num_instances = 0
+        for generated in batches:
+            queried = model(query=query, data=dataset.float_worlds(batch=generated))
+            batch_size = len(next(iter(generated.values())))
+            test = {name: value + queried[name] * batch_size for name, value in test.items()}
+            num_instances += batch_size
+        test = {name: value / num_instances for name, value in test.items()}
         sys.stdout.write('         test: ')
         for name in query:
             sys.stdout.write('{}={:.3f} '.format(name, test[name]))
+        if not args.epoch and (args.workers > 0 or args.prefetch > 0):
+            statistics = batches.statistics()
+            sys.stdout.write(' (queue depth: {:.1f} mean, {} max, blocked: {:.1f}s)'.format(statistics['mean_queue_depth'], statistics['max_queue_depth'], statistics['wait_time']))
         sys.stdout.write('\n')
         sys.stdout.flush()
         if serialize:
             dataset.serialize(path=None, generated=generated, additional={name: (test[name], serialize[name]) for name in serialize})
 
+        dataset.close()
+
         if args.verbosity >= 1:
             sys.stdout.write('\n{} model evaluation finished\n'.format(datetime.now().strftime('%H:%M:%S')))
             sys.stdout.flush()
@@ -38,6 +38,16 @@ if __name__ == '__main__':
     parser.add_argument('-N', '--numpy-format', action='store_true', help='Store images in NumPy as opposed to image format')
     parser.add_argument('-G', '--png-format', action='store_true', help='Store images in PNG as opposed to bitmap format')
     parser.add_argument('-O', '--concatenate-images', action='store_true', help='Concatenate images per part into one image file')
+    parser.add_argument('--png-compression', type=int, default=None, choices=range(10), help='PNG compression level from 0 (none) to 9 (best), lower is faster (requires --png-format)')
+    parser.add_argument('--encode-workers', type=int, default=1, help='Number of threads encoding images per shard')
+    parser.add_argument('--npy-columns', action='store_true', help='Store shards as fixed-shape NumPy columns, memory-mapped when loaded')
+    parser.add_argument('--chunk-size', type=util.parse_int_with_factor, default=None, help='Store shards as columns of fixed-size chunks with an instance index, for random access when loaded')
+    parser.add_argument('--chunk-compression', default=None, choices=('zlib', 'bz2', 'lzma'), help='Compression of each chunk (requires --chunk-size)')
+    parser.add_argument('--world-dtype', default=None, choices=('float32', 'float16', 'uint8'), help='Data type of generated worlds, uint8 for compact storage (default: float32)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for generation')
+    parser.add_argument('--realization-cache', default=None, help='JSON file caching caption realizations across generation runs')
+    parser.add_argument('--ace-processes', type=int, default=1, help='Number of ACE processes realizing captions in parallel')
+    parser.add_argument('--mask-cache', type=util.parse_int_with_factor, default=None, help='Memory budget for cached quantized shape masks, approximating rendering and collisions (default: disabled)')
 
     parser.add_argument('-Y', '--yes', action='store_true', help='Confirm all questions with yes')
     # parser.add_argument('-v', '--values', default=None, help='Comma-separated list of values to include')
@@ -51,8 +61,15 @@ if __name__ == '__main__':
     if args.tf_records:
         from shapeworld import tf_util
 
+    if args.mask_cache is not None:
+        from shapeworld.world import Shape
+        from shapeworld.world.shape import MaskCache
+        Shape.mask_cache = MaskCache(memory_budget=args.mask_cache)
+
     # does not include variant, as loading data for generation is not expected
     dataset = Dataset.create(dtype=args.type, name=args.name, language=args.language, config=args.config, **args.config_values)
+    if args.world_dtype is not None:
+        dataset.world_dtype = args.world_dtype
     sys.stdout.write('{time} {dataset}\n'.format(time=datetime.now().strftime('%H:%M:%S'), dataset=dataset))
     if args.config is None:
         if args.config_values:
@@ -116,6 +133,12 @@ if __name__ == '__main__':
         specification['image_format'] = 'png'
     if args.concatenate_images:
         specification['num_concat_worlds'] = args.instances
+    assert args.png_compression is None or args.png_format
+    assert args.chunk_compression is None or args.chunk_size is not None
+    if args.npy_columns or args.chunk_size is not None:
+        assert not (args.npy_columns and args.chunk_size is not None)
+        assert args.archive is None and not args.html and not args.numpy_format and not args.png_format and not args.concatenate_images and not args.clevr_format
+        specification['shard_format'] = 'npy' if args.npy_columns else 'chunked'
 
     if args.unmanaged:
         directory = args.directory
@@ -141,6 +164,7 @@ if __name__ == '__main__':
             shards = args.shards
 
     assert all(shard is None or shard >= 0 for shard in shards)
+    assert (not args.npy_columns and args.chunk_size is None) or all(shard is not None for shard in shards)
     if len(shards) == 1:
         modes = (args.mode,)
         if args.unmanaged or args.mode is None:
@@ -214,6 +238,19 @@ if __name__ == '__main__':
                 if not os.path.isdir(subdir):
                     os.makedirs(subdir)
 
+    if args.realization_cache is not None:
+        from shapeworld.realizers.dmrs.realizer import RealizationCache
+        assert hasattr(dataset, 'caption_realizer')
+        dataset.caption_realizer.realization_cache = RealizationCache(language=dataset.caption_realizer.language, path=args.realization_cache)
+
+    if args.ace_processes > 1:
+        assert hasattr(dataset, 'caption_realizer')
+        dataset.caption_realizer.ace.num_processes = args.ace_processes
+
+    if args.workers > 1:
+        from shapeworld.dataset import ParallelDataset
+        dataset = ParallelDataset(dataset=dataset, workers=args.workers)
+
     for mode, directory, num_shards, shard_begin in zip(modes, directories, shards, shards_begin):
         sys.stdout.write('{time} generate {dtype} {name}{mode} data...\n'.format(time=datetime.now().strftime('%H:%M:%S'), dtype=dataset.type, name=dataset.name, mode=(' ' + mode if mode else '')))
         sys.stdout.write('         0%  0/{shards}  (time per shard: n/a)'.format(shards=(1 if num_shards is None else num_shards)))
@@ -285,10 +322,15 @@ if __name__ == '__main__':
                 if args.features:
                     for value_name, value_type in dataset.values.items():
                         if value_type == 'world':
-                            features = pretrained_model.features(images=generated[value_name])
+                            features = pretrained_model.features(images=dataset.float_worlds(batch=generated)[value_name])
                             generated[value_name + '_features'] = features
 
-                dataset.serialize(path=path, generated=generated, archive=args.archive, html=args.html, numpy_formats=numpy_formats, image_format=('png' if args.png_format else 'bmp'), concat_worlds=args.concatenate_images)
+                if args.npy_columns:
+                    dataset.serialize_columns(path=path, generated=generated)
+                elif args.chunk_size is not None:
+                    dataset.serialize_chunks(path=path, generated=generated, chunk_size=args.chunk_size, compression=args.chunk_compression)
+                else:
+                    dataset.serialize(path=path, generated=generated, archive=args.archive, html=args.html, numpy_formats=numpy_formats, image_format=('png' if args.png_format else 'bmp'), concat_worlds=args.concatenate_images, encode_workers=args.encode_workers, compress_level=args.png_compression)
 
                 if args.tf_records:
                     tf_util.write_records(dataset=dataset, records=generated, path=path)
@@ -328,5 +370,11 @@ if __name__ == '__main__':
     if args.features:
         pretrained_model.close()
 
+    dataset.close()
+
+    # aggregated over worker processes, whose caches are saved when the dataset is closed
+    for name, statistics in sorted(dataset.statistics().items()):
+        sys.stdout.write('         {name}: {statistics}\n'.format(name=name, statistics=statistics))
+
     sys.stdout.write('{time} data generation completed\n'.format(time=datetime.now().strftime('%H:%M:%S')))
     sys.stdout.flush()
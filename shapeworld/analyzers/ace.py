@@ -1,16 +1,98 @@
 import argparse
+from collections import deque, OrderedDict
+import os
 import re
 import subprocess
 import sys
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 from shapeworld.realizers.dmrs.pydmrs.pydmrs.core import ListDmrs
 from shapeworld.analyzers.mrs import Mrs
 from shapeworld.analyzers.derivtree import DerivTree
 
 
+class AceSession(object):
+
+    # persistent ACE process, reading one input per line, with output streamed line by line
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+        self.pid = None
+        self.stdout_lines = None
+        self.stderr_lines = None
+
+    @staticmethod
+    def read_lines(stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line.decode('utf-8').rstrip('\n'))
+        lines.put(None)
+
+    def is_alive(self):
+        # processes are not shared with forked children, which start their own
+        return self.process is not None and self.pid == os.getpid() and self.process.poll() is None
+
+    def start(self):
+        self.close()
+        self.process = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.pid = os.getpid()
+        self.stdout_lines = Queue()
+        self.stderr_lines = Queue()
+        for stream, lines in ((self.process.stdout, self.stdout_lines), (self.process.stderr, self.stderr_lines)):
+            thread = threading.Thread(target=AceSession.read_lines, args=(stream, lines))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        if self.process is not None and self.pid == os.getpid():
+            try:
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+        self.process = None
+        self.pid = None
+
+    def write(self, line):
+        if not self.is_alive():
+            self.start()
+        self.process.stdin.write((line + '\n').encode())
+        self.process.stdin.flush()
+
+    def read_stdout(self):
+        line = self.stdout_lines.get()
+        if line is None:
+            self.close()
+            raise Exception('ACE process terminated unexpectedly!')
+        return line
+
+    def read_stderr(self):
+        line = self.stderr_lines.get()
+        if line is None:
+            self.close()
+            raise Exception('ACE process terminated unexpectedly!')
+        return line
+
+
 class Ace:
 
     # root_gen, root_informal, root_strict
-    def __init__(self, executable='ace', grammar='erg.dat', num_outputs=None, trees=False, root=None, informal=False):
+    def __init__(self, executable='ace', grammar='erg.dat', num_outputs=None, trees=False, root=None, informal=False, num_sessions=1, max_pending=64, cache_size=10000):
+        assert isinstance(num_sessions, int) and num_sessions >= 1
+        assert isinstance(max_pending, int) and max_pending >= 1
+        assert isinstance(cache_size, int) and cache_size >= 0
+        # persistent sessions, inputs distributed round-robin, with a bounded number of inputs in flight
+        self.num_sessions = num_sessions
+        self.max_pending = max_pending
+        self.parse_sessions = list()
+        self.generate_sessions = list()
+        # raw parse output by sentence
+        self.cache_size = cache_size
+        self.parse_cache = OrderedDict()
         self.args = [executable, '-g', grammar]
         if num_outputs is not None:
             assert num_outputs > 0
@@ -64,70 +146,80 @@ class Ace:
             return parses
 
     def parse_iter(self, sentence_list=None, print_notes=False):
-        sentence_list = list(sentence_list)
-        num_sentences = len(sentence_list)
-        ace_input = '\n'.join(sentence_list) + '\n'
-
-        ace_parse = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_data, stderr_data = ace_parse.communicate(input=ace_input.encode())
-
-        # stderr
-        lines = iter(stderr_data.decode('utf-8').splitlines())
-        num_results = list()
-        while True:
-            line = next(lines)
-            if self.parse_successful_regex.match(line):
-                num_results.append(int(line[6: line.index(' readings, added')]))
-                continue
-            elif self.parse_unsuccessful_regex.match(line):
-                num_results.append(0)
-                continue
-            elif self.parse_final0_regex.match(line):
-                assert len(sentence_list) == 0
-                raise Exception('Empty sentence list!')
-            elif self.parse_final1_regex.match(line):
-                assert len(num_results) == num_sentences
-                break
-            else:
-                assert False, line
-
-        # stdout
-        lines = iter(stdout_data.decode('utf-8').splitlines())
-
-        for n, count in enumerate(num_results):
-            line = next(lines)
-
-            if count == 0:
-                assert line == ('SKIP: ' + sentence_list[n])
-            else:
-                assert line == ('SENT: ' + sentence_list[n])
-
-            parses = [next(lines) for _ in range(count)]  # list actually performs next calls
-            parses = (self.parse_item(line=line, print_notes=print_notes) for line in parses)  # do not parse items immediately
-
-            line = next(lines)
-            assert line == ''
-            line = next(lines)
-            assert line == ''
+        while len(self.parse_sessions) < self.num_sessions:
+            self.parse_sessions.append(AceSession(args=self.args))
+        pending = deque()
+        try:
+            for n, sentence in enumerate(sentence_list):
+                if sentence in self.parse_cache:
+                    # cached output is taken now, as it may be evicted before being yielded
+                    lines = self.parse_cache.pop(sentence)
+                    self.parse_cache[sentence] = lines
+                    pending.append((None, sentence, lines))
+                else:
+                    session = self.parse_sessions[n % self.num_sessions]
+                    session.write(sentence)
+                    pending.append((session, sentence, None))
+                if len(pending) > self.max_pending:
+                    yield self.parse_result(*pending.popleft(), print_notes=print_notes)
+            while pending:
+                yield self.parse_result(*pending.popleft(), print_notes=print_notes)
+        finally:
+            # sessions with unread output are out of sync
+            for session, _, _ in pending:
+                if session is not None:
+                    session.close()
+
+    def parse_result(self, session, sentence, lines=None, print_notes=False):
+        if session is None:
+            assert lines is not None
 
-            if count == 0:
-                yield None
-            elif not self.first_only:
-                yield parses
-            else:
-                parse = next(parses)
-                try:
-                    next(parses)
-                    assert False
-                except StopIteration:
-                    pass
-                yield parse
+        else:
+            try:
+                # stderr
+                line = session.read_stderr()
+                if self.parse_successful_regex.match(line):
+                    count = int(line[6: line.index(' readings, added')])
+                elif self.parse_unsuccessful_regex.match(line):
+                    count = 0
+                else:
+                    assert False, line
 
-        try:
-            next(lines)
-            assert False
-        except StopIteration:
-            pass
+                # stdout
+                line = session.read_stdout()
+                if count == 0:
+                    assert line == ('SKIP: ' + sentence)
+                else:
+                    assert line == ('SENT: ' + sentence)
+                lines = [session.read_stdout() for _ in range(count)]
+                line = session.read_stdout()
+                assert line == ''
+                line = session.read_stdout()
+                assert line == ''
+
+            except BaseException:
+                session.close()
+                raise
+
+            if self.cache_size > 0:
+                self.parse_cache[sentence] = lines
+                while len(self.parse_cache) > self.cache_size:
+                    self.parse_cache.popitem(last=False)
+
+        parses = (self.parse_item(line=line, print_notes=print_notes) for line in lines)  # do not parse items immediately
+
+        if len(lines) == 0:
+            return None
+        elif not self.first_only:
+            return parses
+        else:
+            parse = next(parses)
+            try:
+                next(parses)
+                assert False
+            except StopIteration:
+                pass
+            return parse
 
     def parse_item(self, line, print_notes=False):
         try:
@@ -175,74 +267,60 @@ class Ace:
             return generated
 
     def generate_iter(self, mrs=None, mrs_list=None, print_notes=False):
-        num_mrs = len(mrs_list)
-        ace_input = '\n'.join(str(mrs) for mrs in mrs_list) + '\n'
-
-        ace_generate = subprocess.Popen(self.args + ['-e'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_data, stderr_data = ace_generate.communicate(input=ace_input.encode())
-
-        # stderr
-        lines = iter(stderr_data.decode('utf-8').splitlines())
-        num_results = list()
-        successful = None
-        while True:
-            line = next(lines)
-            if self.gen_successful_regex.match(line):
-                num_results.append(int(line[line.rindex('[') + 1: -9]))
-                successful = True
-                continue
-            elif self.gen_unsuccessful_regex.match(line):
-                num_results.append(0)
-                successful = False
-                continue
-            elif self.gen_unknown_lexeme1_regex.match(line):
-                assert successful is not None
-                if print_notes:
-                    sys.stderr.write('{} {}\n'.format(len(num_results) - 1, line))
-                line = next(lines)
-                self.gen_unknown_lexeme2_regex.match(line)
-                if print_notes:
-                    sys.stderr.write('{} {}\n'.format(len(num_results) - 1, line))
-                successful = None
-            elif self.gen_final0_regex.match(line):
-                assert len(mrs_list) == 0
-                raise Exception('Empty MRS list!')
-            elif self.gen_final1_regex.match(line):
-                assert len(num_results) == num_mrs
-                break
-            else:
-                assert False, line
-        self.gen_final2_regex.match(next(lines))
+        while len(self.generate_sessions) < self.num_sessions:
+            self.generate_sessions.append(AceSession(args=(self.args + ['-e'])))
+        pending = deque()
         try:
-            next(lines)
-            assert False
-        except StopIteration:
-            pass
-
-        # stdout
-        lines = iter(stdout_data.decode('utf-8').splitlines())
-
-        for count in num_results:
-            generated = list()
-            for _ in range(count):
-                sentence = next(lines)
-                generated.append(sentence)
-            line = next(lines)
+            for n, mrs in enumerate(mrs_list):
+                session = self.generate_sessions[n % self.num_sessions]
+                session.write(str(mrs))
+                pending.append((session, n))
+                if len(pending) > self.max_pending:
+                    yield self.generate_result(*pending.popleft(), print_notes=print_notes)
+            while pending:
+                yield self.generate_result(*pending.popleft(), print_notes=print_notes)
+        finally:
+            # sessions with unread output are out of sync
+            for session, _ in pending:
+                session.close()
+
+    def generate_result(self, session, n, print_notes=False):
+        try:
+            # stderr, including notes for the previous item
+            while True:
+                line = session.read_stderr()
+                if self.gen_successful_regex.match(line):
+                    count = int(line[line.rindex('[') + 1: -9])
+                    break
+                elif self.gen_unsuccessful_regex.match(line):
+                    count = 0
+                    break
+                elif self.gen_unknown_lexeme1_regex.match(line) or self.gen_unknown_lexeme2_regex.match(line):
+                    if print_notes:
+                        sys.stderr.write('{} {}\n'.format(n - self.num_sessions, line))
+                else:
+                    assert False, line
+
+            # stdout
+            generated = [session.read_stdout() for _ in range(count)]
+            line = session.read_stdout()
             assert line == ''
 
-            if not self.first_only:
-                yield generated
-            elif count > 0:
-                assert len(generated) == 1
-                yield generated[0]
-            else:
-                yield None
+        except BaseException:
+            session.close()
+            raise
 
-        try:
-            next(lines)
-            assert False
-        except StopIteration:
-            pass
+        if not self.first_only:
+            return generated
+        elif count > 0:
+            assert len(generated) == 1
+            return generated[0]
+        else:
+            return None
+
+    def close(self):
+        for session in self.parse_sessions + self.generate_sessions:
+            session.close()
 
 
 if __name__ == "__main__":
@@ -255,9 +333,10 @@ if __name__ == "__main__":
     parser.add_argument('-d', '--dmrs', action='store_true', help='DMRS graph')
     parser.add_argument('-r', '--root', help='Root')
     parser.add_argument('-i', '--informal', action='store_true', help='root_informal')
+    parser.add_argument('-s', '--sessions', type=int, default=1, help='Number of parallel ACE sessions')
     args = parser.parse_args()
 
-    ace = Ace(executable=args.executable, grammar=args.grammar, num_outputs=args.num_outputs, trees=args.trees, root=args.root, informal=args.informal)
+    ace = Ace(executable=args.executable, grammar=args.grammar, num_outputs=args.num_outputs, trees=args.trees, root=args.root, informal=args.informal, num_sessions=args.sessions)
 
     if sys.stdin.isatty():
 
@@ -5,8 +5,8 @@ import re
 from pydmrs.matching.exact_matching import dmrs_exact_matching
 from shapeworld.analyzers.ace import Ace
 from shapeworld.captions import Attribute, Relation, EntityType, Selector, Existential, Quantifier, NumberBound, ComparativeQuantifier, Proposition
-from shapeworld.realizers.dmrs.dmrs import Dmrs, SubDmrs, create_sortinfo
-from shapeworld.realizers.dmrs.realizer import prepare_ace, prepare_grammar
+from shapeworld.realizers.dmrs.dmrs import Pred, Dmrs, SubDmrs, create_sortinfo
+from shapeworld.realizers.dmrs.realizer import prepare_ace, prepare_grammar, related_preds
 
 
 int_regex = re.compile(pattern=r'^-?[0-9]+$')
@@ -28,16 +28,46 @@ def parse_string(string):
         return str(string)
 
 
+def memoized_analysis(analysis_fn):
+    # analyses of a subgraph only depend on its node set within the parsed graph, and are shared
+    # lazily between calls, yielding copies which refer to the original parsed graph
+    name = analysis_fn.__name__
+
+    def memoized_analysis_fn(self, dmrs):
+        if not self.memoize:
+            for analysis in analysis_fn(self, dmrs=dmrs):
+                yield analysis
+            return
+        root = dmrs
+        while isinstance(root, SubDmrs):
+            root = root.dmrs
+        key = (name, id(root), frozenset(node.nodeid for node in dmrs.iter_nodes()))
+        if key not in self.analysis_cache:
+            self.analysis_cache[key] = (list(), analysis_fn(self, dmrs=dmrs))
+        analyses, analysis_iter = self.analysis_cache[key]
+        n = 0
+        while True:
+            if n == len(analyses):
+                try:
+                    analyses.append(next(analysis_iter))
+                except StopIteration:
+                    return
+            yield copy.deepcopy(analyses[n], memo={id(root): root})
+            n += 1
+
+    return memoized_analysis_fn
+
+
 class DmrsAnalyzer(object):
 
-    def __init__(self, language):
+    def __init__(self, language, num_sessions=1, memoize=True):
         prepare_ace()
         prepare_grammar(language=language)
         directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'realizers', 'dmrs')
         self.ace_path = os.path.join(directory, 'resources', 'ace')
         self.erg_path = os.path.join(directory, 'languages', language + '.dat')
 
-        self.ace = Ace(executable=self.ace_path, grammar=self.erg_path)
+        self.ace = Ace(executable=self.ace_path, grammar=self.erg_path, num_sessions=num_sessions)
 
         with open(os.path.join(directory, 'languages', language + '.json'), 'r') as filehandle:
             language = json.load(fp=filehandle)
@@ -227,6 +257,74 @@ class DmrsAnalyzer(object):
             assert paraphrase['key'] not in self.pre_processing_by_key
             self.pre_processing_by_key[paraphrase['key']] = n
 
+        # templates by their unused key
+        templates = dict()
+        templates['attribute', 'relation'] = self.relation_attribute
+        for predtype in self.attributes:
+            for value in self.attributes[predtype]:
+                templates['attribute', predtype, value] = self.attributes[predtype][value]
+        templates[('type',)] = self.entity_type
+        templates['selector', 'unique'] = self.unique_selector
+        for predtype in self.selectors:
+            for value in self.selectors[predtype]:
+                templates['selector', predtype, value] = self.selectors[predtype][value]
+        templates['relation', 'attribute'] = self.attribute_relation
+        templates['relation', 'type'] = self.type_relation
+        for predtype in self.relations:
+            for value in self.relations[predtype]:
+                templates['relation', predtype, value] = self.relations[predtype][value]
+        templates['existential', 'type'] = self.type_existential
+        templates['existential', 'selector'] = self.selector_existential
+        for qtype in self.quantifiers:
+            for qrange in self.quantifiers[qtype]:
+                for quantity in self.quantifiers[qtype][qrange]:
+                    templates['quantifier', qtype, qrange, quantity] = self.quantifiers[qtype][qrange][quantity]
+        for bound in self.number_bounds:
+            templates['number-bound', bound] = self.number_bounds[bound]
+        for qtype in self.comparative_quantifiers:
+            for qrange in self.comparative_quantifiers[qtype]:
+                for quantity in self.comparative_quantifiers[qtype][qrange]:
+                    templates['comparative-quantifier', qtype, qrange, quantity] = self.comparative_quantifiers[qtype][qrange][quantity]
+        for connective in self.propositions:
+            templates['proposition', connective] = self.propositions[connective]
+
+        # pred index over templates: a template is only matched against graphs which contain, for each of
+        # its fully specified nodes, one of the candidate preds (conservatively up to hierarchy)
+        self.template_index = dict()
+        self.template_requirements = dict()
+        self.unindexed_templates = set()
+        for key, template in templates.items():
+            if template is None:
+                continue
+            elif not isinstance(template, Dmrs):
+                self.unindexed_templates.add(key)
+                continue
+            requirements = list()
+            for node in template.iter_nodes():
+                pred = str(node.pred)
+                if type(node.pred) is Pred or '?' in pred or pred in ('pred', 'node'):
+                    continue
+                requirements.append(related_preds(pred=pred, hierarchy=self.hierarchy))
+            if requirements:
+                self.template_requirements[key] = len(requirements)
+                for n, candidate_preds in enumerate(requirements):
+                    for pred in candidate_preds:
+                        self.template_index.setdefault(pred, list()).append((key, n))
+            else:
+                self.unindexed_templates.add(key)
+
+        self.memoize = memoize
+        self.analysis_cache = dict()
+
+    def candidate_templates(self, dmrs):
+        candidates = set(self.unindexed_templates)
+        satisfied = dict()
+        for pred in set(str(node.pred) for node in dmrs.iter_nodes()):
+            for key, n in self.template_index.get(pred, ()):
+                satisfied.setdefault(key, set()).add(n)
+        candidates.update(key for key, requirements in satisfied.items() if len(requirements) == self.template_requirements[key])
+        return candidates
+
     def analyze(self, sentences):
         captions = list()
         mrs_iter_iter = self.ace.parse(sentence_list=sentences)
@@ -249,6 +347,7 @@ class DmrsAnalyzer(object):
         return captions
 
     def analyze2(self, dmrs):
+        self.analysis_cache = dict()
         # print(dmrs.dumps_xml())
         for search, replace, disable_hierarchy, match_top_index in self.pre_processing:
             dmrs = dmrs.apply_paraphrases(paraphrases=[(search, replace)], hierarchy=(None if disable_hierarchy else self.hierarchy), match_top_index=match_top_index)
@@ -265,9 +364,11 @@ class DmrsAnalyzer(object):
             if len(matches) == 1 and len(caption_dmrs) == len(dmrs) and all(dmrs[matches[0][nodeid]].pred == caption_dmrs[nodeid].pred for nodeid in caption_dmrs):
                 yield caption
 
+    @memoized_analysis
     def attribute_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         # predtype: relation
-        matches = list(dmrs_exact_matching(sub_dmrs=self.relation_attribute, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        matches = list(dmrs_exact_matching(sub_dmrs=self.relation_attribute, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('attribute', 'relation') in candidates else ()
         for match in matches:
             # print('attribute > relation')
             relation_nodeid = match[self.relation_attribute.anchors['attr'].nodeid]
@@ -284,6 +385,8 @@ class DmrsAnalyzer(object):
         # predtype: *
         for predtype in self.attributes:
             for value in self.attributes[predtype]:
+                if ('attribute', predtype, value) not in candidates:
+                    continue
                 # print(predtype, value)
                 # print([str(node.pred) for node in self.attributes[predtype][value].iter_nodes()])
                 # print([str(node.pred) for node in dmrs.iter_nodes()])
@@ -295,8 +398,10 @@ class DmrsAnalyzer(object):
                     self.unused.discard(('attribute', predtype, value))
                     yield attribute, attribute_dmrs
 
+    @memoized_analysis
     def type_caption(self, dmrs):  # entity_ not if suffix
-        matches = list(dmrs_exact_matching(sub_dmrs=self.entity_type, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        candidates = self.candidate_templates(dmrs)
+        matches = list(dmrs_exact_matching(sub_dmrs=self.entity_type, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('type',) in candidates else ()
         for match in matches:
             # print('type > !')
             type_nodeid = match[self.entity_type.anchors['type'].nodeid]
@@ -331,9 +436,11 @@ class DmrsAnalyzer(object):
                 self.unused.discard(('type',))
                 yield entity_type, type_dmrs
 
+    @memoized_analysis
     def selector_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         # predtype: unique
-        matches = list(dmrs_exact_matching(sub_dmrs=self.unique_selector, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        matches = list(dmrs_exact_matching(sub_dmrs=self.unique_selector, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('selector', 'unique') in candidates else ()
         for match in matches:
             # print('selector > unique')
             unmatched_dmrs = SubDmrs(dmrs=dmrs)
@@ -349,6 +456,8 @@ class DmrsAnalyzer(object):
         # predtype: *
         for predtype in self.selectors:
             for value in self.selectors[predtype]:
+                if ('selector', predtype, value) not in candidates:
+                    continue
                 selector_dmrs = self.selectors[predtype][value]
                 matches = list(dmrs_exact_matching(sub_dmrs=selector_dmrs, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
                 for match in matches:
@@ -383,9 +492,11 @@ class DmrsAnalyzer(object):
                                 self.unused.discard(('selector', predtype, value))
                                 yield selector, scope_selector_dmrs
 
+    @memoized_analysis
     def relation_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         # predtype: attribute
-        matches = list(dmrs_exact_matching(sub_dmrs=self.attribute_relation, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        matches = list(dmrs_exact_matching(sub_dmrs=self.attribute_relation, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('relation', 'attribute') in candidates else ()
         for match in matches:
             # print('relation > attribute')
             relation_nodeid = match[self.attribute_relation.anchors['rel'].nodeid]
@@ -401,7 +512,7 @@ class DmrsAnalyzer(object):
                     yield relation, relation_dmrs
 
         # predtype: type
-        matches = list(dmrs_exact_matching(sub_dmrs=self.type_relation, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        matches = list(dmrs_exact_matching(sub_dmrs=self.type_relation, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('relation', 'type') in candidates else ()
         for match in matches:
             # print('relation > type')
             relation_nodeid = match[self.type_relation.anchors['rel'].nodeid]
@@ -419,6 +530,8 @@ class DmrsAnalyzer(object):
         # predtype: *
         for predtype in self.relations:
             for value in self.relations[predtype]:
+                if ('relation', predtype, value) not in candidates:
+                    continue
                 relation_dmrs = self.relations[predtype][value]
                 matches = list(dmrs_exact_matching(sub_dmrs=relation_dmrs, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
                 for match in matches:
@@ -468,8 +581,10 @@ class DmrsAnalyzer(object):
                                 self.unused.discard(('relation', predtype, value))
                                 yield relation, ref_relation_dmrs
 
+    @memoized_analysis
     def existential_caption(self, dmrs):
-        matches = list(dmrs_exact_matching(sub_dmrs=self.type_existential, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        candidates = self.candidate_templates(dmrs)
+        matches = list(dmrs_exact_matching(sub_dmrs=self.type_existential, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('existential', 'type') in candidates else ()
         for match in matches:
             # print('existential type > restrictor')
             restrictor_nodeid = match[self.type_existential.anchors['rstr'].nodeid]
@@ -493,7 +608,7 @@ class DmrsAnalyzer(object):
                                 self.unused.discard(('existential', 'type'))
                                 yield existential, body_existential_dmrs
 
-        matches = list(dmrs_exact_matching(sub_dmrs=self.selector_existential, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
+        matches = list(dmrs_exact_matching(sub_dmrs=self.selector_existential, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False)) if ('existential', 'selector') in candidates else ()
         for match in matches:
             # print('existential selector > restrictor')
             restrictor_nodeid = match[self.selector_existential.anchors['rstr'].nodeid]
@@ -517,10 +632,14 @@ class DmrsAnalyzer(object):
                                 self.unused.discard(('existential', 'selector'))
                                 yield existential, body_existential_dmrs
 
+    @memoized_analysis
     def quantifier_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         for qtype in self.quantifiers:
             for qrange in self.quantifiers[qtype]:
                 for quantity in self.quantifiers[qtype][qrange]:
+                    if ('quantifier', qtype, qrange, quantity) not in candidates:
+                        continue
                     # if any(str(node.pred) == '_at+least_x_deg' for node in dmrs.iter_nodes()) and any(str(node.pred) == '_quarter_n_of' for node in dmrs.iter_nodes()) and any(str(node.pred) == '_at+least_x_deg' for node in self.quantifiers[qtype][qrange][quantity].iter_nodes()):
                     #     print([str(node) for node in dmrs.iter_nodes()])
                     #     print([str(node) for node in self.quantifiers[qtype][qrange][quantity].iter_nodes()])
@@ -550,10 +669,14 @@ class DmrsAnalyzer(object):
                                         self.unused.discard(('quantifier', qtype, qrange, quantity))
                                         yield quantifier, body_quantifier_dmrs
 
+    @memoized_analysis
     def number_bound_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         for qtype in self.quantifiers:
             for qrange in self.quantifiers[qtype]:
                 for quantity in self.quantifiers[qtype][qrange]:
+                    if ('quantifier', qtype, qrange, quantity) not in candidates:
+                        continue
                     quantifier_dmrs = self.quantifiers[qtype][qrange][quantity]
                     matches = list(dmrs_exact_matching(sub_dmrs=quantifier_dmrs, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
                     for match in matches:
@@ -562,6 +685,8 @@ class DmrsAnalyzer(object):
                         body_nodeid = match[quantifier_dmrs.anchors['body'].nodeid]
                         unmatched_dmrs = dmrs.subgraph(nodeid=restrictor_nodeid, exclude=(body_nodeid,))  # dmrs.index.nodeid, dmrs.top.nodeid
                         for bound in self.number_bounds:
+                            if ('number-bound', bound) not in candidates:
+                                continue
                             bound_dmrs = self.number_bounds[bound]
                             matches = list(dmrs_exact_matching(sub_dmrs=bound_dmrs, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
                             for match in matches:
@@ -589,10 +714,14 @@ class DmrsAnalyzer(object):
                                                 self.unused.discard(('number-bound', bound))
                                                 yield number_bound, body_quantifier_dmrs
 
+    @memoized_analysis
     def comparative_quantifier_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         for qtype in self.comparative_quantifiers:
             for qrange in self.comparative_quantifiers[qtype]:
                 for quantity in self.comparative_quantifiers[qtype][qrange]:
+                    if ('comparative-quantifier', qtype, qrange, quantity) not in candidates:
+                        continue
                     quantifier_dmrs = self.comparative_quantifiers[qtype][qrange][quantity]
                     matches = list(dmrs_exact_matching(sub_dmrs=quantifier_dmrs, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
                     for match in matches:
@@ -630,10 +759,14 @@ class DmrsAnalyzer(object):
                                                         self.unused.discard(('comparative-quantifier', qtype, qrange, quantity))
                                                         yield comparative_quantifier, body_quantifier_dmrs
 
+    @memoized_analysis
     def proposition_caption(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         for proptype in self.propositions:
             if proptype in ('attribute', 'type', 'selector', 'relation', 'existential', 'quantifier', 'number-bound', 'comparative-quantifier'):
                 continue
+            elif ('proposition', proptype) not in candidates:
+                continue
             proposition_dmrs = self.propositions[proptype]
             matches = list(dmrs_exact_matching(sub_dmrs=proposition_dmrs, dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
@@ -659,10 +792,12 @@ class DmrsAnalyzer(object):
                                 self.unused.discard(('proposition', proptype))
                                 yield proposition, arg2_proposition_dmrs
 
+    @memoized_analysis
     def caption_with_dmrs(self, dmrs):
+        candidates = self.candidate_templates(dmrs)
         yield from self.proposition_caption(dmrs=dmrs)
 
-        if 'comparative-quantifier' in self.propositions:
+        if ('proposition', 'comparative-quantifier') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['comparative-quantifier'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > comparative-quantifier')
@@ -676,7 +811,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'comparative-quantifier'))
                         yield comparative_quantifier, caption_dmrs
 
-        if 'number-bound' in self.propositions:
+        if ('proposition', 'number-bound') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['number-bound'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > number-bound')
@@ -690,7 +825,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'number-bound'))
                         yield number_bound, caption_dmrs
 
-        if 'quantifier' in self.propositions:
+        if ('proposition', 'quantifier') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['quantifier'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > quantifier')
@@ -704,7 +839,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'quantifier'))
                         yield quantifier, caption_dmrs
 
-        if 'existential' in self.propositions:
+        if ('proposition', 'existential') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['existential'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > existential')
@@ -718,7 +853,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'existential'))
                         yield existential, caption_dmrs
 
-        if 'relation' in self.propositions:
+        if ('proposition', 'relation') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['relation'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > relation')
@@ -732,7 +867,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'relation'))
                         yield relation, caption_dmrs
 
-        if 'selector' in self.propositions:
+        if ('proposition', 'selector') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['selector'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > selector')
@@ -746,7 +881,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'selector'))
                         yield selector, caption_dmrs
 
-        if 'type' in self.propositions:
+        if ('proposition', 'type') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['type'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > type')
@@ -760,7 +895,7 @@ class DmrsAnalyzer(object):
                         self.unused.discard(('proposition', 'type'))
                         yield entity_type, caption_dmrs
 
-        if 'attribute' in self.propositions:
+        if ('proposition', 'attribute') in candidates:
             matches = list(dmrs_exact_matching(sub_dmrs=self.propositions['attribute'], dmrs=dmrs, hierarchy=self.hierarchy, match_top_index=False))
             for match in matches:
                 # print('caption > attribute')
@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 from shapeworld.analyzers.mrs import Reference, Variable, ElemPred, Mrs
 
@@ -12,100 +13,101 @@ sys.path.insert(1, directory)
 from pydmrs.components import Pred, GPred, RealPred, Sortinfo, EventSortinfo, InstanceSortinfo
 
 
-def find_next(string, start=None, end=None, whitespace=False):
-    if start is None or start < 0:
-        start = 0
-    if end is None or end < 0:
-        end = len(string)
-    for i in range(start, end):
-        if (string[i] == ' ') is whitespace:
-            return i
-    return -1
-
-
-def find_previous(string, start=None, end=None, whitespace=False):
-    if start is None or start < 0:
-        start = 0
-    if end is None or end < 0:
-        end = len(string)
-    for i in range(end-1, start-1, -1):
-        if (string[i] == ' ') is whitespace:
-            return i
-    return -1
-
-
-bracket_mapping = {'(': ')', '[': ']', '{': '}', '<': '>', '"': '"', '\'': '\'', '`': '\''}  # , '“': '”'}
-quote_brackets = '"\'`'  # “'
-
-
-# robust quote
-def find_substring(string, substring, start=None, end=None, exclude_brackets='', exclude_quotes='', allow_escape=False):
-    if start is None or start < 0:
-        start = 0
-    if end is None or end < 0:
-        end = len(string)
-    assert all(b in bracket_mapping for b in exclude_brackets), 'Invalid excluded bracket type.'
-    assert all(b in quote_brackets for b in exclude_quotes), 'Invalid excluded quote type.'
-    opening_brackets = ''.join(b for b in bracket_mapping if b not in exclude_brackets)
-    closing_brackets = ''.join(b2 for b1, b2 in bracket_mapping.items() if b1 not in exclude_brackets)
-    opening_quotes = ''.join(q for q in quote_brackets if q not in exclude_quotes)
-    #closing_quotes = ''.join(bracket_mappinq for q in quote_brackets if q not in exclude_quotes)
-    length = len(substring)
-    brackets = []
-    quote = False
-    escape = False
-    for i in range(start, end - length + 1):
-        if escape:
-            escape = string[i] == '\\'
-        else:
-            if not brackets and string[i:i+length] == substring:
-                return i
-            elif brackets and string[i] == brackets[-1]:
-                brackets.pop()
-                if quote:
-                    quote = False
-            elif not quote and string[i] in opening_brackets:
-                brackets.append(bracket_mapping[string[i]])
-                if string[i] in opening_quotes:
-                    quote = True
-            elif not quote and string[i] in closing_brackets:
-                assert False, '{}::   {}'.format(string[i-10:i+11], string[start:end])
-            elif allow_escape and string[i] == '\\':
-                escape = True
-    return -1
-
+# values are (symbol, None) or (symbol, (sort, properties)), cargs are kept as raw strings
+mrs_token_regex = re.compile(r'"(?:[^"\\]|\\.)*"|<-?[0-9]+:-?[0-9]+>|<>|[\[\]<>]|[^\s\[\]<>"]+')
 
-# ('vice+versa',
 
+def _tokenize_value(tokens, n, lower=True):
+    symbol = tokens[n].lower() if lower else tokens[n]
+    n += 1
+    if tokens[n] != '[':
+        return (symbol, None), n
+    sort = tokens[n+1].lower()
+    n += 2
+    properties = dict()
+    while tokens[n] != ']':
+        assert tokens[n][-1] == ':'
+        properties[tokens[n][:-1].lower()] = tokens[n+1].lower()
+        n += 2
+    return (symbol, (sort, properties)), n + 1
 
 
-def _read_attributes(string, not_lower=(), keys=()):
+def _tokenize_attributes(tokens, n, end):
     attributes = dict()
-    l = 0
-    r = find_substring(string, ':', start=l)
-    while r != -1:
-        l = find_next(string, start=l)
-        key = string[l:r].lower()
-        assert not keys or key in keys
-        l = find_next(string, start=r+1)
-        r = find_substring(string, ':', start=l)
-        if r == -1:
-            m = -1
+    while tokens[n] != end:
+        assert tokens[n][-1] == ':'
+        key = tokens[n][:-1].lower()
+        if key == 'carg':
+            attributes[key] = tokens[n+1]
+            n += 2
         else:
-            m = find_previous(string, start=l, end=r, whitespace=True)
-        m = find_previous(string, start=l, end=m) + 1
-        value = string[l:m]
-        attributes[key] = value if key in not_lower else value.lower()
-        l = m
-    return attributes
+            attributes[key], n = _tokenize_value(tokens, n + 1)
+    return attributes, n
+
+
+def _tokenize_list(tokens, n):
+    # flat list of symbols, variable properties are skipped
+    if tokens[n] == '<>':
+        return [], n + 1
+    assert tokens[n] == '<'
+    n += 1
+    values = []
+    while tokens[n] != '>':
+        if tokens[n] == '[':
+            n = tokens.index(']', n)
+        else:
+            values.append(tokens[n])
+        n += 1
+    return values, n + 1
+
+
+def _tokenize_mrs(string):
+    tokens = mrs_token_regex.findall(string)
+    assert tokens[0] == '[' and tokens[-1] == ']'
+    attributes, n = _tokenize_attributes(tokens, 1, 'RELS:')
+    eps = []
+    n += 1
+    if tokens[n] == '<':
+        n += 1
+        while tokens[n] != '>':
+            assert tokens[n] == '['
+            pred = tokens[n+1]
+            n += 2
+            if tokens[n] == '<>':
+                cfrom = None
+                cto = None
+                n += 1
+            elif tokens[n][0] == '<':
+                c = tokens[n].index(':')
+                cfrom = int(tokens[n][1:c])
+                cto = int(tokens[n][c+1:-1])
+                n += 1
+            else:
+                cfrom = None
+                cto = None
+            ep_attributes, n = _tokenize_attributes(tokens, n, ']')
+            eps.append((pred, cfrom, cto, ep_attributes))
+            n += 1
+    else:
+        assert tokens[n] == '<>'
+    n += 1
+    assert tokens[n] == 'HCONS:'
+    hcons, n = _tokenize_list(tokens, n + 1)
+    if tokens[n] == 'ICONS:':
+        icons, n = _tokenize_list(tokens, n + 1)
+    else:
+        icons = None
+    assert n == len(tokens) - 1
+    return attributes, eps, hcons, icons
 
 
-def _read_reference(string, vs, rs, replace=True):
-    if '[' in string:
-        ref, var = _read_variable(string, vs, rs, replace=replace)
+def _read_reference(value, vs, rs, replace=True):
+    if value[1] is not None:
+        ref, var = _read_variable(value, vs, rs, replace=replace)
         if var is not None:
             vs[ref] = var
         return ref
+    string = value[0]
     assert string[0] in 'hexipu' and string[1:].isdigit()
     index = int(string[1:])
     ref = Reference(string[0], index)
@@ -114,9 +116,9 @@ def _read_reference(string, vs, rs, replace=True):
     return ref
 
 
-def _read_variable(string, vs, rs, replace=True):
-    if '[' not in string:
-        ref = _read_reference(string, vs, rs, replace=replace)
+def _read_variable(value, vs, rs, replace=True):
+    if value[1] is None:
+        ref = _read_reference(value, vs, rs, replace=replace)
         if replace:
             ref = rs.get(ref, ref)
         if ref in vs:
@@ -128,16 +130,12 @@ def _read_variable(string, vs, rs, replace=True):
         else:
             return ref, Variable(ref, Sortinfo())
 
-    assert string[-1] == ']'
-    r = string.index('[')
-    ref = _read_reference(string[:find_previous(string, end=r)+1], vs, rs, replace=replace)
+    sort, attributes = value[1]
+    ref = _read_reference((value[0], None), vs, rs, replace=replace)
     if replace:
         ref = rs.get(ref, ref)
-    l = find_next(string, start=r+1)
-    assert replace or string[l] == ref.sort
-    l = find_next(string, start=l+1)
-    r = find_previous(string, end=len(string)-1) + 1
-    attributes = _read_attributes(string[l:r])
+    assert replace or sort == ref.sort
+    attributes = dict(attributes)
     if 'prontype' in attributes:
         assert 'pt' not in attributes
         attributes['pt'] = attributes.pop('prontype')
@@ -187,14 +185,12 @@ def _read_variable(string, vs, rs, replace=True):
     return ref, var
 
 
-def _get_reference_replacements(string):
+def _get_reference_replacements(attributes, eps):
     vs = {}
     rs = {}
     references = set()
-    l = find_next(string, start=1)
-    r = string.index('RELS:', l)
-    r = find_previous(string, start=l, end=r)
-    args = _read_attributes(string[l:r+1])
+    index_ref = None
+    args = dict(attributes)
     if 'top' in args:
         references.add(_read_reference(args.pop('top'), vs, rs, replace=False))
     if 'ltop' in args:
@@ -202,23 +198,9 @@ def _get_reference_replacements(string):
     if 'index' in args:
         index_ref = _read_reference(args.pop('index'), vs, rs, replace=False)
         references.add(index_ref)
-    l = string.index('RELS:', r)
-    l_ep = string.index('<', l)
-    r_ep = find_substring(string, '>', start=l_ep+1)
-
-    while l_ep < r_ep:
-        l = string.index('[', l_ep)
-        r = find_substring(string, ']', start=l+1) + 1
-        l_ep = find_next(string, start=r)
-
-        m = string.find('<', l, r_ep)
-        if m >= 0:
-            m = string.index('>', m, r_ep)
-        else:
-            m = string.index(' ', l)
-        l = find_next(string, start=m+1, whitespace=True)
-        r = find_previous(string, start=l, end=r-1) + 1
-        args = _read_attributes(string[l:r], not_lower=('carg',))
+
+    for _, _, _, args in eps:
+        args = dict(args)
         args.pop('carg', None)
         references.add(_read_reference(args.pop('lbl'), vs, rs, replace=False))
         intrinsic, _ = _read_variable(args.pop('arg0'), vs, rs, replace=False)
@@ -236,42 +218,25 @@ def _get_reference_replacements(string):
     return rs
 
 
-def _read_elempred(string, vs, rs):
-    assert string[0] == '[' and string[-1] == ']'
-    l = 1
-    while string[l] == ' ':
-        l += 1
-    m = string.find('<', l)
-    if m >= 0:
-        r = string.index('>', m)
-        c = string.find(':', m, r)
-        if c >= 0:
-            cfrom = int(string[m+1:c])
-            cto = int(string[c+1:r])
-        else:
-            assert m + 1 == r
-            cfrom = None
-            cto = None
-    else:
-        m = r = string.index(' ', l)
-        cfrom = None
-        cto = None
-    if string[m-15:m] == '_u_unknown_rel"':
-        assert string[l:l+2] == '"_'
-        slash = string.index('/', l + 2, m - 15)
+def _read_pred(string):
+    if string[-15:] == '_u_unknown_rel"':
+        assert string[:2] == '"_'
+        slash = string.index('/', 2, len(string) - 15)
         pos = {'FW': 'u', 'JJ': 'a', 'NN': 'n', 'NNS': 'n', 'RB': 'a', 'VB': 'v', 'VBP': 'v', 'VBG': 'v', 'VBN': 'v'}  # ?????????????????????????????????????
-        assert string[slash+1:m-15] in pos, 'Invalid unknown word POS: {}'.format(string[slash+1:m-15])
-        pred = Pred.from_string(string[l+1:slash] + '_' + pos[string[slash+1:m-15]] + string[m-13:m-1])
+        assert string[slash+1:-15] in pos, 'Invalid unknown word POS: {}'.format(string[slash+1:-15])
+        return Pred.from_string(string[1:slash] + '_' + pos[string[slash+1:-15]] + string[-13:-1])
+    assert string.islower()
+    if string[0] == '"':
+        assert string[-1] == '"'
+        return Pred.from_string(string[1:-1])
     else:
-        assert string[l:m].islower()
-        if string[l] == '"':
-            assert string[m-1] == '"'
-            pred = Pred.from_string(string[l+1:m-1])
-        else:
-            pred = Pred.from_string(string[l:m])
-    l = find_next(string, start=r+1)
-    r = find_previous(string, start=l, end=len(string)-1) + 1
-    attributes = _read_attributes(string[l:r], not_lower=('carg',))
+        return Pred.from_string(string)
+
+
+def _read_elempred(ep, vs, rs):
+    pred, cfrom, cto, attributes = ep
+    pred = _read_pred(pred)
+    attributes = dict(attributes)
     label = _read_reference(attributes.pop('lbl'), vs, rs)
     carg = attributes.pop('carg', None)
     assert (carg is not None) == (isinstance(pred, GPred) and pred.name in ('basic_card', 'basic_numbered_hour', 'card', 'dofm', 'dofw', 'mofy', 'named', 'named_n', 'numbered_hour', 'ord', 'season', 'year_range', 'yofc')), (carg, pred)  # gpreds with CARG
@@ -365,18 +330,13 @@ def _read_elempred(string, vs, rs):
 
 
 def read_mrs(string):
+    attributes, eps, hcons, icons = _tokenize_mrs(string)
     mrs = Mrs()
     icon_labels = {}
-    assert string[0] == '[' and string[-1] == ']'
-    assert 'RELS:' in string and 'HCONS:' in string and string.index('RELS:') < string.index('HCONS:') and ('ICONS:' not in string or string.index('HCONS:') < string.index('ICONS:'))
     # var check
-    rs = _get_reference_replacements(string)
+    rs = _get_reference_replacements(attributes, eps)
     vs = {}
-    l = find_next(string, 1)
-    r = string.index('RELS:', l)
-    while string[r-1] == ' ':
-        r -= 1
-    attributes = _read_attributes(string[l:r])
+    attributes = dict(attributes)
     if 'top' in attributes:
         mrs.top_handle = _read_reference(attributes.pop('top'), vs, rs)
         assert mrs.top_handle.is_handle()
@@ -387,18 +347,8 @@ def read_mrs(string):
         mrs.index_ref = _read_reference(attributes.pop('index'), vs, rs)
         assert mrs.index_ref.is_event()
     assert not attributes
-    l = string.index('RELS:', r) + 6
-    l = string.index('<', l) + 2
-    r = find_substring(string, '>', l)
-    while '[' in string[l:r]:
-        l = string.index('[', l)
-        bracket = string.find('[', l + 1)
-        m = string.index(']', l) + 1
-        while bracket != -1 and bracket < m:
-            bracket = string.find('[', m + 1)
-            m = string.index(']', m + 1) + 1
-        ep, var = _read_elempred(string[l:m], vs, rs)
-        l = m
+    for ep in eps:
+        ep, var = _read_elempred(ep, vs, rs)
         if isinstance(ep.pred, GPred) and ep.pred.name[-2:] == '_d':
             assert ep.intrinsic.is_event() and var.sortinfo.sf == 'prop'
             # and len(var.sortinfo) == 2) or (var.sortinfo.sf == 'prop' and var.sortinfo.tense == 'untensed' and var.sortinfo.mood == 'indicative' and len(var.sortinfo) == 4))  # untensed the same as None
@@ -411,38 +361,20 @@ def read_mrs(string):
             mrs.add_node(ep)
     # for old_ref, new_ref in rs.items():
     #     mrs.change_ref(old_ref, new_ref)
-    l = r + 2
-
-    l = string.index('HCONS:', l) + 7
-    l = string.index('<', l) + 2
-    r = string.index('>', l)
-    values = string[l:r].split()
-    assert len(values) % 3 == 0
-    for hole, label in ((_read_reference(values[3*n], vs, rs), _read_reference(values[3*n+2], vs, rs)) for n in range(len(values) // 3)):
+
+    assert len(hcons) % 3 == 0
+    for hole, label in ((_read_reference((hcons[3*n], None), vs, rs), _read_reference((hcons[3*n+2], None), vs, rs)) for n in range(len(hcons) // 3)):
         if label in icon_labels:
             ref1, icon, ref2 = icon_labels.pop(label)
             mrs.add_icon(ref1, icon, ref2)
             mrs.add_hcon(hole, label, icon_label=True)
         else:
             mrs.add_hcon(hole, label)
-    l = r + 1
 
-    if 'ICONS:' in string[l:]:
+    if icons is not None:
         assert not icon_labels
-        l = find_substring(string, '<', l) + 1
-        assert l >= 0
-        r = find_substring(string, '>', l)
-        assert r >= 0
-        m = find_substring(string, '[', l, r)
-        while m >= 0:
-            m2 = find_substring(string, ']', m+1)
-            assert m2 >= 0
-            string = string[:m] + string[m2+1:]
-            r -= m2 - m + 1
-            m = find_substring(string, '[', l, r)
-        values = string[l:r].split()
-        assert len(values) % 3 == 0
-        for ref1, icon, ref2 in ((_read_reference(values[3*n], vs, rs), values[3*n+1], _read_reference(values[3*n+2], vs, rs)) for n in range(len(values) // 3)):
+        assert len(icons) % 3 == 0
+        for ref1, icon, ref2 in ((_read_reference((icons[3*n], None), vs, rs), icons[3*n+1], _read_reference((icons[3*n+2], None), vs, rs)) for n in range(len(icons) // 3)):
             mrs.add_icon(ref1, icon, ref2)
     # assert not vs, 'Invalid instantiated variables: {}'.format(vs)
 
@@ -465,3 +397,4 @@ def read_mrs(string):
     # assert not vs
     assert mrs.valid()
     return mrs
+
@@ -0,0 +1,207 @@
+import argparse
+import sys
+import time
+from shapeworld.analyzers.mrs_load import _tokenize_mrs, read_mrs
+
+
+# character-level scanner of the original MRS loader, kept as baseline for the tokenizer in mrs_load
+
+
+def find_next(string, start=None, end=None, whitespace=False):
+    if start is None or start < 0:
+        start = 0
+    if end is None or end < 0:
+        end = len(string)
+    for i in range(start, end):
+        if (string[i] == ' ') is whitespace:
+            return i
+    return -1
+
+
+def find_previous(string, start=None, end=None, whitespace=False):
+    if start is None or start < 0:
+        start = 0
+    if end is None or end < 0:
+        end = len(string)
+    for i in range(end-1, start-1, -1):
+        if (string[i] == ' ') is whitespace:
+            return i
+    return -1
+
+
+bracket_mapping = {'(': ')', '[': ']', '{': '}', '<': '>', '"': '"', '\'': '\'', '`': '\''}  # , '“': '”'}
+quote_brackets = '"\'`'  # “'
+
+
+# robust quote
+def find_substring(string, substring, start=None, end=None, exclude_brackets='', exclude_quotes='', allow_escape=False):
+    if start is None or start < 0:
+        start = 0
+    if end is None or end < 0:
+        end = len(string)
+    assert all(b in bracket_mapping for b in exclude_brackets), 'Invalid excluded bracket type.'
+    assert all(b in quote_brackets for b in exclude_quotes), 'Invalid excluded quote type.'
+    opening_brackets = ''.join(b for b in bracket_mapping if b not in exclude_brackets)
+    closing_brackets = ''.join(b2 for b1, b2 in bracket_mapping.items() if b1 not in exclude_brackets)
+    opening_quotes = ''.join(q for q in quote_brackets if q not in exclude_quotes)
+    #closing_quotes = ''.join(bracket_mappinq for q in quote_brackets if q not in exclude_quotes)
+    length = len(substring)
+    brackets = []
+    quote = False
+    escape = False
+    for i in range(start, end - length + 1):
+        if escape:
+            escape = string[i] == '\\'
+        else:
+            if not brackets and string[i:i+length] == substring:
+                return i
+            elif brackets and string[i] == brackets[-1]:
+                brackets.pop()
+                if quote:
+                    quote = False
+            elif not quote and string[i] in opening_brackets:
+                brackets.append(bracket_mapping[string[i]])
+                if string[i] in opening_quotes:
+                    quote = True
+            elif not quote and string[i] in closing_brackets:
+                assert False, '{}::   {}'.format(string[i-10:i+11], string[start:end])
+            elif allow_escape and string[i] == '\\':
+                escape = True
+    return -1
+
+
+def _read_attributes(string, not_lower=(), keys=()):
+    attributes = dict()
+    l = 0
+    r = find_substring(string, ':', start=l)
+    while r != -1:
+        l = find_next(string, start=l)
+        key = string[l:r].lower()
+        assert not keys or key in keys
+        l = find_next(string, start=r+1)
+        r = find_substring(string, ':', start=l)
+        if r == -1:
+            m = -1
+        else:
+            m = find_previous(string, start=l, end=r, whitespace=True)
+        m = find_previous(string, start=l, end=m) + 1
+        value = string[l:m]
+        attributes[key] = value if key in not_lower else value.lower()
+        l = m
+    return attributes
+
+
+
+def _scan_value(string):
+    if '[' not in string:
+        return string, None
+    assert string[-1] == ']'
+    r = string.index('[')
+    symbol = string[:find_previous(string, end=r)+1]
+    l = find_next(string, start=r+1)
+    sort = string[l]
+    l = find_next(string, start=l+1)
+    r = find_previous(string, end=len(string)-1) + 1
+    return symbol, (sort, _read_attributes(string[l:r]))
+
+
+def _scan_elempred(string):
+    assert string[0] == '[' and string[-1] == ']'
+    l = 1
+    while string[l] == ' ':
+        l += 1
+    m = string.find('<', l)
+    if m >= 0:
+        r = string.index('>', m)
+        c = string.find(':', m, r)
+        if c >= 0:
+            cfrom = int(string[m+1:c])
+            cto = int(string[c+1:r])
+        else:
+            assert m + 1 == r
+            cfrom = None
+            cto = None
+    else:
+        m = r = string.index(' ', l)
+        cfrom = None
+        cto = None
+    pred = string[l:m]
+    l = find_next(string, start=r+1)
+    r = find_previous(string, start=l, end=len(string)-1) + 1
+    attributes = _read_attributes(string[l:r], not_lower=('carg',))
+    attributes = {key: (value if key == 'carg' else _scan_value(value)) for key, value in attributes.items()}
+    return pred, cfrom, cto, attributes
+
+
+def _scan_mrs(string):
+    assert string[0] == '[' and string[-1] == ']'
+    assert 'RELS:' in string and 'HCONS:' in string and string.index('RELS:') < string.index('HCONS:') and ('ICONS:' not in string or string.index('HCONS:') < string.index('ICONS:'))
+    l = find_next(string, 1)
+    r = string.index('RELS:', l)
+    while string[r-1] == ' ':
+        r -= 1
+    attributes = {key: _scan_value(value) for key, value in _read_attributes(string[l:r]).items()}
+    eps = []
+    l = string.index('RELS:', r) + 6
+    l = string.index('<', l) + 2
+    r = find_substring(string, '>', l)
+    while '[' in string[l:r]:
+        l = string.index('[', l)
+        bracket = string.find('[', l + 1)
+        m = string.index(']', l) + 1
+        while bracket != -1 and bracket < m:
+            bracket = string.find('[', m + 1)
+            m = string.index(']', m + 1) + 1
+        eps.append(_scan_elempred(string[l:m]))
+        l = m
+    l = r + 2
+
+    l = string.index('HCONS:', l) + 7
+    l = string.index('<', l) + 2
+    r = string.index('>', l)
+    hcons = string[l:r].split()
+    l = r + 1
+
+    if 'ICONS:' in string[l:]:
+        l = find_substring(string, '<', l) + 1
+        assert l >= 0
+        r = find_substring(string, '>', l)
+        assert r >= 0
+        m = find_substring(string, '[', l, r)
+        while m >= 0:
+            m2 = find_substring(string, ']', m+1)
+            assert m2 >= 0
+            string = string[:m] + string[m2+1:]
+            r -= m2 - m + 1
+            m = find_substring(string, '[', l, r)
+        icons = string[l:r].split()
+    else:
+        icons = None
+    return attributes, eps, hcons, icons
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='MRS reader benchmark')
+    parser.add_argument('corpus', help='File of captured ACE outputs, one MRS per line')
+    parser.add_argument('-r', '--repeats', type=int, default=3, help='Number of passes over the corpus')
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r') as filehandle:
+        strings = [line.strip() for line in filehandle if line.lstrip().startswith('[')]
+    sys.stdout.write('{} MRS strings\n'.format(len(strings)))
+
+    for n, string in enumerate(strings):
+        scanned = _scan_mrs(string)
+        tokenized = _tokenize_mrs(string)
+        assert scanned == tokenized, 'Readers disagree on MRS {}:\n{}\n{}\n{}'.format(n, string, scanned, tokenized)
+
+    # scanning only, and full reading into Mrs objects which additionally resolves variables and predicates
+    for name, read in (('scanner', _scan_mrs), ('tokenizer', _tokenize_mrs), ('read_mrs', read_mrs)):
+        times = []
+        for _ in range(args.repeats):
+            start = time.time()
+            for string in strings:
+                read(string)
+            times.append(time.time() - start)
+        sys.stdout.write('{}: {:.3f}s per pass ({:.1f} MRS/s)\n'.format(name, min(times), len(strings) / max(min(times), 1e-9)))
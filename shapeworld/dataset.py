@@ -1,18 +1,65 @@
+from bisect import bisect_right
+import bz2
+from collections import OrderedDict
 from importlib import import_module
 from io import BytesIO
 import json
 from math import ceil, sqrt
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
-from random import random, randrange
+from random import random, randrange, seed
+from time import time
+import traceback
+import zlib
+try:
+    from queue import Empty, Full
+except ImportError:
+    from Queue import Empty, Full
+try:
+    import lzma
+except ImportError:
+    lzma = None
 import numpy as np
 from PIL import Image
 from shapeworld import util
 
 
+chunk_compressions = dict(zlib=(zlib.compress, zlib.decompress), bz2=(bz2.compress, bz2.decompress))
+if lzma is not None:
+    chunk_compressions['lzma'] = (lzma.compress, lzma.decompress)
+
+
+def convert_world(world, dtype):
+    # float worlds take values in [0.0, 1.0], uint8 worlds in [0, 255]
+    if world.dtype == dtype:
+        return world
+    elif dtype == 'uint8':
+        return np.rint(world * 255.0).astype(dtype=np.uint8)
+    elif world.dtype == np.uint8:
+        return (world.astype(dtype=np.float32) / 255.0).astype(dtype=dtype, copy=False)
+    else:
+        return world.astype(dtype=dtype)
+
+
+def encode_image(world_array, image_format, compress_level=None):
+    from shapeworld.world import World
+    image = World.get_image(world_array=world_array)
+    image_bytes = BytesIO()
+    if image_format == 'png' and compress_level is not None:
+        image.save(image_bytes, format=image_format, compress_level=compress_level)
+    else:
+        image.save(image_bytes, format=image_format)
+    value = image_bytes.getvalue()
+    image_bytes.close()
+    return value
+
+
 class Dataset(object):
 
-    def __init__(self, values, world_size, pixel_noise_stddev=None, vectors=None, vocabularies=None, language=None):
+    def __init__(self, values, world_size, pixel_noise_stddev=None, vectors=None, vocabularies=None, language=None, world_dtype='float32'):
         assert self.type and self.name
+        assert world_dtype in ('float32', 'float16', 'uint8')
         assert all(value_name != 'alternatives' or value_type == 'int' for value_name, value_type in values.items())
         self.values = values
         if isinstance(world_size, int):
@@ -20,6 +67,7 @@ class Dataset(object):
         else:
             self.world_size = tuple(world_size)
         self.pixel_noise_stddev = pixel_noise_stddev
+        self.world_dtype = world_dtype
         self.vectors = {value_name: shape if isinstance(shape, int) else tuple(shape) for value_name, shape in vectors.items()}
         self.vocabularies = dict()
         if vocabularies is not None:
@@ -254,6 +302,8 @@ class Dataset(object):
             specification['vocabularies'] = self.vocabularies
         if self.language:
             specification['language'] = self.language
+        if self.world_dtype != 'float32':
+            specification['world_dtype'] = self.world_dtype
         return specification
 
     def world_shape(self):
@@ -305,16 +355,38 @@ class Dataset(object):
             assert False
 
     def apply_pixel_noise(self, world):
+        # in place for a world or a batch of worlds, then converted to the world dtype
+        if isinstance(world, list):
+            return [self.apply_pixel_noise(world=w) for w in world]
         if self.pixel_noise_stddev is not None and self.pixel_noise_stddev > 0.0:
-            noise = np.random.normal(loc=0.0, scale=self.pixel_noise_stddev, size=world.shape)
-            mask = (noise < -2.0 * self.pixel_noise_stddev) + (noise > 2.0 * self.pixel_noise_stddev)
-            while np.any(a=mask):
-                noise -= mask * noise
-                noise += mask * np.random.normal(loc=0.0, scale=self.pixel_noise_stddev, size=world.shape)
-                mask = (noise < -2.0 * self.pixel_noise_stddev) + (noise > 2.0 * self.pixel_noise_stddev)
+            world = convert_world(world=world, dtype='float32')
+            # truncated normal noise within two standard deviations, only out-of-range values are redrawn
+            generator = get_numpy_generator()
+            noise = generator.standard_normal(size=world.shape, dtype=np.float32)
+            flat_noise = noise.reshape(-1)
+            resample = np.flatnonzero(np.abs(flat_noise) > 2.0)
+            while resample.size > 0:
+                values = generator.standard_normal(size=resample.size, dtype=np.float32)
+                flat_noise[resample] = values
+                resample = resample[np.abs(values) > 2.0]
+            noise *= self.pixel_noise_stddev
             world += noise
             np.clip(world, a_min=0.0, a_max=1.0, out=world)
-        return world
+        return convert_world(world=world, dtype=self.world_dtype)
+
+    def float_worlds(self, batch):
+        # compact worlds are only converted to float when fed to a model
+        if self.world_dtype == 'float32':
+            return batch
+        batch = dict(batch)
+        for value_name, value_type in self.values.items():
+            value_type, alts = util.alternatives_type(value_type=value_type)
+            if value_type == 'world' and value_name in batch:
+                if alts:
+                    batch[value_name] = [[convert_world(world=world, dtype='float32') for world in worlds] for worlds in batch[value_name]]
+                else:
+                    batch[value_name] = convert_world(world=batch[value_name], dtype='float32')
+        return batch
 
     def zero_batch(self, n, include_model=False, alternatives=False):
         batch = dict()
@@ -330,7 +402,7 @@ class Dataset(object):
                 elif value_type == 'vector(float)':
                     batch[value_name] = [[np.zeros(shape=self.vector_shape(value_name), dtype=np.float32)] for _ in range(n)]
                 elif value_type == 'world':
-                    batch[value_name] = [[np.zeros(shape=self.world_shape(), dtype=np.float32)] for _ in range(n)]
+                    batch[value_name] = [[np.zeros(shape=self.world_shape(), dtype=self.world_dtype)] for _ in range(n)]
                 elif value_type == 'model' and include_model:
                     batch[value_name] = [[] for _ in range(n)]
             else:
@@ -343,7 +415,7 @@ class Dataset(object):
                 elif value_type == 'vector(float)':
                     batch[value_name] = np.zeros(shape=((n,) + self.vector_shape(value_name)), dtype=np.float32)
                 elif value_type == 'world':
-                    batch[value_name] = np.zeros(shape=((n,) + self.world_shape()), dtype=np.float32)
+                    batch[value_name] = np.zeros(shape=((n,) + self.world_shape()), dtype=self.world_dtype)
                 elif value_type == 'model' and include_model:
                     batch[value_name] = [None] * n
         return batch
@@ -351,49 +423,151 @@ class Dataset(object):
     def generate(self, n, mode=None, include_model=False, alternatives=False):  # mode: None, 'train', 'validation', 'test'
         raise NotImplementedError
 
-    def iterate(self, n, mode=None, include_model=False, alternatives=False, iterations=None):
-        i = 0
-        while iterations is None or i < iterations:
-            yield self.generate(n=n, mode=mode, include_model=include_model, alternatives=alternatives)
-            i += 1
+    def close(self):
+        pass
+
+    def statistics(self):
+        # named statistics of caches and failures, for instance reported after generation
+        from shapeworld.world import Shape
+        statistics = dict()
+        if Shape.mask_cache is not None:
+            statistics['mask cache'] = Shape.mask_cache.statistics()
+        return statistics
+
+    def iterate(self, n, mode=None, include_model=False, alternatives=False, iterations=None, prefetch=0, workers=0):
+        # with prefetch or workers, batches are produced by background processes into a bounded queue
+        return DatasetIterator(dataset=self, n=n, mode=mode, include_model=include_model, alternatives=alternatives, iterations=iterations, prefetch=prefetch, workers=workers)
 
     def get_html(self, generated, image_format='bmp', image_dir=''):
         return None
 
-    def serialize(self, path, generated, additional=None, filename=None, archive=None, html=False, numpy_formats=(), image_format='bmp', concat_worlds=False):
+    def serialize(self, path, generated, additional=None, filename=None, archive=None, html=False, numpy_formats=(), image_format='bmp', concat_worlds=False, encode_workers=1, compress_level=None):
         assert not additional or all(value_name not in self.values for value_name in additional)
+        assert compress_level is None or 0 <= compress_level <= 9
         if not os.path.isdir(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path))
 
-        with util.Archive(path=path, mode='w', archive=archive) as write_file:
-            for value_name, value in generated.items():
-                self.serialize_value(
-                    path=path,
-                    value=value,
-                    value_name=value_name,
-                    write_file=write_file,
-                    numpy_format=(value_name in numpy_formats),
-                    image_format=image_format,
-                    concat_worlds=concat_worlds
-                )
-            if additional:
-                for value_name, (value, value_type) in additional.items():
+        # images are encoded in background threads, as PIL releases the GIL while encoding
+        if encode_workers > 1:
+            encode_pool = ThreadPool(processes=encode_workers)
+        else:
+            encode_pool = None
+
+        try:
+            with util.Archive(path=path, mode='w', archive=archive) as write_file:
+                for value_name, value in generated.items():
                     self.serialize_value(
                         path=path,
                         value=value,
                         value_name=value_name,
                         write_file=write_file,
-                        value_type=value_type,
                         numpy_format=(value_name in numpy_formats),
                         image_format=image_format,
-                        concat_worlds=concat_worlds
+                        concat_worlds=concat_worlds,
+                        encode_pool=encode_pool,
+                        compress_level=compress_level
                     )
-            if html:
-                html = self.get_html(generated=generated, image_format=image_format)
-                assert html is not None
-                write_file(filename='data.html', value=html)
+                if additional:
+                    for value_name, (value, value_type) in additional.items():
+                        self.serialize_value(
+                            path=path,
+                            value=value,
+                            value_name=value_name,
+                            write_file=write_file,
+                            value_type=value_type,
+                            numpy_format=(value_name in numpy_formats),
+                            image_format=image_format,
+                            concat_worlds=concat_worlds,
+                            encode_pool=encode_pool,
+                            compress_level=compress_level
+                        )
+                if html:
+                    html = self.get_html(generated=generated, image_format=image_format)
+                    assert html is not None
+                    write_file(filename='data.html', value=html)
+        finally:
+            # encode threads are also shut down if serialization fails
+            if encode_pool is not None:
+                encode_pool.close()
+                encode_pool.join()
+
+    def serialize_columns(self, path, generated):
+        # one fixed-shape .npy column per value
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for value_name, value in generated.items():
+            value_type, _ = util.alternatives_type(value_type=self.values[value_name])
+            if value_type == 'model':
+                with open(os.path.join(path, value_name + '.json'), 'w') as filehandle:
+                    json.dump(obj=value, fp=filehandle)
+            else:
+                np.save(os.path.join(path, value_name + '.npy'), self.value_column(value_name=value_name, value=value))
+
+    def serialize_chunks(self, path, generated, chunk_size, compression=None):
+        # per value, fixed-size chunks of instances concatenated in one file, with byte offsets in index.json
+        assert chunk_size > 0
+        assert compression is None or compression in chunk_compressions
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        num_instances = len(next(iter(generated.values())))
+        index = dict(num_instances=num_instances, chunk_size=chunk_size, compression=compression, offsets=dict())
+        for value_name, value in generated.items():
+            value_type, _ = util.alternatives_type(value_type=self.values[value_name])
+            if value_type != 'model':
+                value = self.value_column(value_name=value_name, value=value)
+            offsets = [0]
+            with open(os.path.join(path, value_name + '.chunks'), 'wb') as filehandle:
+                for start in range(0, num_instances, chunk_size):
+                    if value_type == 'model':
+                        chunk = json.dumps(obj=value[start: start + chunk_size]).encode()
+                    else:
+                        chunk_bytes = BytesIO()
+                        np.save(chunk_bytes, value[start: start + chunk_size])
+                        chunk = chunk_bytes.getvalue()
+                        chunk_bytes.close()
+                    if compression is not None:
+                        chunk = chunk_compressions[compression][0](chunk)
+                    filehandle.write(chunk)
+                    offsets.append(offsets[-1] + len(chunk))
+            index['offsets'][value_name] = offsets
+        with open(os.path.join(path, 'index.json'), 'w') as filehandle:
+            json.dump(obj=index, fp=filehandle)
+
+    def value_column(self, value_name, value):
+        # alternatives are padded to their maximum number, word sequences to the vector shape
+        value_type, alts = util.alternatives_type(value_type=self.values[value_name])
+        if value_type == 'int' or value_type == 'vector(int)' or value_type in self.vocabularies:
+            dtype = np.int32
+        elif value_type == 'world':
+            dtype = self.world_dtype
+        else:
+            dtype = np.float32
+        if value_type in self.vocabularies:
+            if alts:
+                column = np.zeros(shape=((len(value), max([len(v) for v in value] + [0])) + self.vector_shape(value_name=value_name)), dtype=dtype)
+                for n, v in enumerate(value):
+                    for i, words in enumerate(v):
+                        column[n, i, :len(words)] = words
+            else:
+                column = np.zeros(shape=((len(value),) + self.vector_shape(value_name=value_name)), dtype=dtype)
+                for n, words in enumerate(value):
+                    column[n, :len(words)] = words
+        elif alts:
+            if value_type == 'world':
+                shape = self.world_shape()
+            elif value_type == 'int' or value_type == 'float':
+                shape = ()
+            else:
+                shape = self.vector_shape(value_name=value_name)
+            column = np.zeros(shape=((len(value), max([len(v) for v in value] + [0])) + shape), dtype=dtype)
+            for n, v in enumerate(value):
+                if len(v) > 0:
+                    column[n, :len(v)] = v
+        else:
+            column = np.asarray(value, dtype=dtype)
+        return column
 
-    def serialize_value(self, path, value, value_name, write_file, value_type=None, numpy_format=False, image_format='bmp', concat_worlds=False):
+    def serialize_value(self, path, value, value_name, write_file, value_type=None, numpy_format=False, image_format='bmp', concat_worlds=False, encode_pool=None, compress_level=None):
         if value_type is None:
             value_type = self.values[value_name]
         value_type, alts = util.alternatives_type(value_type=value_type)
@@ -435,7 +609,6 @@ class Dataset(object):
                 value = '\n'.join(','.join(str(round(x, 3)) for x in vector.flatten()) for vector in value) + '\n'
                 write_file(value_name + '.txt', value)
         elif value_type == 'world':
-            from shapeworld.world import World
             if numpy_format:
                 np.save(path + '-' + value_name + '.npy', value)
             elif concat_worlds:
@@ -448,26 +621,25 @@ class Dataset(object):
                     else:
                         worlds.append(np.concatenate([value[y * size + x] for x in range(len(value) % size)] + [np.zeros_like(a=value[0]) for _ in range(-len(value) % size)], axis=1))
                 worlds = np.concatenate(worlds, axis=0)
-                image = World.get_image(world_array=worlds)
-                image_bytes = BytesIO()
-                image.save(image_bytes, format=image_format)
-                write_file('{}.{}'.format(value_name, image_format), image_bytes.getvalue(), binary=True)
-                image_bytes.close()
+                write_file('{}.{}'.format(value_name, image_format), encode_image(world_array=worlds, image_format=image_format, compress_level=compress_level), binary=True)
             else:
+                filenames = list()
+                world_arrays = list()
                 for n in range(len(value)):
                     if alts:
                         for i, v in enumerate(value[n]):
-                            image = World.get_image(world_array=v)
-                            image_bytes = BytesIO()
-                            image.save(image_bytes, format=image_format)
-                            write_file('{}-{}-{}.{}'.format(value_name, n, i, image_format), image_bytes.getvalue(), binary=True)
-                            image_bytes.close()
+                            filenames.append('{}-{}-{}.{}'.format(value_name, n, i, image_format))
+                            world_arrays.append(v)
                     else:
-                        image = World.get_image(world_array=value[n])
-                        image_bytes = BytesIO()
-                        image.save(image_bytes, format=image_format)
-                        write_file('{}-{}.{}'.format(value_name, n, image_format), image_bytes.getvalue(), binary=True)
-                        image_bytes.close()
+                        filenames.append('{}-{}.{}'.format(value_name, n, image_format))
+                        world_arrays.append(value[n])
+                if encode_pool is None:
+                    images_bytes = (encode_image(world_array=world_array, image_format=image_format, compress_level=compress_level) for world_array in world_arrays)
+                else:
+                    # imap preserves order, so files are written deterministically
+                    images_bytes = encode_pool.imap(func=(lambda world_array: encode_image(world_array=world_array, image_format=image_format, compress_level=compress_level)), iterable=world_arrays, chunksize=8)
+                for filename, image_bytes in zip(filenames, images_bytes):
+                    write_file(filename, image_bytes, binary=True)
         elif value_type == 'model':
             assert not numpy_format
             value = json.dumps(obj=value, indent=2, sort_keys=True)
@@ -540,7 +712,7 @@ class Dataset(object):
                 path, extension = os.path.splitext(path)
                 while extension != '':
                     path, extension = os.path.splitext(path)
-                value = np.load(path + '-' + value_name + '.npy')
+                value = convert_world(world=np.load(path + '-' + value_name + '.npy'), dtype=self.world_dtype)
             elif num_concat_worlds:
                 assert not alts
                 size = ceil(sqrt(num_concat_worlds))
@@ -548,7 +720,7 @@ class Dataset(object):
                 assert image_bytes is not None
                 image_bytes = BytesIO(image_bytes)
                 image = Image.open(image_bytes)
-                worlds = World.from_image(image)
+                worlds = World.from_image(image, dtype=self.world_dtype)
                 height = worlds.shape[0] // ceil(num_concat_worlds / size)
                 assert worlds.shape[0] % ceil(num_concat_worlds / size) == 0
                 width = worlds.shape[1] // size
@@ -572,7 +744,7 @@ class Dataset(object):
                                 break
                             image_bytes = BytesIO(image_bytes)
                             image = Image.open(image_bytes)
-                            v.append(World.from_image(image))
+                            v.append(World.from_image(image, dtype=self.world_dtype))
                             i += 1
                         value.append(v)
                     else:
@@ -581,7 +753,7 @@ class Dataset(object):
                             break
                         image_bytes = BytesIO(image_bytes)
                         image = Image.open(image_bytes)
-                        value.append(World.from_image(image))
+                        value.append(World.from_image(image, dtype=self.world_dtype))
                     n += 1
             return value
         elif value_type == 'model':
@@ -602,7 +774,7 @@ class Dataset(object):
 
 class LoadedDataset(Dataset):
 
-    def __init__(self, specification, random_sampling=True, pixel_noise_stddev=None, exclude_values=()):
+    def __init__(self, specification, random_sampling=True, pixel_noise_stddev=None, exclude_values=(), world_dtype=None, resident_shards=1, prefetch_shards=0, shard_cache_size=None):
         self._type = specification.pop('type')
         self._name = specification.pop('name')
         self.variant = specification.pop('variant', None)
@@ -615,8 +787,14 @@ class LoadedDataset(Dataset):
         self.numpy_formats = tuple(specification.pop('numpy_formats', ()))
         self.image_format = specification.pop('image_format', 'bmp')
         self.num_concat_worlds = specification.pop('num_concat_worlds', 0)
+        self.shard_format = specification.pop('shard_format', None)
         self._specification = specification
         self.random_sampling = random_sampling
+        # random sampling mixes instances of resident shards, the upcoming ones are decoded in background threads
+        assert resident_shards >= 1 and prefetch_shards >= 0
+        self.resident_shards = resident_shards
+        self.prefetch_shards = prefetch_shards
+        self.shard_cache_size = util.parse_int_with_factor(shard_cache_size) if isinstance(shard_cache_size, str) else shard_cache_size
 
         values = specification.pop('values')
         for value in exclude_values:
@@ -627,7 +805,11 @@ class LoadedDataset(Dataset):
         else:
             assert 'pixel_noise_stddev' not in specification
 
-        super(LoadedDataset, self).__init__(values=values, world_size=specification.pop('world_size'), pixel_noise_stddev=pixel_noise_stddev, vectors=specification.pop('vectors', None), vocabularies=specification.pop('vocabularies', None), language=specification.pop('language', None))
+        stored_world_dtype = specification.pop('world_dtype', 'float32')
+        if world_dtype is None:
+            world_dtype = stored_world_dtype
+
+        super(LoadedDataset, self).__init__(values=values, world_size=specification.pop('world_size'), pixel_noise_stddev=pixel_noise_stddev, vectors=specification.pop('vectors', None), vocabularies=specification.pop('vocabularies', None), language=specification.pop('language', None), world_dtype=world_dtype)
 
         self.shards = None
         self.records_shards = None
@@ -670,8 +852,14 @@ class LoadedDataset(Dataset):
 
         self.loaded = dict()
         self.shard = dict()
-        self.num_instances = dict()
-        self.num_alternatives = dict()
+        self.order = dict()
+        self.cursor = dict()
+        self.upcoming = dict()
+        self.chunk_indices = dict()
+        self.instance_offsets = dict()
+        self.shard_cache = OrderedDict()
+        self.shard_pool = None
+        self.pending = dict()
 
     def __str__(self):
         name = '{} {}'.format(self.type, self.name)
@@ -727,83 +915,28 @@ class LoadedDataset(Dataset):
             mode_shards = self.shards[mode]
 
         if mode not in self.loaded:
-            self.loaded[mode] = dict()
-            self.shard[mode] = -1
-            self.num_instances[mode] = 0
-            self.num_alternatives[mode] = 0
-            for value_name, value_type in self.values.items():
-                value_type, alts = util.alternatives_type(value_type=value_type)
-                if value_type != 'model' or self.include_model:
-                    self.loaded[mode][value_name] = list()
-
-        while (self.num_instances[mode] < n) if (self.random_sampling or alternatives) else (self.num_alternatives[mode] < n):
-            if self.random_sampling:
-                next_shard = self.shard[mode]
-                while len(mode_shards) > 1 and next_shard == self.shard[mode]:
-                    next_shard = randrange(len(mode_shards))
-                self.shard[mode] = next_shard
-            else:
-                self.shard[mode] = (self.shard[mode] + 1) % len(mode_shards)
-            self.num_instances[mode] = 0
-            with util.Archive(path=mode_shards[self.shard[mode]], mode='r', archive=self.archive) as read_file:
-                for value_name, value in self.loaded[mode].items():
-                    value.extend(self.deserialize_value(
-                        path=mode_shards[self.shard[mode]],
-                        value_name=value_name,
-                        read_file=read_file,
-                        numpy_format=(value_name in self.numpy_formats),
-                        image_format=self.image_format,
-                        num_concat_worlds=self.num_concat_worlds
-                    ))
-                    if self.num_instances[mode] == 0:
-                        self.num_instances[mode] = self.num_alternatives[mode] = len(value)
-                    else:
-                        assert len(value) == self.num_instances[mode]
-                    if value_name == 'alternatives':
-                        self.num_alternatives[mode] = sum(value)
+            self.loaded[mode] = list()
+            self.shard[mode] = list()
+            self.order[mode] = (np.zeros(shape=(0,), dtype=np.int64), np.zeros(shape=(0,), dtype=np.int64), None)
+            self.cursor[mode] = 0
+            self.upcoming[mode] = list()
 
         batch = self.zero_batch(n, include_model=include_model, alternatives=alternatives)
 
-        for i in range(n):
-            if self.random_sampling:
-                index = randrange(self.num_instances[mode])
-            else:
-                index = 0
-            if 'alternatives' not in self.values:
-                alt_index = -1
-                self.num_instances[mode] -= 1
-                self.num_alternatives[mode] -= 1
-            elif alternatives or self.loaded[mode]['alternatives'][index] == 1:
-                alt_index = -1
-                self.num_instances[mode] -= 1
-                self.num_alternatives[mode] -= self.loaded[mode]['alternatives'][index]
-            elif self.random_sampling:
-                alt_index = randrange(self.loaded[mode]['alternatives'][index])
-                self.num_instances[mode] -= 1
-                self.num_alternatives[mode] -= self.loaded[mode]['alternatives'][index]
-            else:
-                alt_index = 0
-                self.loaded[mode]['alternatives'][index] -= 1
-                self.num_alternatives[mode] -= 1
-
-            for value_name, value_type in self.values.items():
-                value_type, alts = util.alternatives_type(value_type=value_type)
-                if value_type == 'model' and not self.include_model:
-                    continue
-                if self.random_sampling or alt_index == -1:
-                    value = self.loaded[mode][value_name].pop(index)
-                else:
-                    value = self.loaded[mode][value_name][index]
-                if value_type == 'model' and not include_model:
-                    continue
-                if not alternatives and alts:
-                    value = value.pop(alt_index)
-                if not alternatives and value_name == 'alternatives':
-                    continue
-                if value_type in self.vocabularies:
-                    batch[value_name][i][:len(value)] = value
-                else:
-                    batch[value_name][i] = value
+        i = 0
+        while i < n:
+            slots, indices, alt_indices = self.order[mode]
+            if self.cursor[mode] == len(indices):
+                shards = self.next_shards(mode=mode, mode_shards=mode_shards)
+                self.loaded[mode] = [self.shard_columns(path=mode_shards[shard]) for shard in shards]
+                self.order[mode] = self.pool_order(pool=self.loaded[mode], alternatives=alternatives)
+                self.cursor[mode] = 0
+                continue
+            k = min(n - i, len(indices) - self.cursor[mode])
+            cursor = self.cursor[mode]
+            self.gather_pool(batch=batch, offset=i, pool=self.loaded[mode], slots=slots[cursor: cursor + k], indices=indices[cursor: cursor + k], alt_indices=(None if alt_indices is None else alt_indices[cursor: cursor + k]), alternatives=alternatives)
+            self.cursor[mode] += k
+            i += k
 
         for value_name, value_type in self.values.items():
             value_type, _ = util.alternatives_type(value_type=value_type)
@@ -823,99 +956,299 @@ class LoadedDataset(Dataset):
             mode_shards = self.shards
         else:
             mode_shards = self.shards[mode]
-        available_shards = list(range(len(mode_shards)))
-        loaded = dict()
+
+        # streams through the shards, so only the resident and prefetched ones are held in memory
+        if self.random_sampling:
+            shards = list(np.random.permutation(len(mode_shards)))
+        else:
+            shards = list(range(len(mode_shards)))
+
+        batch = None
+        for index in range(0, len(shards), self.resident_shards):
+            for shard in shards[index + self.resident_shards: index + self.resident_shards + self.prefetch_shards]:
+                self.prefetch_shard(path=mode_shards[shard])
+            pool = [self.shard_columns(path=mode_shards[shard]) for shard in shards[index: index + self.resident_shards]]
+            slots, indices, alt_indices = self.pool_order(pool=pool, alternatives=alternatives, all_alternatives=True)
+            cursor = 0
+            while cursor < len(indices):
+                if batch is None:
+                    batch = self.zero_batch(n, include_model=include_model, alternatives=alternatives)
+                    i = 0
+                k = min(n - i, len(indices) - cursor)
+                self.gather_pool(batch=batch, offset=i, pool=pool, slots=slots[cursor: cursor + k], indices=indices[cursor: cursor + k], alt_indices=(None if alt_indices is None else alt_indices[cursor: cursor + k]), alternatives=alternatives)
+                cursor += k
+                i += k
+                if i == n:
+                    for value_name, value_type in self.values.items():
+                        value_type, _ = util.alternatives_type(value_type=value_type)
+                        if value_type == 'world':
+                            batch[value_name] = self.apply_pixel_noise(world=batch[value_name])
+                    yield batch
+                    batch = None
+
+        # final partial batch
+        if batch is not None:
+            batch = {value_name: value[:i] for value_name, value in batch.items()}
+            for value_name, value_type in self.values.items():
+                value_type, _ = util.alternatives_type(value_type=value_type)
+                if value_type == 'world':
+                    batch[value_name] = self.apply_pixel_noise(world=batch[value_name])
+            yield batch
+
+    def load_shard(self, path):
+        # values as fixed-shape arrays, memory-mapped for the npy shard format, models as lists
+        if self.shard_format == 'npy':
+            columns = dict()
+            for value_name, value_type in self.values.items():
+                value_type, _ = util.alternatives_type(value_type=value_type)
+                if value_type != 'model':
+                    columns[value_name] = np.load(os.path.join(path, value_name + '.npy'), mmap_mode='r')
+                elif self.include_model:
+                    with open(os.path.join(path, value_name + '.json'), 'r') as filehandle:
+                        columns[value_name] = json.load(fp=filehandle)
+            return columns
+        elif self.shard_format == 'chunked':
+            index = self.chunk_index(path=path)
+            columns = dict()
+            for value_name, value_type in self.values.items():
+                value_type, _ = util.alternatives_type(value_type=value_type)
+                if value_type == 'model' and not self.include_model:
+                    continue
+                chunks = [self.read_chunk(path=path, value_name=value_name, chunk=chunk) for chunk in range(len(index['offsets'][value_name]) - 1)]
+                if value_type == 'model':
+                    columns[value_name] = [value for chunk in chunks for value in chunk]
+                else:
+                    columns[value_name] = np.concatenate(chunks)
+            return columns
+        columns = dict()
+        with util.Archive(path=path, mode='r', archive=self.archive) as read_file:
+            for value_name, value_type in self.values.items():
+                value_type, _ = util.alternatives_type(value_type=value_type)
+                if value_type == 'model' and not self.include_model:
+                    continue
+                value = self.deserialize_value(
+                    path=path,
+                    value_name=value_name,
+                    read_file=read_file,
+                    numpy_format=(value_name in self.numpy_formats),
+                    image_format=self.image_format,
+                    num_concat_worlds=self.num_concat_worlds
+                )
+                if value_type == 'model':
+                    columns[value_name] = value
+                else:
+                    columns[value_name] = self.value_column(value_name=value_name, value=value)
+        assert all(len(column) == len(next(iter(columns.values()))) for column in columns.values())
+        return columns
+
+    def chunk_index(self, path):
+        if path not in self.chunk_indices:
+            with open(os.path.join(path, 'index.json'), 'r') as filehandle:
+                self.chunk_indices[path] = json.load(fp=filehandle)
+        return self.chunk_indices[path]
+
+    def read_chunk(self, path, value_name, chunk):
+        index = self.chunk_index(path=path)
+        offsets = index['offsets'][value_name]
+        with open(os.path.join(path, value_name + '.chunks'), 'rb') as filehandle:
+            filehandle.seek(offsets[chunk])
+            chunk = filehandle.read(offsets[chunk + 1] - offsets[chunk])
+        if index['compression'] is not None:
+            chunk = chunk_compressions[index['compression']][1](chunk)
+        value_type, _ = util.alternatives_type(value_type=self.values[value_name])
+        if value_type == 'model':
+            return json.loads(chunk.decode())
+        else:
+            return np.load(BytesIO(chunk))
+
+    def locate_instance(self, index, mode=None):
+        # global instance id to (shard, chunk, offset), counting instances in the listed shard order
+        assert self.shard_format == 'chunked'
+        if mode == 'none':
+            mode = None
+        if mode is None:
+            mode_shards = self.shards
+        else:
+            mode_shards = self.shards[mode]
+        if mode not in self.instance_offsets:
+            self.instance_offsets[mode] = np.cumsum([0] + [self.chunk_index(path=path)['num_instances'] for path in mode_shards])
+        assert 0 <= index < self.instance_offsets[mode][-1]
+        shard = bisect_right(self.instance_offsets[mode], index) - 1
+        index = int(index - self.instance_offsets[mode][shard])
+        chunk_size = self.chunk_index(path=mode_shards[shard])['chunk_size']
+        return shard, index // chunk_size, index % chunk_size
+
+    def get_instances(self, indices, mode=None, include_model=False, alternatives=False):
+        # random access to instances by global id, only the containing chunks are read
+        assert not include_model or self.include_model
+        if mode == 'none':
+            mode = None
+        if mode is None:
+            mode_shards = self.shards
+        else:
+            mode_shards = self.shards[mode]
+        batch = self.zero_batch(len(indices), include_model=include_model, alternatives=alternatives)
+        locations = dict()
+        for position, index in enumerate(indices):
+            shard, chunk, offset = self.locate_instance(index=index, mode=mode)
+            locations.setdefault((shard, chunk), list()).append((position, offset))
+        for (shard, chunk), positions in sorted(locations.items()):
+            columns = dict()
+            for value_name, value_type in self.values.items():
+                value_type, _ = util.alternatives_type(value_type=value_type)
+                if value_type != 'model' or self.include_model:
+                    columns[value_name] = self.read_chunk(path=mode_shards[shard], value_name=value_name, chunk=chunk)
+            positions, offsets = (np.array(x, dtype=np.int64) for x in zip(*positions))
+            if 'alternatives' in columns and not alternatives:
+                if self.random_sampling:
+                    alt_indices = (np.random.random_sample(size=len(offsets)) * columns['alternatives'][offsets]).astype(np.int64)
+                else:
+                    alt_indices = np.zeros_like(offsets)
+            else:
+                alt_indices = None
+            self.gather_columns(batch=batch, positions=positions, columns=columns, indices=offsets, alt_indices=alt_indices, alternatives=alternatives)
         for value_name, value_type in self.values.items():
-            value_type, alts = util.alternatives_type(value_type=value_type)
-            if value_type != 'model' or self.include_model:
-                loaded[value_name] = list()
-        num_instances = 0
+            value_type, _ = util.alternatives_type(value_type=value_type)
+            if value_type == 'world':
+                batch[value_name] = self.apply_pixel_noise(world=batch[value_name])
+        return batch
 
-        while available_shards:
+    def next_shards(self, mode, mode_shards):
+        # shards are chosen ahead of time, so the upcoming ones can be prefetched
+        # a pool never holds the same shard twice
+        resident_shards = min(self.resident_shards, len(mode_shards))
+        upcoming = self.upcoming[mode]
+        while len(upcoming) < resident_shards + self.prefetch_shards:
+            chosen = self.shard[mode] + upcoming
             if self.random_sampling:
-                shard = available_shards.pop(randrange(len(available_shards)))
+                recent = chosen[len(chosen) - min(resident_shards, len(mode_shards) - 1, len(chosen)):]
+                shard = randrange(len(mode_shards))
+                while shard in recent:
+                    shard = randrange(len(mode_shards))
             else:
-                shard = available_shards.pop(0)
-            num_instances = 0
-            with util.Archive(path=mode_shards[shard], mode='r', archive=self.archive) as read_file:
-                for value_name, value in loaded.items():
-                    value.extend(self.deserialize_value(
-                        path=mode_shards[shard],
-                        value_name=value_name,
-                        read_file=read_file,
-                        numpy_format=(value_name in self.numpy_formats),
-                        image_format=self.image_format,
-                        num_concat_worlds=self.num_concat_worlds
-                    ))
-                    if num_instances == 0:
-                        num_instances = num_alternatives = len(value)
-                    else:
-                        assert len(value) == num_instances
-                    if value_name == 'alternatives':
-                        num_alternatives = sum(value)
-
-            while (num_instances >= n) if alternatives else (num_alternatives >= n):
-                batch = self.zero_batch(n, include_model=include_model, alternatives=alternatives)
-
-                for i in range(n):
-                    if self.random_sampling:
-                        index = randrange(num_instances)
-                    else:
-                        index = 0
-                    if 'alternatives' not in self.values:
-                        alt_index = -1
-                        num_instances -= 1
-                        num_alternatives -= 1
-                    elif alternatives or loaded['alternatives'][index] == 1:
-                        alt_index = -1
-                        num_instances -= 1
-                        num_alternatives -= loaded['alternatives'][index]
+                shard = ((chosen[-1] if chosen else -1) + 1) % len(mode_shards)
+            upcoming.append(shard)
+        self.shard[mode] = upcoming[:resident_shards]
+        del upcoming[:resident_shards]
+        for shard in upcoming:
+            self.prefetch_shard(path=mode_shards[shard])
+        return self.shard[mode]
+
+    def prefetch_shard(self, path):
+        if self.prefetch_shards == 0 or path in self.shard_cache or path in self.pending:
+            return
+        if self.shard_pool is None:
+            self.shard_pool = ThreadPool(processes=self.prefetch_shards)
+        self.pending[path] = self.shard_pool.apply_async(func=self.load_shard, kwds=dict(path=path))
+
+    def close(self):
+        # pending prefetches are discarded, the pool is recreated on the next prefetch
+        if self.shard_pool is not None:
+            self.shard_pool.terminate()
+            self.shard_pool.join()
+            self.shard_pool = None
+        self.pending = dict()
+
+    def shard_columns(self, path):
+        # decoded shards are kept in a least-recently-used cache up to the given number of bytes
+        if path in self.shard_cache:
+            columns = self.shard_cache.pop(path)
+        elif path in self.pending:
+            columns = self.pending.pop(path).get()
+        else:
+            columns = self.load_shard(path=path)
+        if self.shard_cache_size is not None:
+            self.shard_cache[path] = columns
+            cache_size = sum(sum(column.nbytes for column in columns.values() if isinstance(column, np.ndarray) and not isinstance(column, np.memmap)) for columns in self.shard_cache.values())
+            while cache_size > self.shard_cache_size and len(self.shard_cache) > 1:
+                _, evicted = self.shard_cache.popitem(last=False)
+                cache_size -= sum(column.nbytes for column in evicted.values() if isinstance(column, np.ndarray) and not isinstance(column, np.memmap))
+        return columns
+
+    def pool_order(self, pool, alternatives, all_alternatives=False):
+        # shard slot and instance indices in sampling order across the resident shards
+        orders = [self.column_order(columns=columns, alternatives=alternatives, all_alternatives=all_alternatives) for columns in pool]
+        slots = np.concatenate([np.full(shape=(len(indices),), fill_value=slot, dtype=np.int64) for slot, (indices, _) in enumerate(orders)])
+        indices = np.concatenate([indices for indices, _ in orders])
+        if orders[0][1] is None:
+            alt_indices = None
+        else:
+            alt_indices = np.concatenate([alt_indices for _, alt_indices in orders])
+        if self.random_sampling and len(pool) > 1:
+            permutation = np.random.permutation(len(indices))
+            slots = slots[permutation]
+            indices = indices[permutation]
+            if alt_indices is not None:
+                alt_indices = alt_indices[permutation]
+        return slots, indices, alt_indices
+
+    def column_order(self, columns, alternatives, all_alternatives=False):
+        # instance indices in sampling order, plus alternative indices if alternatives are sampled individually
+        num_instances = len(next(iter(columns.values())))
+        if 'alternatives' in columns and not alternatives:
+            num_alternatives = np.asarray(columns['alternatives'])
+            if self.random_sampling and not all_alternatives:
+                indices = np.random.permutation(num_instances)
+                alt_indices = (np.random.random_sample(size=num_instances) * num_alternatives[indices]).astype(np.int64)
+            else:
+                indices = np.repeat(np.arange(num_instances), num_alternatives)
+                alt_indices = np.arange(len(indices)) - np.repeat(np.cumsum(num_alternatives) - num_alternatives, num_alternatives)
+                if self.random_sampling:
+                    permutation = np.random.permutation(len(indices))
+                    indices = indices[permutation]
+                    alt_indices = alt_indices[permutation]
+        elif self.random_sampling:
+            indices = np.random.permutation(num_instances)
+            alt_indices = None
+        else:
+            indices = np.arange(num_instances)
+            alt_indices = None
+        return indices, alt_indices
+
+    def gather_pool(self, batch, offset, pool, slots, indices, alt_indices, alternatives):
+        positions = np.arange(offset, offset + len(indices))
+        for slot, columns in enumerate(pool):
+            selected = (slots == slot)
+            if selected.any():
+                self.gather_columns(batch=batch, positions=positions[selected], columns=columns, indices=indices[selected], alt_indices=(None if alt_indices is None else alt_indices[selected]), alternatives=alternatives)
+
+    def gather_columns(self, batch, positions, columns, indices, alt_indices, alternatives):
+        # gathers in ascending index order for sequential access of the memory-mapped columns
+        order = np.argsort(indices, kind='stable')
+        indices = indices[order]
+        if alt_indices is not None:
+            alt_indices = alt_indices[order]
+        positions = positions[order]
+        for value_name, value_type in self.values.items():
+            if value_name not in batch:
+                continue
+            value_type, alts = util.alternatives_type(value_type=value_type)
+            column = columns[value_name]
+            if value_type == 'model':
+                for n, index in enumerate(indices):
+                    if alts and not alternatives:
+                        batch[value_name][positions[n]] = column[index][alt_indices[n]]
                     else:
-                        if self.random_sampling:
-                            alt_index = randrange(loaded['alternatives'][index])
-                        else:
-                            alt_index = 0
-                        loaded['alternatives'][index] -= 1
-                        num_alternatives -= 1
-
-                    for value_name, value_type in self.values.items():
-                        value_type, alts = util.alternatives_type(value_type=value_type)
-                        if value_type == 'model' and not self.include_model:
-                            continue
-                        if alt_index == -1:
-                            value = loaded[value_name].pop(index)
-                            if not alternatives and alts:
-                                value = value.pop(0)
-                        elif alts:
-                            value = loaded[value_name][index].pop(alt_index)
-                        else:
-                            value = loaded[value_name][index]
-                        if value_type == 'model' and not include_model:
-                            continue
-                        if not alternatives and value_name == 'alternatives':
-                            continue
-                        if value_type in self.vocabularies:
-                            batch[value_name][i][:len(value)] = value
-                        else:
-                            batch[value_name][i] = value
-
-                for value_name, value_type in self.values.items():
-                    value_type, _ = util.alternatives_type(value_type=value_type)
+                        batch[value_name][positions[n]] = column[index]
+            elif alts and alternatives:
+                num_alternatives = columns['alternatives']
+                for n, index in enumerate(indices):
+                    value = column[index, :num_alternatives[index]]
                     if value_type == 'world':
-                        batch[value_name] = self.apply_pixel_noise(world=batch[value_name])
-
-                yield batch
-
-                if not available_shards:
-                    if alternatives:
-                        if 0 < num_instances < n:
-                            n = num_instances
-
+                        value = convert_world(world=value, dtype=self.world_dtype)
+                    if value_type == 'int' or value_type == 'float':
+                        batch[value_name][positions[n]] = value.tolist()
                     else:
-                        if 0 < num_alternatives < n:
-                            n = num_alternatives
-
-        assert num_instances == 0 and num_alternatives == 0
+                        # copies, as the batch must not alias read-only or cached shard columns
+                        batch[value_name][positions[n]] = [np.array(v) for v in value]
+            else:
+                if alts:
+                    value = column[indices, alt_indices]
+                else:
+                    value = column[indices]
+                if value_type == 'world':
+                    value = convert_world(world=value, dtype=self.world_dtype)
+                batch[value_name][positions] = value
 
     def get_html(self, generated, image_format='bmp', image_dir=''):
         module = import_module('shapeworld.datasets.{}.{}'.format(self.type, self.name))
@@ -942,6 +1275,7 @@ class DatasetMixer(Dataset):
         assert all(dataset.world_size == self.datasets[0].world_size for dataset in self.datasets)
         assert all(sorted(dataset.vectors) == sorted(self.datasets[0].vectors) for dataset in self.datasets)
         assert all(sorted(dataset.vocabularies) == sorted(self.datasets[0].vocabularies) for dataset in self.datasets)
+        assert all(dataset.world_dtype == self.datasets[0].world_dtype for dataset in self.datasets)
         # combine vectors and words information
         values = self.datasets[0].values
         world_size = self.datasets[0].world_size
@@ -950,7 +1284,7 @@ class DatasetMixer(Dataset):
         for name in self.datasets[0].vocabularies:
             vocabularies[name] = sorted(set(word for dataset in self.datasets for word in dataset.vocabularies[name]))
         language = self.datasets[0].language
-        super(DatasetMixer, self).__init__(values=values, world_size=world_size, vectors=vectors, vocabularies=vocabularies, language=language)
+        super(DatasetMixer, self).__init__(values=values, world_size=world_size, vectors=vectors, vocabularies=vocabularies, language=language, world_dtype=self.datasets[0].world_dtype)
         self.translations = list()
         for dataset in self.datasets:
             dataset.vectors = self.vectors
@@ -980,6 +1314,20 @@ class DatasetMixer(Dataset):
     def name(self):
         return '+'.join(dataset.name for dataset in self.datasets)
 
+    @property
+    def world_dtype(self):
+        return self.datasets[0].world_dtype
+
+    @world_dtype.setter
+    def world_dtype(self, world_dtype):
+        # worlds are produced by the mixed datasets
+        for dataset in self.datasets:
+            dataset.world_dtype = world_dtype
+
+    def close(self):
+        for dataset in self.datasets:
+            dataset.close()
+
     def generate(self, n, mode=None, include_model=False, alternatives=False):
         if mode == 'none':
             mode = None
@@ -1008,6 +1356,249 @@ class DatasetMixer(Dataset):
         return batch
 
 
+parallel_dataset = None
+
+
+def initialize_parallel_worker(dataset):
+    global parallel_dataset
+    parallel_dataset = dataset
+    # caches held by the worker are flushed when the pool is closed
+    multiprocessing.util.Finalize(None, dataset.close, exitpriority=0)
+
+
+numpy_generator = None
+
+
+def get_numpy_generator():
+    # derived from the global numpy random state unless seeded per worker
+    global numpy_generator
+    if numpy_generator is None:
+        numpy_generator = np.random.default_rng(np.random.randint(2 ** 31, size=4))
+    return numpy_generator
+
+
+def seed_random(seed_sequence):
+    global numpy_generator
+    state = seed_sequence.generate_state(4)
+    seed(sum(int(value) << (32 * k) for k, value in enumerate(state)))
+    np.random.seed(state)
+    numpy_generator = np.random.default_rng(seed_sequence)
+
+
+def generate_parallel(arguments):
+    n, mode, include_model, alternatives, seed_sequence = arguments
+    # independent random streams per chunk, reproducible irrespective of worker scheduling
+    seed_random(seed_sequence=seed_sequence)
+    generated = parallel_dataset.generate(n=n, mode=mode, include_model=include_model, alternatives=alternatives)
+    return os.getpid(), generated, parallel_dataset.statistics()
+
+
+def produce_batches(dataset, queue, stop, n, mode, include_model, alternatives, seed_sequence):
+    seed_random(seed_sequence=seed_sequence)
+    try:
+        while not stop.is_set():
+            generated = dataset.generate(n=n, mode=mode, include_model=include_model, alternatives=alternatives)
+            while not stop.is_set():
+                try:
+                    queue.put(generated, timeout=0.1)
+                    break
+                except Full:
+                    pass
+    except Exception:
+        queue.put(Exception('Batch producer failed:\n' + traceback.format_exc()))
+    finally:
+        dataset.close()
+
+
+class DatasetIterator(object):
+
+    def __init__(self, dataset, n, mode=None, include_model=False, alternatives=False, iterations=None, prefetch=0, workers=0, seed=None):
+        assert isinstance(prefetch, int) and prefetch >= 0
+        assert isinstance(workers, int) and workers >= 0
+        self.dataset = dataset
+        self.n = n
+        self.mode = mode
+        self.include_model = include_model
+        self.alternatives = alternatives
+        self.iterations = iterations
+        if prefetch > 0 or workers > 0:
+            self.prefetch = max(prefetch, workers)
+            self.workers = max(workers, 1)
+        else:
+            self.prefetch = 0
+            self.workers = 0
+        # forked producers would each continue from the same position of a sequential loaded dataset
+        assert self.workers <= 1 or not isinstance(dataset, LoadedDataset) or dataset.random_sampling, 'Sequential loaded datasets support at most one producer process'
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.queue = None
+        self.stop = None
+        self.processes = list()
+        self.iteration = 0
+        self.num_batches = 0
+        self.wait_time = 0.0
+        self.num_depth_samples = 0
+        self.queue_depth_sum = 0
+        self.max_queue_depth = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.iterations is not None and self.iteration >= self.iterations:
+            self.close()
+            raise StopIteration
+        before = time()
+        if self.workers == 0:
+            generated = self.dataset.generate(n=self.n, mode=self.mode, include_model=self.include_model, alternatives=self.alternatives)
+        else:
+            if self.queue is None:
+                self.start()
+            # sampled before each batch is taken, as the queue is gone once the iterator is closed
+            queue_depth = self.queue_depth()
+            if queue_depth >= 0:
+                self.num_depth_samples += 1
+                self.queue_depth_sum += queue_depth
+                self.max_queue_depth = max(queue_depth, self.max_queue_depth)
+            generated = self.queue.get()
+            if isinstance(generated, Exception):
+                self.close()
+                raise generated
+        self.wait_time += time() - before
+        self.num_batches += 1
+        self.iteration += 1
+        return generated
+
+    def next(self):
+        return self.__next__()
+
+    def start(self):
+        self.queue = multiprocessing.Queue(maxsize=self.prefetch)
+        self.stop = multiprocessing.Event()
+        for seed_sequence in self.seed_sequence.spawn(self.workers):
+            process = multiprocessing.Process(target=produce_batches, kwargs=dict(dataset=self.dataset, queue=self.queue, stop=self.stop, n=self.n, mode=self.mode, include_model=self.include_model, alternatives=self.alternatives, seed_sequence=seed_sequence))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def queue_depth(self):
+        if self.queue is None:
+            return 0
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # not available on macOS
+            return -1
+
+    def statistics(self, reset=False):
+        # wait time is the time the consumer blocks on the next batch
+        statistics = dict(batches=self.num_batches, queue_depth=self.queue_depth(), mean_queue_depth=(float(self.queue_depth_sum) / self.num_depth_samples if self.num_depth_samples > 0 else 0.0), max_queue_depth=self.max_queue_depth, prefetch=self.prefetch, workers=self.workers, wait_time=self.wait_time, mean_wait_time=(self.wait_time / self.num_batches if self.num_batches > 0 else 0.0))
+        if reset:
+            self.num_batches = 0
+            self.wait_time = 0.0
+            self.num_depth_samples = 0
+            self.queue_depth_sum = 0
+            self.max_queue_depth = 0
+        return statistics
+
+    def close(self):
+        if self.stop is not None:
+            self.stop.set()
+            while any(process.is_alive() for process in self.processes):
+                try:
+                    while True:
+                        self.queue.get_nowait()
+                except Empty:
+                    pass
+                for process in self.processes:
+                    process.join(timeout=0.1)
+            self.queue.close()
+            self.queue = None
+            self.stop = None
+            self.processes = list()
+        self.dataset.close()
+
+
+class ParallelDataset(Dataset):
+
+    def __init__(self, dataset, workers, seed=None):
+        assert isinstance(dataset, Dataset)
+        # workers would each sample from their own copy, so loaded instances would be duplicated
+        assert not isinstance(dataset, LoadedDataset), 'Loaded datasets are not supported by parallel generation'
+        assert isinstance(workers, int) and workers >= 1
+        self.dataset = dataset
+        self.workers = workers
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.pool = None
+        self.worker_statistics = dict()
+        super(ParallelDataset, self).__init__(values=dataset.values, world_size=dataset.world_size, pixel_noise_stddev=dataset.pixel_noise_stddev, vectors=dataset.vectors, vocabularies=dataset.vocabularies, language=dataset.language, world_dtype=dataset.world_dtype)
+
+    def __str__(self):
+        return '{} ({} workers)'.format(self.dataset, self.workers)
+
+    @property
+    def type(self):
+        return self.dataset.type
+
+    @property
+    def name(self):
+        return self.dataset.name
+
+    def specification(self):
+        return self.dataset.specification()
+
+    def __getattr__(self, name):
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.dataset.close()
+
+    def generate(self, n, mode=None, include_model=False, alternatives=False):
+        num_chunks = min(n, self.workers)
+        if num_chunks == 0:
+            return self.dataset.generate(n=n, mode=mode, include_model=include_model, alternatives=alternatives)
+        if self.pool is None:
+            # workers hold their own copy of the dataset, including generator, captioner and realizer
+            self.pool = multiprocessing.Pool(processes=self.workers, initializer=initialize_parallel_worker, initargs=(self.dataset,))
+        chunks = [(n // num_chunks + (1 if k < n % num_chunks else 0), mode, include_model, alternatives, seed_sequence) for k, seed_sequence in enumerate(self.seed_sequence.spawn(num_chunks))]
+        batches = list()
+        for pid, generated, statistics in self.pool.map(generate_parallel, chunks):
+            batches.append(generated)
+            self.worker_statistics[pid] = statistics
+        batch = dict()
+        for value_name, value in batches[0].items():
+            if isinstance(value, np.ndarray):
+                batch[value_name] = np.concatenate([generated[value_name] for generated in batches], axis=0)
+            else:
+                batch[value_name] = [instance for generated in batches for instance in generated[value_name]]
+        return batch
+
+    def statistics(self):
+        # counts are summed over the latest statistics of all workers, and rates recomputed
+        if not self.worker_statistics:
+            return self.dataset.statistics()
+        statistics = dict()
+        for worker_statistics in self.worker_statistics.values():
+            for name, values in worker_statistics.items():
+                merged = statistics.setdefault(name, dict())
+                for key, value in values.items():
+                    merged[key] = merged.get(key, 0) + value
+        for values in statistics.values():
+            if 'hit_rate' in values:
+                requests = values['hits'] + values['misses']
+                values['hit_rate'] = float(values['hits']) / requests if requests > 0 else 0.0
+            if 'failure_rate' in values:
+                values['failure_rate'] = float(values['failures']) / values['realizations'] if values['realizations'] > 0 else 0.0
+        return statistics
+
+    def get_html(self, generated, image_format='bmp', image_dir=''):
+        return self.dataset.get_html(generated=generated, image_format=image_format, image_dir=image_dir)
+
+
 class ClassificationDataset(Dataset):
 
     def __init__(self, world_generator, num_classes, multi_class=False, count_class=False, pixel_noise_stddev=None):
@@ -1039,6 +1630,7 @@ class ClassificationDataset(Dataset):
             mode = None
 
         batch = self.zero_batch(n, include_model=include_model, alternatives=alternatives)
+        worlds = list()
         for i in range(n):
 
             while not self.world_generator.initialize(mode=mode):
@@ -1049,7 +1641,7 @@ class ClassificationDataset(Dataset):
                 if world is not None:
                     break
 
-            batch['world'][i] = self.apply_pixel_noise(world=world.get_array(world_array=batch['world'][i]))
+            worlds.append(world)
 
             if include_model:
                 batch['world_model'][i] = world.model()
@@ -1064,6 +1656,11 @@ class ClassificationDataset(Dataset):
             if not self.multi_class:
                 assert c is not None
 
+        from shapeworld.world import World
+        # compact worlds are rendered in float and converted after noise
+        worlds = World.render_batch(worlds=worlds, out=(batch['world'] if self.world_dtype == 'float32' else None))
+        batch['world'] = self.apply_pixel_noise(world=worlds)
+
         return batch
 
     def get_html(self, generated, image_format='bmp', image_dir=''):
@@ -1097,6 +1694,8 @@ class CaptionAgreementDataset(Dataset):
 
     GENERATOR_INIT_FREQUENCY = 25
     CAPTIONER_INIT_FREQUENCY = 100
+    # instances with failed realizations are resampled at most this many times
+    MAX_REALIZATION_ROUNDS = 10
     CAPTIONER_INIT_FREQUENCY2 = 5
 
     def __init__(self, world_generator, world_captioner, caption_size, vocabulary, pixel_noise_stddev=None, caption_realizer='dmrs', language=None, worlds_per_instance=1, captions_per_instance=1, correct_ratio=0.5, train_correct_ratio=None, validation_correct_ratio=None, test_correct_ratio=None):
@@ -1154,11 +1753,27 @@ class CaptionAgreementDataset(Dataset):
         self.pn_arity = self.world_captioner.pn_arity()
         self.pn_arity[''] = 1
         self.pn_arity['[UNKNOWN]'] = 1
+        self.num_realizations = 0
+        self.num_realization_failures = 0
 
     @property
     def type(self):
         return 'agreement'
 
+    def realization_statistics(self):
+        return dict(realizations=self.num_realizations, failures=self.num_realization_failures, failure_rate=(float(self.num_realization_failures) / self.num_realizations if self.num_realizations > 0 else 0.0))
+
+    def close(self):
+        # stops the realizer processes and saves the realization cache
+        self.caption_realizer.close()
+
+    def statistics(self):
+        statistics = super(CaptionAgreementDataset, self).statistics()
+        statistics['realization failures'] = self.realization_statistics()
+        if getattr(self.caption_realizer, 'realization_cache', None) is not None:
+            statistics['realization cache'] = self.caption_realizer.realization_cache.statistics()
+        return statistics
+
     def specification(self):
         specification = super(CaptionAgreementDataset, self).specification()
         specification['worlds_per_instance'] = self.worlds_per_instance
@@ -1166,25 +1781,12 @@ class CaptionAgreementDataset(Dataset):
         specification['pn_arity'] = self.pn_arity
         return specification
 
-    def generate(self, n, mode=None, include_model=False, alternatives=False):
-        if mode == 'none':
-            mode = None
-        if mode == 'train':
-            correct_ratio = self.train_correct_ratio
-        elif mode == 'validation':
-            correct_ratio = self.validation_correct_ratio
-        elif mode == 'test':
-            correct_ratio = self.test_correct_ratio
-        else:
-            correct_ratio = self.correct_ratio
-
+    def sample_instances(self, batch, indices, captions, worlds, mode, correct_ratio, include_model, alternatives):
         pn2id = self.vocabularies['pn']
         unknown = pn2id['[UNKNOWN]']
         pn_size = self.vector_shape('caption_pn')[0]
 
-        batch = self.zero_batch(n, include_model=include_model, alternatives=alternatives)
-        captions = list()
-        for i in range(n):
+        for i in indices:
             correct = random() < correct_ratio
             # print(i, correct, flush=True)
             # print(i, correct, end=', ', flush=True)
@@ -1244,7 +1846,7 @@ class CaptionAgreementDataset(Dataset):
                 batch['caption'][i].extend(batch['caption'][i][0].copy() for _ in range(self.captions_per_instance - 1))
                 batch['caption_pn'][i].extend(batch['caption_pn'][i][0].copy() for _ in range(self.captions_per_instance - 1))
                 batch['caption_rpn'][i].extend(batch['caption_rpn'][i][0].copy() for _ in range(self.captions_per_instance - 1))
-                captions.append(caption)
+                captions[i * self.captions_per_instance] = caption
                 pn = caption.polish_notation()
                 assert len(pn) <= pn_size, (len(pn), pn_size, pn)
                 for k, pn_symbol in enumerate(pn):
@@ -1274,7 +1876,7 @@ class CaptionAgreementDataset(Dataset):
                         caption = self.world_captioner(world=world)
                         if caption is not None:
                             break
-                    captions.append(caption)
+                    captions[i * self.captions_per_instance + j] = caption
                     pn = caption.polish_notation()
                     assert len(pn) <= pn_size, (len(pn), pn_size, pn)
                     for k, pn_symbol in enumerate(pn):
@@ -1292,7 +1894,7 @@ class CaptionAgreementDataset(Dataset):
                     batch['agreement'][i].append(float(correct))
 
             else:
-                captions.append(caption)
+                captions[i] = caption
                 pn = caption.polish_notation()
                 assert len(pn) <= pn_size, (len(pn), pn_size, pn)
                 for k, pn_symbol in enumerate(pn):
@@ -1312,7 +1914,7 @@ class CaptionAgreementDataset(Dataset):
                 from shapeworld.captions import PragmaticalPredication
                 batch['alternatives'][i] = self.worlds_per_instance
                 batch['world'][i].extend(batch['world'][i][0].copy() for _ in range(self.worlds_per_instance - 1))
-                batch['world'][i][0] = self.apply_pixel_noise(world=world.get_array(world_array=batch['world'][i][0]))
+                batch['world'][i][0] = world.get_array(world_array=(batch['world'][i][0] if self.world_dtype == 'float32' else None))
                 if include_model:
                     batch['world_model'][i].append(world.model())
 
@@ -1338,16 +1940,67 @@ class CaptionAgreementDataset(Dataset):
                         if agreement > 0.0:
                             break
 
-                    batch['world'][i][j] = self.apply_pixel_noise(world=world.get_array(world_array=batch['world'][i][j]))
+                    batch['world'][i][j] = world.get_array(world_array=(batch['world'][i][j] if self.world_dtype == 'float32' else None))
                     if include_model:
                         batch['world_model'][i].append(world.model())
                     batch['agreement'][i].append(float(correct))
 
             else:
-                batch['world'][i] = self.apply_pixel_noise(world=world.get_array(world_array=batch['world'][i]))
+                worlds[i] = world
                 if include_model:
                     batch['world_model'][i] = world.model()
 
+    def generate(self, n, mode=None, include_model=False, alternatives=False):
+        if mode == 'none':
+            mode = None
+        if mode == 'train':
+            correct_ratio = self.train_correct_ratio
+        elif mode == 'validation':
+            correct_ratio = self.validation_correct_ratio
+        elif mode == 'test':
+            correct_ratio = self.test_correct_ratio
+        else:
+            correct_ratio = self.correct_ratio
+
+        batch = self.zero_batch(n, include_model=include_model, alternatives=alternatives)
+        captions_per_instance = self.captions_per_instance if alternatives else 1
+        captions = [None] * (n * captions_per_instance)
+        worlds = [None] * n
+        realized_captions = [None] * (n * captions_per_instance)
+        indices = list(range(n))
+        num_rounds = 0
+        failed_caption = None
+        while len(indices) > 0:
+            if num_rounds == self.__class__.MAX_REALIZATION_ROUNDS:
+                failed_mrs = self.caption_realizer.caption_mrs(captions[failed_caption])[1]
+                raise Exception('Failed to realize captions of {} instances after {} rounds of resampling, for instance:\n{}'.format(len(indices), num_rounds, failed_mrs))
+            num_rounds += 1
+            self.sample_instances(batch=batch, indices=indices, captions=captions, worlds=worlds, mode=mode, correct_ratio=correct_ratio, include_model=include_model, alternatives=alternatives)
+            caption_indices = [i * captions_per_instance + j for i in indices for j in range(captions_per_instance)]
+            # captions which fail to be realized are None, and their instances are resampled
+            realized = self.caption_realizer.realize(captions=[captions[k] for k in caption_indices], return_failures=True)
+            failed = set()
+            for k, caption in zip(caption_indices, realized):
+                if caption is None:
+                    failed.add(k // captions_per_instance)
+                    failed_caption = k
+                else:
+                    realized_captions[k] = caption
+            self.num_realizations += len(caption_indices)
+            self.num_realization_failures += sum(caption is None for caption in realized)
+            indices = sorted(failed)
+            if len(indices) > 0:
+                reset_batch = self.zero_batch(len(indices), include_model=include_model, alternatives=alternatives)
+                for value_name, value in batch.items():
+                    for k, i in enumerate(indices):
+                        value[i] = reset_batch[value_name][k]
+
+        if any(world is not None for world in worlds):
+            from shapeworld.world import World
+            # compact worlds are rendered in float and converted after noise
+            batch['world'] = World.render_batch(worlds=worlds, out=(batch['world'] if self.world_dtype == 'float32' else None))
+        batch['world'] = self.apply_pixel_noise(world=batch['world'])
+
         word2id = self.vocabularies['language']
         unknown = word2id['[UNKNOWN]']
         caption_size = self.vector_shape('caption')[0]
@@ -1358,10 +2011,8 @@ class CaptionAgreementDataset(Dataset):
         missing_words = set()  # for assert
         max_caption_size = caption_size  # for assert
 
-        assert len(captions) == n * self.captions_per_instance if alternatives else len(captions) == n
-        captions = self.caption_realizer.realize(captions=captions)
-
-        for i, caption in enumerate(captions):
+        assert len(realized_captions) == n * self.captions_per_instance if alternatives else len(realized_captions) == n
+        for i, caption in enumerate(realized_captions):
             caption = util.sentence2tokens(sentence=caption)
 
             if len(caption) > caption_size:
@@ -34,12 +34,11 @@ class NlvrDataset(Dataset):
                 worlds, world_models, description, agreement = next(self.nlvr[mode])
             except StopIteration:
                 if i > 0:
-                    return {key: value[:i] for key, value in batch.items()}
+                    batch = {key: value[:i] for key, value in batch.items()}
+                    break
                 else:
                     return None
-            batch['world1'][i] = self.apply_pixel_noise(world=worlds[0])
-            batch['world2'][i] = self.apply_pixel_noise(world=worlds[1])
-            batch['world3'][i] = self.apply_pixel_noise(world=worlds[2])
+            batch['world1'][i], batch['world2'][i], batch['world3'][i] = worlds
             if include_model:
                 batch['world_model1'][i], batch['world_model2'][i], batch['world_model3'][i] = world_models
             assert len(description) <= self.description_size
@@ -47,6 +46,8 @@ class NlvrDataset(Dataset):
                 batch['description'][i][w] = vocabulary.get(word, unknown)
             batch['description_length'][i] = len(description)
             batch['agreement'][i] = agreement
+        for value_name in ('world1', 'world2', 'world3'):
+            batch[value_name] = self.apply_pixel_noise(world=batch[value_name])
         return batch
 
     def get_html(self, generated, image_format='bmp', image_dir=''):
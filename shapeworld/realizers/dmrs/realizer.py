@@ -1,3 +1,5 @@
+from __future__ import division
+from collections import OrderedDict
 import copy
 import json
 import os
@@ -5,9 +7,15 @@ import platform
 import re
 import stat
 import subprocess
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+from shapeworld import util
 from shapeworld.captions import Attribute, Relation, EntityType, Selector, Existential, Quantifier, NumberBound, ComparativeQuantifier, Proposition
 from shapeworld.realizers import CaptionRealizer
-from shapeworld.realizers.dmrs.dmrs import Dmrs, create_sortinfo
+from shapeworld.realizers.dmrs.dmrs import Pred, Dmrs, create_sortinfo
 
 
 def prepare_ace():
@@ -68,6 +76,287 @@ def parse_string(string):
         return str(string)
 
 
+def memoized_dmrs(dmrs_fn):
+    # composed DMRS fragments by caption component, returned as copies since composition modifies them
+    name = dmrs_fn.__name__
+
+    def memoized_dmrs_fn(self, component):
+        key = (name, json.dumps(component.model(), sort_keys=True))
+        if key in self.dmrs_cache:
+            dmrs = self.dmrs_cache.pop(key)
+        else:
+            dmrs = dmrs_fn(self, component)
+            while len(self.dmrs_cache) >= self.dmrs_cache_size:
+                self.dmrs_cache.popitem(last=False)
+        self.dmrs_cache[key] = dmrs
+        return copy.deepcopy(dmrs)
+
+    memoized_dmrs_fn.__name__ = name
+    return memoized_dmrs_fn
+
+
+def related_preds(pred, hierarchy):
+    # pred with all its transitive hypernyms and hyponyms
+    hypernyms = dict()
+    for hypernym, hyponyms in hierarchy.items():
+        for hyponym in hyponyms:
+            hypernyms.setdefault(hyponym, list()).append(hypernym)
+    related = {pred}
+    for relation in (hierarchy, hypernyms):
+        stack = [pred]
+        while stack:
+            for other in relation.get(stack.pop(), ()):
+                if other not in related:
+                    related.add(other)
+                    stack.append(other)
+    return related
+
+
+class AceGenerator(object):
+
+    # long-lived ACE generation process: one MRS per input line, and per item one NOTE line on stderr
+    # and, if successful, one realization line on stdout
+    def __init__(self, ace_path, grammar_path, arguments=()):
+        self.args = [ace_path, '-g', grammar_path, '-1e'] + list(arguments)
+        self.process = None
+        self.pid = None
+        self.stdout_lines = None
+        self.stderr_lines = None
+        self.num_restarts = 0
+
+    @staticmethod
+    def read_lines(stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line.decode('utf-8').rstrip('\n'))
+        lines.put(None)
+
+    @staticmethod
+    def write_lines(stream, lines):
+        try:
+            for line in lines:
+                stream.write((line + '\n').encode())
+            stream.flush()
+        except (IOError, OSError):  # process terminated
+            pass
+
+    def is_alive(self):
+        # processes are not shared with forked children, which start their own
+        return self.process is not None and self.pid == os.getpid() and self.process.poll() is None
+
+    def start(self):
+        self.close()
+        try:
+            self.process = subprocess.Popen(self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except Exception as e:
+            import sys
+            from datetime import datetime
+            print(datetime.now().strftime('%H:%M:%S'))
+            print(e.strerror)
+            print(sys.exc_info()[0])
+            raise
+        self.pid = os.getpid()
+        self.stdout_lines = Queue()
+        self.stderr_lines = Queue()
+        for stream, lines in ((self.process.stdout, self.stdout_lines), (self.process.stderr, self.stderr_lines)):
+            thread = threading.Thread(target=AceGenerator.read_lines, args=(stream, lines))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        if self.process is not None and self.pid == os.getpid():
+            try:
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+        self.process = None
+        self.pid = None
+
+    def generate(self, mrs_list, successful_regex, unsuccessful_regex):
+        # returns realization (or None) and stderr notes per MRS
+        results = list()
+        num_crashes = 0
+        while len(results) < len(mrs_list):
+            if not self.is_alive():
+                self.start()
+            # written concurrently, so a full stdin pipe cannot block reading the output
+            writer = threading.Thread(target=AceGenerator.write_lines, args=(self.process.stdin, mrs_list[len(results):]))
+            writer.daemon = True
+            writer.start()
+            while len(results) < len(mrs_list):
+                # the NOTE line of an item decides whether it was realized
+                notes = list()
+                line = self.stderr_lines.get()
+                while line is not None:
+                    notes.append(line)
+                    if successful_regex.match(line) or unsuccessful_regex.match(line):
+                        break
+                    line = self.stderr_lines.get()
+                if line is None:
+                    break
+                if unsuccessful_regex.match(line):
+                    results.append((None, notes))
+                    num_crashes = 0
+                    continue
+                # one realization per successful item, empty lines and output for failed items are skipped
+                line = self.stdout_lines.get()
+                while line is not None and (line == '' or line.startswith('SKIP:')):
+                    line = self.stdout_lines.get()
+                if line is None:
+                    break
+                results.append((line, notes))
+                num_crashes = 0
+            else:
+                writer.join()
+                continue
+            # process crashed on the current item: mark it as failed and restart for the remaining ones
+            writer.join()
+            notes = list()
+            while not self.stderr_lines.empty():
+                line = self.stderr_lines.get()
+                if line is not None:
+                    notes.append(line)
+            num_crashes += 1
+            if num_crashes > 3:
+                raise Exception('ACE process terminated repeatedly:\n' + '\n'.join(notes))
+            results.append((None, notes + ['ERROR: ACE process terminated']))
+            self.close()
+            self.num_restarts += 1
+        return results
+
+
+class AceGeneratorPool(object):
+
+    # MRS lists are split into contiguous shards, realized concurrently by separate ACE processes
+    def __init__(self, ace_path, grammar_path, arguments=(), num_processes=1):
+        assert isinstance(num_processes, int) and num_processes >= 1
+        self.ace_path = ace_path
+        self.grammar_path = grammar_path
+        self.arguments = arguments
+        self.num_processes = num_processes
+        self.generators = list()
+
+    @property
+    def num_restarts(self):
+        return sum(generator.num_restarts for generator in self.generators)
+
+    def close(self):
+        for generator in self.generators:
+            generator.close()
+
+    def generate(self, mrs_list, successful_regex, unsuccessful_regex):
+        while len(self.generators) < self.num_processes:
+            self.generators.append(AceGenerator(ace_path=self.ace_path, grammar_path=self.grammar_path, arguments=self.arguments))
+        num_shards = min(self.num_processes, len(mrs_list))
+        if num_shards <= 1:
+            return self.generators[0].generate(mrs_list=mrs_list, successful_regex=successful_regex, unsuccessful_regex=unsuccessful_regex)
+
+        shard_size = -(-len(mrs_list) // num_shards)
+        shards = [mrs_list[n * shard_size: (n + 1) * shard_size] for n in range(num_shards)]
+        results = [None] * num_shards
+
+        def generate_shard(n):
+            try:
+                results[n] = self.generators[n].generate(mrs_list=shards[n], successful_regex=successful_regex, unsuccessful_regex=unsuccessful_regex)
+            except Exception as exc:
+                results[n] = exc
+
+        threads = [threading.Thread(target=generate_shard, args=(n,)) for n in range(num_shards)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for shard_results in results:
+            if isinstance(shard_results, Exception):
+                raise shard_results
+        return [result for shard_results in results for result in shard_results]
+
+
+class RealizationCache(object):
+
+    # Realized sentences by MRS string, with least-recently-used eviction. If a path is given, the
+    # cache is loaded from and periodically merged into a JSON file shared by generation runs.
+
+    def __init__(self, language, max_size=1000000, path=None, save_frequency=10000):
+        assert isinstance(max_size, int) and max_size > 0
+        assert path is None or isinstance(path, str)
+        assert isinstance(save_frequency, int) and save_frequency > 0
+        self.language = language
+        self.max_size = max_size
+        self.path = path
+        self.save_frequency = save_frequency
+        self.realizations = OrderedDict()
+        self.num_unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.path is not None and os.path.isfile(self.path):
+            self.load()
+
+    def statistics(self):
+        requests = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_rate=(self.hits / requests if requests > 0 else 0.0), evictions=self.evictions, realizations=len(self.realizations))
+
+    def clear(self):
+        self.realizations.clear()
+        self.num_unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, mrs):
+        if mrs in self.realizations:
+            self.hits += 1
+            realization = self.realizations.pop(mrs)
+            self.realizations[mrs] = realization
+            return realization
+        else:
+            self.misses += 1
+            return None
+
+    def put(self, mrs, realization):
+        self.realizations.pop(mrs, None)
+        self.realizations[mrs] = realization
+        while len(self.realizations) > self.max_size:
+            self.realizations.popitem(last=False)
+            self.evictions += 1
+        if self.path is not None:
+            self.num_unsaved += 1
+            if self.num_unsaved >= self.save_frequency:
+                self.save()
+
+    def read(self):
+        with open(self.path, 'r') as filehandle:
+            cache = json.load(fp=filehandle)
+        assert cache['language'] == self.language, (cache['language'], self.language)
+        return cache['realizations']
+
+    def load(self):
+        for mrs, realization in self.read():
+            self.realizations[mrs] = realization
+        while len(self.realizations) > self.max_size:
+            self.realizations.popitem(last=False)
+
+    def save(self):
+        # merged with realizations saved meanwhile, for instance by other generation processes
+        realizations = OrderedDict()
+        if os.path.isfile(self.path):
+            for mrs, realization in self.read():
+                if mrs not in self.realizations:
+                    realizations[mrs] = realization
+        realizations.update(self.realizations)
+        realizations = list(realizations.items())[-self.max_size:]
+        # atomic replacement, so concurrent readers never see a partial file
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as filehandle:
+            json.dump(dict(language=self.language, realizations=realizations), filehandle)
+        os.rename(tmp_path, self.path)
+        self.num_unsaved = 0
+
+
 class DmrsRealizer(CaptionRealizer):
 
     def __init__(self, language):
@@ -80,13 +369,15 @@ class DmrsRealizer(CaptionRealizer):
 
         self.successful_regex = re.compile(pattern=r'^NOTE: [0-9]+ passive, [0-9]+ active edges in final generation chart; built [0-9]+ passives total. \[[1-9][0-9]* results\]$')
         self.unsuccessful_regex = re.compile(pattern=r'^NOTE: [0-9]+ passive, [0-9]+ active edges in final generation chart; built [0-9]+ passives total. \[0 results\]$')
-        self.final_regex = re.compile(pattern=r'^(NOTE: generated [0-9]+ / [0-9]+ sentences, avg [0-9]+k, time [0-9]+.[0-9]+s)|(NOTE: transfer did [0-9]+ successful unifies and [0-9]+ failed ones)$')
 
         with open(os.path.join(directory, 'languages', language + '.json'), 'r') as filehandle:
             language = json.load(fp=filehandle)
 
         self.ace_arguments = language.get('ace-arguments', list())
         self.requires_rel_suffix = language.get('requires-rel-suffix', False)
+        # started lazily by the first realize call of each process, with one ACE process by default
+        self.ace = AceGeneratorPool(ace_path=self.ace_path, grammar_path=self.erg_path, arguments=self.ace_arguments)
+        self.realization_cache = RealizationCache(language=self.language)
 
         if 'sortinfos' in language:
             sortinfo_classes = dict()
@@ -255,16 +546,22 @@ class DmrsRealizer(CaptionRealizer):
             assert paraphrase['key'] not in self.post_processing_by_key
             self.post_processing_by_key[paraphrase['key']] = n
 
-    def realize(self, captions):
-        try:
-            ace = subprocess.Popen([self.ace_path, '-g', self.erg_path, '-1e'] + self.ace_arguments, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except Exception as e:
-            import sys
-            from datetime import datetime
-            print(datetime.now().strftime('%H:%M:%S'))
-            print(e.strerror)
-            print(sys.exc_info()[0])
-            raise
+        # per paraphrase, a set of candidate preds for each fully specified search node, one of which
+        # is required in a graph for the paraphrase to possibly apply (conservatively up to hierarchy)
+        self.post_processing_preds = list()
+        for search, _, _, _, _ in self.post_processing:
+            required_preds = list()
+            for node in search.iter_nodes():
+                pred = str(node.pred)
+                if type(node.pred) is Pred or '?' in pred or pred in ('pred', 'node'):
+                    continue
+                required_preds.append(related_preds(pred=pred, hierarchy=self.hierarchy))
+            self.post_processing_preds.append(required_preds)
+
+        self.dmrs_cache = OrderedDict()
+        self.dmrs_cache_size = 100000
+
+    def realize(self, captions, return_failures=False):
         dmrs_list = list()
         mrs_list = list()
         none_indices = list()
@@ -272,51 +569,64 @@ class DmrsRealizer(CaptionRealizer):
             if caption is None:
                 none_indices.append(n)
                 continue
-            dmrs = self.caption_dmrs(caption=caption)
-            # print(dmrs.dumps_xml())
-            for search, replace, _, disable_hierarchy, match_top_index in self.post_processing:
-                dmrs = dmrs.apply_paraphrases(paraphrases=[(search, replace)], hierarchy=(None if disable_hierarchy else self.hierarchy), match_top_index=match_top_index)
-            # print(dmrs.dumps_xml())
-            dmrs.remove_underspecifications()
+            dmrs, mrs = self.caption_mrs(caption)
             dmrs_list.append(dmrs)
-            mrs_list.append(dmrs.get_mrs(requires_rel_suffix=self.requires_rel_suffix) + '\n')
-            # print(n, dmrs.get_mrs())
-        stdout_data, stderr_data = ace.communicate(input=''.join(mrs_list).encode())
-        stderr_data = stderr_data.decode('utf-8').splitlines()
-        stdout_data = stdout_data.decode('utf-8').splitlines()
+            mrs_list.append(mrs)
+            # print(n, mrs)
+
+        # only MRS strings neither cached nor repeated within the batch are sent to ACE
+        caption_strings = [None] * len(mrs_list)
+        uncached = OrderedDict()
+        for n, mrs in enumerate(mrs_list):
+            if self.realization_cache is not None:
+                caption_strings[n] = self.realization_cache.get(mrs)
+            if caption_strings[n] is None:
+                uncached.setdefault(mrs, list()).append(n)
+        results = self.ace.generate(mrs_list=list(uncached), successful_regex=self.successful_regex, unsuccessful_regex=self.unsuccessful_regex)
 
         failures = 0
-        n = 0
-        unexpected = False
-        for line in stderr_data:
-            if n == len(captions) - len(none_indices):
-                assert self.final_regex.match(line), line
-                continue
-            if self.successful_regex.match(line):
-                if unexpected:
-                    # print(dmrs_list[n].dumps_xml().decode())
-                    # print(mrs_list[n])
-                    unexpected = False
-                n += 1
-            elif self.unsuccessful_regex.match(line):
-                print(dmrs_list[n].dumps_xml().decode())
-                print(mrs_list[n])
-                failures += 1
-                n += 1
-            else:
-                print('Unexpected: ' + line)
-                unexpected = True
-        if failures > 0:
-            print('Failures: {}'.format(failures))
-            exit(0)
+        for (mrs, indices), (caption_string, notes) in zip(uncached.items(), results):
+            for line in notes:
+                if not self.successful_regex.match(line) and not self.unsuccessful_regex.match(line):
+                    print('Unexpected: ' + line)
+            if caption_string is None:
+                if not return_failures or util.debug():
+                    print(dmrs_list[indices[0]].dumps_xml().decode())
+                    print(mrs)
+                failures += len(indices)
+            elif self.realization_cache is not None:
+                self.realization_cache.put(mrs, caption_string)
+            for n in indices:
+                caption_strings[n] = caption_string
+        if failures > 0 and not return_failures:
+            raise Exception('Failed to realize {} of {} captions.'.format(failures, len(mrs_list)))
 
-        caption_strings = [line for line in stdout_data if line != '']
         for n in none_indices:
             caption_strings.insert(n, '')
 
-        assert len(caption_strings) == len(captions), '\n'.join(stdout_data) + '\n' + '\n'.join(stderr_data)
+        assert len(caption_strings) == len(captions)
         return caption_strings
 
+    def close(self):
+        self.ace.close()
+        if self.realization_cache is not None and self.realization_cache.path is not None:
+            self.realization_cache.save()
+
+    @memoized_dmrs
+    def caption_mrs(self, caption):
+        dmrs = self.caption_dmrs(caption)
+        # print(dmrs.dumps_xml())
+        preds = set(str(node.pred) for node in dmrs.iter_nodes())
+        for (search, replace, _, disable_hierarchy, match_top_index), required_preds in zip(self.post_processing, self.post_processing_preds):
+            if any(preds.isdisjoint(candidate_preds) for candidate_preds in required_preds):
+                continue
+            dmrs = dmrs.apply_paraphrases(paraphrases=[(search, replace)], hierarchy=(None if disable_hierarchy else self.hierarchy), match_top_index=match_top_index)
+            preds = set(str(node.pred) for node in dmrs.iter_nodes())
+        # print(dmrs.dumps_xml())
+        dmrs.remove_underspecifications()
+        return dmrs, dmrs.get_mrs(requires_rel_suffix=self.requires_rel_suffix)
+
+    @memoized_dmrs
     def attribute_dmrs(self, attribute):
         if attribute.predtype == 'relation':
             assert self.relation_attribute is not None
@@ -327,6 +637,7 @@ class DmrsRealizer(CaptionRealizer):
             dmrs = copy.deepcopy(self.attributes[attribute.predtype][attribute.value])
         return dmrs
 
+    @memoized_dmrs
     def type_dmrs(self, entity_type):
         assert self.entity_type is not None
         dmrs = copy.deepcopy(self.entity_type)
@@ -334,6 +645,7 @@ class DmrsRealizer(CaptionRealizer):
             dmrs.compose(self.attribute_dmrs(attribute), fusion={'type': 'type', 'quant': 'quant'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def selector_dmrs(self, selector):
         if selector.predtype == 'unique':
             assert self.unique_selector is not None
@@ -347,6 +659,7 @@ class DmrsRealizer(CaptionRealizer):
                 dmrs.compose(self.selector_dmrs(selector.comparison), fusion={'comp': 'scope'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def relation_dmrs(self, relation):
         if relation.predtype == 'attribute':
             assert self.attribute_relation is not None
@@ -370,6 +683,7 @@ class DmrsRealizer(CaptionRealizer):
                     dmrs.compose(self.selector_dmrs(relation.comparison), fusion={'comp': 'scope'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def existential_dmrs(self, existential):
         if isinstance(existential.restrictor, Selector):
             assert self.selector_existential is not None
@@ -382,6 +696,7 @@ class DmrsRealizer(CaptionRealizer):
         dmrs.compose(self.relation_dmrs(existential.body), fusion={'body': 'rel'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def quantifier_dmrs(self, quantifier):
         assert quantifier.qtype in self.quantifiers and quantifier.qrange in self.quantifiers[quantifier.qtype] and quantifier.quantity in self.quantifiers[quantifier.qtype][quantifier.qrange], (quantifier.qtype, quantifier.qrange, quantifier.quantity)
         dmrs = copy.deepcopy(self.quantifiers[quantifier.qtype][quantifier.qrange][quantifier.quantity])
@@ -389,6 +704,7 @@ class DmrsRealizer(CaptionRealizer):
         dmrs.compose(self.relation_dmrs(quantifier.body), fusion={'body': 'rel'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def number_bound_dmrs(self, number_bound):
         assert number_bound.bound in self.number_bounds, number_bound.bound
         # TODO: Would be more compositional
@@ -405,6 +721,7 @@ class DmrsRealizer(CaptionRealizer):
         dmrs.compose(self.relation_dmrs(quantifier.body), fusion={'body': 'rel'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def comparative_quantifier_dmrs(self, comparative_quantifier):
         assert comparative_quantifier.qtype in self.comparative_quantifiers and comparative_quantifier.qrange in self.comparative_quantifiers[comparative_quantifier.qtype] and comparative_quantifier.quantity in self.comparative_quantifiers[comparative_quantifier.qtype][comparative_quantifier.qrange], (comparative_quantifier.qtype, comparative_quantifier.qrange, comparative_quantifier.quantity)
         dmrs = copy.deepcopy(self.comparative_quantifiers[comparative_quantifier.qtype][comparative_quantifier.qrange][comparative_quantifier.quantity])
@@ -413,6 +730,7 @@ class DmrsRealizer(CaptionRealizer):
         dmrs.compose(self.relation_dmrs(comparative_quantifier.body), fusion={'body': 'rel'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def proposition_dmrs(self, proposition):
         assert proposition.proptype in self.propositions, proposition.proptype
         dmrs = copy.deepcopy(self.propositions[proposition.proptype])
@@ -434,6 +752,7 @@ class DmrsRealizer(CaptionRealizer):
             dmrs.compose(first_dmrs, fusion={'arg1': 'arg'}, hierarchy=self.hierarchy)
         return dmrs
 
+    @memoized_dmrs
     def caption_dmrs(self, caption):
         if isinstance(caption, Attribute):
             assert 'attribute' in self.propositions
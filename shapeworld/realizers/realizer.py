@@ -21,5 +21,9 @@ class CaptionRealizer(object):
         realizer = module(language=language)
         return realizer
 
-    def realize(self, captions):
+    def realize(self, captions, return_failures=False):
+        # with return_failures, captions which fail to be realized are None instead of raising an exception
         raise NotImplementedError
+
+    def close(self):
+        pass
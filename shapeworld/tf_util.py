@@ -31,6 +31,12 @@ def read_record(dataset, serialized_record):
                 feature_lists[value_name] = tf.io.FixedLenSequenceFeature(shape=dataset.vector_shape(value_name=value_name), dtype=tf.float32)
             else:
                 features[value_name] = tf.io.FixedLenFeature(shape=dataset.vector_shape(value_name=value_name), dtype=tf.float32)
+        elif value_type == 'world' and dataset.world_dtype == 'uint8':
+            # compact worlds are stored as raw bytes
+            if alts:
+                feature_lists[value_name] = tf.io.FixedLenSequenceFeature(shape=(), dtype=tf.string)
+            else:
+                features[value_name] = tf.io.FixedLenFeature(shape=(), dtype=tf.string)
         elif value_type == 'world':
             if alts:
                 feature_lists[value_name] = tf.io.FixedLenSequenceFeature(shape=dataset.world_shape(), dtype=tf.float32)
@@ -39,6 +45,13 @@ def read_record(dataset, serialized_record):
         else:
             pass
     record, sequence_record = tf.io.parse_single_sequence_example(serialized=serialized_record, context_features=features, sequence_features=feature_lists)
+    if dataset.world_dtype == 'uint8':
+        for value_name, value_type in dataset.values.items():
+            value_type, alts = util.alternatives_type(value_type=value_type)
+            if value_type == 'world' and alts:
+                sequence_record[value_name] = tf.reshape(tensor=tf.io.decode_raw(input_bytes=sequence_record[value_name], out_type=tf.uint8), shape=((-1,) + dataset.world_shape()))
+            elif value_type == 'world':
+                record[value_name] = tf.reshape(tensor=tf.io.decode_raw(input_bytes=record[value_name], out_type=tf.uint8), shape=dataset.world_shape())
     return record, sequence_record
 
 
@@ -87,6 +100,12 @@ def batch_records(dataset, mode, batch_size):
             batch = tf.train.batch(tensors=records, batch_size=batch_size, num_threads=1, capacity=(batch_size * 50))
         for value_name in batch:
             value_type, _ = util.alternatives_type(value_type=dataset.values[value_name])
+            if value_type == 'world' and dataset.world_dtype != 'float32':
+                # compact worlds are only converted to float here, as model input
+                if dataset.world_dtype == 'uint8':
+                    batch[value_name] = tf.cast(x=batch[value_name], dtype=tf.float32) / 255.0
+                else:
+                    batch[value_name] = tf.cast(x=batch[value_name], dtype=tf.float32)
             if dataset.pixel_noise_stddev is not None and dataset.pixel_noise_stddev > 0.0 and value_type == 'world':
                 noise = tf.truncated_normal(shape=((batch_size,) + dataset.world_shape()), mean=0.0, stddev=dataset.pixel_noise_stddev)
                 batch[value_name] = tf.clip_by_value(t=(batch[value_name] + noise), clip_value_min=0.0, clip_value_max=1.0)
@@ -122,6 +141,11 @@ def write_record(dataset, record):
                 feature_lists[value_name] = tf.train.FeatureList(feature=[tf.train.Feature(float_list=tf.train.FloatList(value=value.flatten())) for value in record[value_name]])
             else:
                 features[value_name] = tf.train.Feature(float_list=tf.train.FloatList(value=record[value_name].flatten()))
+        elif value_type == 'world' and dataset.world_dtype == 'uint8':
+            if alts:
+                feature_lists[value_name] = tf.train.FeatureList(feature=[tf.train.Feature(bytes_list=tf.train.BytesList(value=(value.tobytes(),))) for value in record[value_name]])
+            else:
+                features[value_name] = tf.train.Feature(bytes_list=tf.train.BytesList(value=(record[value_name].tobytes(),)))
         elif value_type == 'world':
             if alts:
                 features[value_name] = tf.train.FeatureList(feature=[tf.train.Feature(float_list=tf.train.FloatList(value=value.flatten())) for value in record[value_name]])
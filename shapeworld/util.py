@@ -1,5 +1,6 @@
 from __future__ import division
 from collections import Counter
+from io import BytesIO
 from itertools import chain, combinations
 import json
 from math import sqrt
@@ -277,14 +278,8 @@ class Archive(object):
         self.mode = mode
         if not os.path.isdir(self.archive[:self.archive.rindex('/')]):
             os.mkdir(self.archive[:self.archive.rindex('/')])
-        try:
-            if not os.path.isdir('/tmp/shapeworld'):
-                os.makedirs('/tmp/shapeworld')
-            self.temp_directory = os.path.join('/tmp/shapeworld', 'temp-' + str(time.time()))
-            os.mkdir(self.temp_directory)
-        except PermissionError:
-            self.temp_directory = os.path.join(self.archive[:self.archive.rindex('/')], 'temp-' + str(time.time()))
-            os.mkdir(self.temp_directory)
+        # members are read and written in memory, looked up via a name index
+        self.members = dict()
         if archive is None:
             self.archive_type = None
             if not os.path.isdir(self.archive):
@@ -304,6 +299,8 @@ class Archive(object):
             if not self.archive.endswith('.zip'):
                 self.archive += '.zip'
             self.archive = zipfile.ZipFile(self.archive, mode, compression)
+            if mode == 'r':
+                self.members = {fileinfo.filename: fileinfo for fileinfo in self.archive.infolist()}
         elif archive[:3] == 'tar':
             self.archive_type = 'tar'
             if len(archive) == 3:
@@ -323,11 +320,12 @@ class Archive(object):
             if not self.archive.endswith('.tar' + extension):
                 self.archive += '.tar' + extension
             self.archive = tarfile.open(self.archive, mode)
+            if mode[0] == 'r':
+                self.members = {fileinfo.name: fileinfo for fileinfo in self.archive.getmembers()}
 
     def close(self):
         if self.archive_type is not None:
             self.archive.close()
-        os.rmdir(self.temp_directory)
 
     def __enter__(self):
         if self.mode == 'r':
@@ -347,26 +345,18 @@ class Archive(object):
             with open(filename, 'rb' if binary else 'r') as filehandle:
                 value = filehandle.read()
             return value
-        elif self.archive_type == 'zip':
-            try:
-                fileinfo = self.archive.getinfo(filename)
-            except KeyError:
-                return None
+        fileinfo = self.members.get(filename)
+        if fileinfo is None:
+            return None
+        if self.archive_type == 'zip':
             value = self.archive.read(fileinfo)
-            if not binary:
-                value = value.decode()
-            return value
         elif self.archive_type == 'tar':
-            try:
-                fileinfo = self.archive.getmember(filename)
-            except KeyError:
-                return None
-            self.archive.extract(member=fileinfo, path=self.temp_directory)
-            filepath = os.path.join(self.temp_directory, filename)
-            with open(filepath, 'rb' if binary else 'r') as filehandle:
-                value = filehandle.read()
-            os.remove(filepath)
-            return value
+            filehandle = self.archive.extractfile(fileinfo)
+            value = filehandle.read()
+            filehandle.close()
+        if not binary:
+            value = value.decode()
+        return value
 
     def write_file(self, filename, value, binary=False):
         if self.archive_type is None:
@@ -374,17 +364,11 @@ class Archive(object):
             with open(filename, 'wb' if binary else 'w') as filehandle:
                 filehandle.write(value)
         elif self.archive_type == 'zip':
-            if binary:
-                filepath = os.path.join(self.temp_directory, filename)
-                with open(filepath, 'wb') as filehandle:
-                    filehandle.write(value)
-                self.archive.write(filepath, filename)
-                os.remove(filepath)
-            else:
-                self.archive.writestr(filename, value)
+            self.archive.writestr(filename, value)
         elif self.archive_type == 'tar':
-            filepath = os.path.join(self.temp_directory, filename)
-            with open(filepath, 'wb' if binary else 'w') as filehandle:
-                filehandle.write(value)
-            self.archive.add(filepath, filename)
-            os.remove(filepath)
+            if not binary:
+                value = value.encode()
+            fileinfo = tarfile.TarInfo(name=filename)
+            fileinfo.size = len(value)
+            fileinfo.mtime = time.time()
+            self.archive.addfile(tarinfo=fileinfo, fileobj=BytesIO(value))
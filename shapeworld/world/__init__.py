@@ -1,4 +1,4 @@
-from shapeworld.world.point import Point
+from shapeworld.world.point import Point, PointArray
 from shapeworld.world.shape import Shape
 from shapeworld.world.color import Color
 from shapeworld.world.texture import Texture
@@ -6,4 +6,4 @@ from shapeworld.world.entity import Entity
 from shapeworld.world.world import World
 
 
-__all__ = ['Point', 'Shape', 'Color', 'Texture', 'Entity', 'World']
+__all__ = ['Point', 'PointArray', 'Shape', 'Color', 'Texture', 'Entity', 'World']
@@ -1,7 +1,9 @@
 from __future__ import division
 from math import cos, pi, sin
 from random import choice, random
+import numpy as np
 from shapeworld.world import Point, Shape, Color, Texture
+from shapeworld.world.point import PointTuple
 
 
 default_resolution = Point(100, 100)
@@ -9,7 +11,7 @@ default_resolution = Point(100, 100)
 
 class Entity(object):
 
-    __slots__ = ('id', 'shape', 'color', 'texture', 'center', 'rotation', 'rotation_sin', 'rotation_cos', 'relative_topleft', 'relative_bottomright', 'topleft', 'bottomright', 'collisions')
+    __slots__ = ('id', 'shape', 'color', 'texture', 'center', 'rotation', 'rotation_sin', 'rotation_cos', 'relative_topleft', 'relative_bottomright', 'topleft', 'bottomright', 'collisions', 'distance_cache')
 
     def __init__(self, shape, color, texture, center, rotation):
         assert isinstance(shape, Shape)
@@ -53,11 +55,43 @@ class Entity(object):
         return offset.rotate(self.rotation_sin, self.rotation_cos)
 
     def __contains__(self, offset):
-        return self.rotate(offset) in self.shape
+        return self.shape.__contains__(self.rotate(offset))
 
     def distance(self, offset):
         return self.shape.distance(self.rotate(offset))
 
+    def distance_grid(self, x, y):
+        rotated_x = x * self.rotation_cos - y * self.rotation_sin
+        rotated_y = x * self.rotation_sin + y * self.rotation_cos
+        return self.shape.distance_grid(self.shape.size, rotated_x, rotated_y)
+
+    def distance_mask(self, topleft, bottomright, resolution):
+        # distances at the pixel points of Point.range(topleft, bottomright, resolution), indexed as [x, y]
+        topleft = topleft.__floor__()
+        bottomright = bottomright.__ceil__()
+        if self.distance_cache is None or self.distance_cache[0] != resolution:
+            cache_topleft = (self.topleft * resolution).__floor__()
+            cache_bottomright = (self.bottomright * resolution).__ceil__()
+            mask = self.distance_window(cache_topleft, cache_bottomright, resolution)
+            self.distance_cache = (resolution, cache_topleft, cache_bottomright, mask)
+        _, cache_topleft, cache_bottomright, mask = self.distance_cache
+        if cache_topleft <= topleft and bottomright <= cache_bottomright:
+            topleft -= cache_topleft
+            bottomright -= cache_topleft
+            return mask[int(topleft.x): int(bottomright.x), int(topleft.y): int(bottomright.y)]
+        else:
+            return self.distance_window(topleft, bottomright, resolution)
+
+    def distance_window(self, topleft, bottomright, resolution):
+        if Shape.mask_cache is not None:
+            distance = Shape.mask_cache.distance(shape=self.shape, rotation=self.rotation, start=topleft, end=bottomright, origin=self.center, pitch=(1.0 / (resolution - Point.ione)))
+            if distance is not None:
+                return distance.T
+        x = np.arange(int(topleft.x), int(bottomright.x)) / (resolution.x - 1) - self.center.x
+        y = np.arange(int(topleft.y), int(bottomright.y)) / (resolution.y - 1) - self.center.y
+        x, y = np.meshgrid(x, y, indexing='ij')
+        return self.distance_grid(x, y)
+
     def centrality(self, offset):
         return self.shape.centrality(self.rotate(offset))
 
@@ -75,6 +109,7 @@ class Entity(object):
         self.relative_bottomright = bottomright
         self.topleft = topleft + center
         self.bottomright = bottomright + center
+        self.distance_cache = None
 
     def draw(self, world_array, world_size, draw_fn=None):
         shift = Point(2.0 / world_size.x, 2.0 / world_size.y)
@@ -85,17 +120,21 @@ class Entity(object):
         if draw_fn is None:
             color = self.color.get_color()
             world_length = min(*world_size)
-            for (x, y), point in Point.range(topleft, bottomright, world_size):
-                point = point * scale - shift
-                offset = point - self.center
-                distance = self.distance(offset)
-                if distance == 0.0:
-                    # assert offset in self
-                    world_array[y, x] = self.texture.get_color(color, offset)
-                else:
-                    # assert offset not in self
-                    distance = max(1.0 - distance * world_length, 0.0)
-                    world_array[y, x] = distance * self.texture.get_color(color, offset) + (1.0 - distance) * world_array[y, x]
+            topleft = topleft.__floor__()
+            bottomright = bottomright.__ceil__()
+            x = np.arange(int(topleft.x), int(bottomright.x)) / (world_size.x - 1) * scale.x - shift.x - self.center.x
+            y = np.arange(int(topleft.y), int(bottomright.y)) / (world_size.y - 1) * scale.y - shift.y - self.center.y
+            offset = PointTuple(*np.meshgrid(x, y))
+            distance = None
+            if Shape.mask_cache is not None:
+                distance = Shape.mask_cache.distance(shape=self.shape, rotation=self.rotation, start=topleft, end=bottomright, origin=(self.center + shift), pitch=(scale / (world_size - Point.ione)))
+            if distance is None:
+                distance = self.distance_grid(offset.x, offset.y)
+            # anti-aliasing: full coverage inside, linear falloff within one pixel outside
+            coverage = np.maximum(1.0 - distance * world_length, 0.0)
+            coverage = np.expand_dims(coverage, axis=2)
+            world_slice = world_array[int(topleft.y): int(bottomright.y), int(topleft.x): int(bottomright.x)]
+            world_slice[:] = coverage.astype(world_array.dtype) * self.texture.get_color(color, offset) + (1.0 - coverage).astype(world_array.dtype) * world_slice
                 # if distance == 0.0:
                 #     centrality = self.centrality(offset)
                 #     world_array[y, x] = (centrality, centrality, centrality) + (1.0 - centrality) * self.texture.get_color(color, offset)
@@ -128,6 +167,68 @@ class Entity(object):
                 if x == x1 or x == x2 or y == y1 or y == y2:
                     world_array[y, x] = color
 
+    @staticmethod
+    def draw_batch(entities, indices, world_batch, world_size):
+        # entities need to share the same shape type, and indices need to be distinct
+        assert len(entities) == len(indices) == len(set(indices))
+        shape_type = type(entities[0].shape)
+        assert all(type(entity.shape) is shape_type for entity in entities)
+        shift = Point(2.0 / world_size.x, 2.0 / world_size.y)
+        scale = 1.0 + 2.0 * shift
+        world_length = min(*world_size)
+
+        topleft = list()
+        bottomright = list()
+        for entity in entities:
+            topleft.append((((entity.topleft) / scale) * world_size).max(Point.izero).__floor__())
+            bottomright.append((((entity.bottomright + 2.0 * shift) / scale) * world_size).min(world_size).__ceil__())
+        topleft = np.array(object=topleft, dtype=np.int64)
+        bottomright = np.array(object=bottomright, dtype=np.int64)
+        width, height = np.max(bottomright - topleft, axis=0)
+        width = max(width, 0)
+        height = max(height, 0)
+
+        # common padded window per entity, starting at its top-left pixel
+        columns = topleft[:, 0:1] + np.arange(width)
+        rows = topleft[:, 1:2] + np.arange(height)
+        valid = np.logical_and(np.expand_dims(rows < bottomright[:, 1:2], axis=2), np.expand_dims(columns < bottomright[:, 0:1], axis=1))
+        center_x = np.array(object=[entity.center.x for entity in entities])
+        center_y = np.array(object=[entity.center.y for entity in entities])
+        x = columns / (world_size.x - 1) * scale.x - shift.x - center_x[:, None]
+        y = rows / (world_size.y - 1) * scale.y - shift.y - center_y[:, None]
+        offset = PointTuple(*np.broadcast_arrays(x[:, None, :], y[:, :, None]))
+
+        rotation_cos = np.array(object=[entity.rotation_cos for entity in entities])[:, None, None]
+        rotation_sin = np.array(object=[entity.rotation_sin for entity in entities])[:, None, None]
+        rotated_x = offset.x * rotation_cos - offset.y * rotation_sin
+        rotated_y = offset.x * rotation_sin + offset.y * rotation_cos
+        size_x = np.array(object=[entity.shape.size.x for entity in entities])[:, None, None]
+        size_y = np.array(object=[entity.shape.size.y for entity in entities])[:, None, None]
+        if Shape.mask_cache is None:
+            distance = shape_type.distance_grid(PointTuple(size_x, size_y), rotated_x, rotated_y)
+        else:
+            # cached templates where the padded window fits, exact distances otherwise
+            pitch = scale / (world_size - Point.ione)
+            distance = np.empty(shape=valid.shape)
+            exact = list()
+            for n, entity in enumerate(entities):
+                cached = Shape.mask_cache.distance(shape=entity.shape, rotation=entity.rotation, start=PointTuple(topleft[n, 0], topleft[n, 1]), end=PointTuple(topleft[n, 0] + width, topleft[n, 1] + height), origin=(entity.center + shift), pitch=pitch)
+                if cached is None:
+                    exact.append(n)
+                else:
+                    distance[n] = cached
+            if exact:
+                distance[exact] = shape_type.distance_grid(PointTuple(size_x[exact], size_y[exact]), rotated_x[exact], rotated_y[exact])
+        # anti-aliasing: full coverage inside, linear falloff within one pixel outside
+        coverage = np.maximum(1.0 - distance * world_length, 0.0)
+
+        colors = np.stack([np.broadcast_to(entity.texture.get_color(entity.color.get_color(), PointTuple(offset.x[n], offset.y[n])), (height, width, 3)) for n, entity in enumerate(entities)])
+        indices = np.broadcast_to(np.array(object=indices)[:, None, None], valid.shape)[valid]
+        rows = np.broadcast_to(rows[:, :, None], valid.shape)[valid]
+        columns = np.broadcast_to(columns[:, None, :], valid.shape)[valid]
+        coverage = np.expand_dims(coverage[valid], axis=1)
+        world_batch[indices, rows, columns] = coverage.astype(world_batch.dtype) * colors[valid] + (1.0 - coverage).astype(world_batch.dtype) * world_batch[indices, rows, columns]
+
     def overall_collision(self):
         return sum(self.collisions.values())
 
@@ -171,15 +272,13 @@ class Entity(object):
         topleft *= resolution
         bottomright *= resolution
         average_resolution = 0.5 * (resolution.x + resolution.y)
+        distance1 = self.distance_mask(topleft, bottomright, resolution)
+        distance2 = other.distance_mask(topleft, bottomright, resolution)
         if ratio:
             granularity = 1.0 / resolution.x / resolution.y
-            collision = 0.0
-            for _, point in Point.range(topleft, bottomright, resolution):
-                distance1 = max(1.0 - average_resolution * self.distance(point - self.center), 0.0)
-                distance2 = max(1.0 - average_resolution * other.distance(point - other.center), 0.0)
-                average_distance = 0.5 * (distance1 + distance2)
-                if average_distance > 0.95:
-                    collision += granularity * average_distance
+            distance1 = np.maximum(1.0 - average_resolution * distance1, 0.0)
+            distance2 = np.maximum(1.0 - average_resolution * distance2, 0.0)
+            collision = Entity.accumulate_collision(0.5 * (distance1 + distance2), granularity)
             collision1 = collision / self.shape.area
             collision2 = collision / other.shape.area
             if other.id is not None:
@@ -192,9 +291,8 @@ class Entity(object):
                 return (collision1, collision2)
         else:
             min_distance = 1.0 / average_resolution
-            for _, point in Point.range(topleft, bottomright, resolution):
-                if (self.distance(point - self.center) <= min_distance) and (other.distance(point - other.center) <= min_distance):
-                    return True
+            if np.any(np.logical_and(distance1 <= min_distance, distance2 <= min_distance)):
+                return True
 
     def not_collides(self, other, ratio=False, symmetric=False, resolution=None):
         if resolution is None:
@@ -218,24 +316,29 @@ class Entity(object):
         topleft *= resolution
         bottomright *= resolution
         average_resolution = 0.5 * (resolution.x + resolution.y)
+        distance1 = self.distance_mask(topleft, bottomright, resolution)
+        distance2 = other.distance_mask(topleft, bottomright, resolution)
         if ratio:
             granularity = 1.0 / resolution.x / resolution.y
-            collision = 0.0
-            for _, point in Point.range(topleft, bottomright, resolution):
-                distance1 = min(average_resolution * self.distance(point - self.center), 1.0)
-                distance2 = max(1.0 - average_resolution * other.distance(point - other.center), 0.0)
-                average_distance = 0.5 * (distance1 + distance2)
-                if average_distance > 0.95:
-                    collision += granularity * average_distance
+            distance1 = np.minimum(average_resolution * distance1, 1.0)
+            distance2 = np.maximum(1.0 - average_resolution * distance2, 0.0)
+            collision = Entity.accumulate_collision(0.5 * (distance1 + distance2), granularity)
             if symmetric:
                 return min(collision / self.shape.area, collision / other.shape.area)
             else:
                 return (collision / self.shape.area, collision / other.shape.area)
         else:
             min_distance = 1.0 / average_resolution
-            for c, point in Point.range(topleft, bottomright, resolution):
-                if (self.distance(point - self.center) > min_distance) and (other.distance(point - other.center) <= min_distance):
-                    return True
+            if np.any(np.logical_and(distance1 > min_distance, distance2 <= min_distance)):
+                return True
+
+    @staticmethod
+    def accumulate_collision(average_distance, granularity):
+        # sequential sum in Point.range order, so ratios match the per-pixel accumulation exactly
+        collision = granularity * average_distance[average_distance > 0.95]
+        if collision.size == 0:
+            return 0.0
+        return float(np.cumsum(collision)[-1])
 
     @staticmethod
     def random_instance(center, rotation, size_range, distortion_range, shade_range, combination=None, combinations=None, shapes=None, colors=None, textures=None):
@@ -3,6 +3,7 @@ from collections import namedtuple
 from math import ceil, cos, floor, pi, sin, sqrt, trunc
 from operator import __truediv__
 from random import uniform
+import numpy as np
 
 
 PointTuple = namedtuple('PointTuple', ('x', 'y'))
@@ -102,6 +103,9 @@ class Point(PointTuple):
         return Point(-self.x, -self.y)
 
     def __add__(self, other):
+        # point arrays are handled by the reflected operators of PointArray
+        if isinstance(other, PointArray):
+            return NotImplemented
         assert isinstance(other, float) or isinstance(other, int) or isinstance(other, bool) or isinstance(other, Point)
         if isinstance(other, Point):
             return Point(self.x + other.x, self.y + other.y)
@@ -109,6 +113,8 @@ class Point(PointTuple):
             return Point(self.x + other, self.y + other)
 
     def __sub__(self, other):
+        if isinstance(other, PointArray):
+            return NotImplemented
         assert isinstance(other, float) or isinstance(other, int) or isinstance(other, bool) or isinstance(other, Point)
         if isinstance(other, Point):
             return Point(self.x - other.x, self.y - other.y)
@@ -116,6 +122,8 @@ class Point(PointTuple):
             return Point(self.x - other, self.y - other)
 
     def __mul__(self, other):
+        if isinstance(other, PointArray):
+            return NotImplemented
         assert isinstance(other, float) or isinstance(other, int) or isinstance(other, bool) or isinstance(other, Point)
         if isinstance(other, Point):
             return Point(self.x * other.x, self.y * other.y)
@@ -123,6 +131,8 @@ class Point(PointTuple):
             return Point(self.x * other, self.y * other)
 
     def __truediv__(self, other):
+        if isinstance(other, PointArray):
+            return NotImplemented
         assert isinstance(other, float) or isinstance(other, int) or isinstance(other, bool) or isinstance(other, Point)
         if isinstance(other, Point):
             return Point(__truediv__(self.x, other.x), __truediv__(self.y, other.y))
@@ -275,6 +285,184 @@ class Point(PointTuple):
         return Point(uniform(topleft.x, bottomright.x), uniform(topleft.y, bottomright.y))
 
 
+class PointArray(object):
+
+    __slots__ = ('array',)
+
+    def __init__(self, array):
+        assert isinstance(array, np.ndarray) and array.ndim == 2 and array.shape[1] == 2
+        self.array = array
+
+    @staticmethod
+    def from_points(points):
+        return PointArray(np.array(object=[(point.x, point.y) for point in points], dtype=np.float64).reshape((-1, 2)))
+
+    @staticmethod
+    def from_coordinates(x, y):
+        return PointArray(np.stack((x, y), axis=1))
+
+    @staticmethod
+    def operand(other):
+        assert isinstance(other, float) or isinstance(other, int) or isinstance(other, bool) or isinstance(other, Point) or isinstance(other, PointArray)
+        if isinstance(other, PointArray):
+            return other.array
+        elif isinstance(other, Point):
+            return np.array(object=(other.x, other.y))
+        else:
+            return other
+
+    @property
+    def x(self):
+        return self.array[:, 0]
+
+    @property
+    def y(self):
+        return self.array[:, 1]
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return Point(*self.array[index].tolist())
+        else:
+            return PointArray(self.array[index])
+
+    def __iter__(self):
+        for x, y in self.array.tolist():
+            yield Point(x, y)
+
+    def __str__(self):
+        return '[{}]'.format(', '.join('({}/{})'.format(x, y) for x, y in self.array.tolist()))
+
+    def lower(self):
+        return np.minimum(self.x, self.y)
+
+    def upper(self):
+        return np.maximum(self.x, self.y)
+
+    def length(self):
+        return np.sqrt(self.x * self.x + self.y * self.y)
+
+    def distance(self, other):
+        diff = self.array - PointArray.operand(other)
+        return np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+
+    def is_right(self, angle):
+        assert isinstance(angle, float) and 0.0 <= angle < 1.0
+        angle = angle * 2.0 * pi
+        return self.x * sin(angle) - self.y * cos(angle) > 0.0
+
+    def __eq__(self, other):
+        return np.all(self.array == PointArray.operand(other), axis=1)
+
+    def __ne__(self, other):
+        return np.any(self.array != PointArray.operand(other), axis=1)
+
+    def __lt__(self, other):
+        return np.all(self.array < PointArray.operand(other), axis=1)
+
+    def __gt__(self, other):
+        return np.all(self.array > PointArray.operand(other), axis=1)
+
+    def __le__(self, other):
+        return np.all(self.array <= PointArray.operand(other), axis=1)
+
+    def __ge__(self, other):
+        return np.all(self.array >= PointArray.operand(other), axis=1)
+
+    __hash__ = None
+
+    def __pos__(self):
+        return PointArray(self.array.copy())
+
+    def __neg__(self):
+        return PointArray(-self.array)
+
+    def __add__(self, other):
+        return PointArray(self.array + PointArray.operand(other))
+
+    def __sub__(self, other):
+        return PointArray(self.array - PointArray.operand(other))
+
+    def __mul__(self, other):
+        return PointArray(self.array * PointArray.operand(other))
+
+    def __truediv__(self, other):
+        return PointArray(np.true_divide(self.array, PointArray.operand(other)))
+
+    def __floordiv__(self, other):
+        return PointArray(self.array // PointArray.operand(other))
+
+    def __div__(self, other):
+        return self.__truediv__(other)
+
+    def __mod__(self, other):
+        return PointArray(self.array % PointArray.operand(other))
+
+    def __pow__(self, other):
+        return PointArray(self.array ** PointArray.operand(other))
+
+    def __radd__(self, other):
+        return PointArray(PointArray.operand(other) + self.array)
+
+    def __rsub__(self, other):
+        return PointArray(PointArray.operand(other) - self.array)
+
+    def __rmul__(self, other):
+        return PointArray(PointArray.operand(other) * self.array)
+
+    def __rtruediv__(self, other):
+        return PointArray(np.true_divide(PointArray.operand(other), self.array))
+
+    def __abs__(self):
+        return PointArray(np.abs(self.array))
+
+    def __floor__(self):
+        return PointArray(np.floor(self.array))
+
+    def __ceil__(self):
+        return PointArray(np.ceil(self.array))
+
+    def square(self):
+        return PointArray(self.array * self.array)
+
+    def sum(self):
+        return self.x + self.y
+
+    def positive(self):
+        return PointArray(np.maximum(self.array, 0.0))
+
+    def min(self, other):
+        return PointArray(np.minimum(self.array, PointArray.operand(other)))
+
+    def max(self, other):
+        return PointArray(np.maximum(self.array, PointArray.operand(other)))
+
+    def rotate(self, angle_sin, angle_cos):
+        return PointArray.from_coordinates(self.x * angle_cos - self.y * angle_sin, self.x * angle_sin + self.y * angle_cos)
+
+    @staticmethod
+    def range(start, end=None, size=None):
+        # same points and order as Point.range, as arrays
+        assert isinstance(start, Point)
+        assert end is None or isinstance(end, Point)
+        assert size is None or isinstance(size, Point)
+        if end is None:
+            end = start.__ceil__()
+            start = Point.izero
+        else:
+            start = start.__floor__()
+            end = end.__ceil__()
+        assert start <= end
+        x, y = np.meshgrid(np.arange(int(start.x), int(end.x)), np.arange(int(start.y), int(end.y)), indexing='ij')
+        points = PointArray.from_coordinates(x.flatten(), y.flatten())
+        if size is None:
+            return points
+        else:
+            size -= Point.ione
+            return points, points / size
+
 Point.zero = Point(0.0, 0.0)
 Point.one = Point(1.0, 1.0)
 Point.neg_one = Point(-1.0, -1.0)
@@ -1,8 +1,10 @@
 from __future__ import division
-from math import cos, pi, sqrt
+from collections import OrderedDict
+from math import ceil, cos, floor, pi, sin, sqrt
 from random import choice, uniform
+import numpy as np
 from shapeworld.util import quadratic_uniform
-from shapeworld.world import Point
+from shapeworld.world import Point, PointArray
 
 
 golden_ratio = sqrt(5.0) / 2.0 - 0.5
@@ -38,13 +40,42 @@ class Shape(object):
     def copy(self):
         raise NotImplementedError
 
+    # point arrays are evaluated on the coordinate grids, single points by the *_point methods
+
     def __contains__(self, offset):
-        raise NotImplementedError
+        if isinstance(offset, PointArray):
+            return self.contains_grid(self.size, offset.x, offset.y)
+        return self.contains_point(offset)
 
     def distance(self, offset):
-        raise NotImplementedError
+        if isinstance(offset, PointArray):
+            return self.distance_grid(self.size, offset.x, offset.y)
+        return self.distance_point(offset)
 
     def centrality(self, offset):
+        if isinstance(offset, PointArray):
+            return self.centrality_grid(self.size, offset.x, offset.y)
+        return self.centrality_point(offset)
+
+    def contains_point(self, offset):
+        raise NotImplementedError
+
+    def distance_point(self, offset):
+        raise NotImplementedError
+
+    def centrality_point(self, offset):
+        raise NotImplementedError
+
+    @staticmethod
+    def contains_grid(size, x, y):
+        raise NotImplementedError
+
+    @staticmethod
+    def distance_grid(size, x, y):
+        raise NotImplementedError
+
+    @staticmethod
+    def centrality_grid(size, x, y):
         raise NotImplementedError
 
     @property
@@ -84,10 +115,8 @@ class Shape(object):
         for shape in Shape.get_shapes():
             shape_cls = Shape.get_shape(name=shape)
             shape_obj = shape_cls.random_instance(size_range=(1.0, 1.0), distortion_range=(2.0, 2.0))
-            contains = 0
-            for point in Point.range(start=Point(-50, -50), end=Point(50, 50)):
-                if point / 100 in shape_obj:
-                    contains += 1
+            points = PointArray.range(start=Point(-50, -50), end=Point(50, 50)) / 100
+            contains = int(np.count_nonzero(shape_obj.__contains__(points)))
             estimated_area = contains / 10000
             assert shape_obj.area <= 1.0, (shape, shape_obj.area)
             assert shape_obj.area == shape_cls.relative_area() or shape_obj.area == shape_cls.relative_area() / empirical_distortion_multiplier, (shape, shape_obj.area, shape_cls.relative_area())
@@ -105,12 +134,22 @@ class WorldShape(Shape):
     def size(self):
         return Point(0.5, 0.5)
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return abs(offset) < 0.5
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        return np.logical_and(np.abs(x) < 0.5, np.abs(y) < 0.5)
+
+    def distance_point(self, offset):
         return (abs(offset) - 0.5).positive().length()
 
+    @staticmethod
+    def distance_grid(size, x, y):
+        x = np.maximum(np.abs(x) - 0.5, 0.0)
+        y = np.maximum(np.abs(y) - 0.5, 0.0)
+        return np.sqrt(x * x + y * y)
+
     @property
     def area(self):
         return 1.0
@@ -127,15 +166,29 @@ class Square(Shape):
     def copy(self):
         return Square(size=(self.size.x * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return abs(offset) <= self.size
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        return np.logical_and(np.abs(x) <= size.x, np.abs(y) <= size.y)
+
+    def distance_point(self, offset):
         return (abs(offset) - self.size).positive().length()
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        x = np.maximum(np.abs(x) - size.x, 0.0)
+        y = np.maximum(np.abs(y) - size.y, 0.0)
+        return np.sqrt(x * x + y * y)
+
+    def centrality_point(self, offset):
         return max(((self.size - abs(offset)) / self.size).lower(), 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        return np.maximum(np.minimum((size.x - np.abs(x)) / size.x, (size.y - np.abs(y)) / size.y), 0.0)
+
     @property
     def area(self):
         return 4.0 * self.size.x * self.size.y
@@ -164,15 +217,29 @@ class Rectangle(Shape):
     def copy(self):
         return Rectangle(size=(self.size * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return abs(offset) <= self.size
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        return np.logical_and(np.abs(x) <= size.x, np.abs(y) <= size.y)
+
+    def distance_point(self, offset):
         return (abs(offset) - self.size).positive().length()
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        x = np.maximum(np.abs(x) - size.x, 0.0)
+        y = np.maximum(np.abs(y) - size.y, 0.0)
+        return np.sqrt(x * x + y * y)
+
+    def centrality_point(self, offset):
         return max(((self.size - abs(offset)) / self.size).lower(), 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        return np.maximum(np.minimum((size.x - np.abs(x)) / size.x, (size.y - np.abs(y)) / size.y), 0.0)
+
     @property
     def area(self):
         return 4.0 * self.size.x * self.size.y
@@ -210,10 +277,14 @@ class Triangle(Shape):
     def copy(self):
         return Triangle(size=(self.size.x * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return offset.y >= -self.size.y and 2.0 * abs(offset.x) / self.size.x + offset.y / self.size.y <= 1.0
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        return np.logical_and(y >= -size.y, 2.0 * np.abs(x) / size.x + y / size.y <= 1.0)
+
+    def distance_point(self, offset):
         if offset.y < -self.size.y:
             return (abs(offset) - self.size).positive().length()
         else:
@@ -222,7 +293,21 @@ class Triangle(Shape):
             size = Point((1.0 - linear) * self.size.x, linear * 2.0 * self.size.y)
             return (offset - size).positive().length()
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        below = y < -size.y
+        x = np.abs(x)
+        below_x = np.maximum(x - size.x, 0.0)
+        below_y = np.maximum(np.abs(y) - size.y, 0.0)
+        y = y + size.y
+        linear = np.minimum(np.maximum(y - x + size.x, 0.0) / (size.x + 2.0 * size.y), 1.0)
+        x = np.maximum(x - (1.0 - linear) * size.x, 0.0)
+        y = np.maximum(y - linear * 2.0 * size.y, 0.0)
+        x = np.where(below, below_x, x)
+        y = np.where(below, below_y, y)
+        return np.sqrt(x * x + y * y)
+
+    def centrality_point(self, offset):
         if offset.y < -self.size.y:
             return 0.0
         else:
@@ -250,6 +335,29 @@ class Triangle(Shape):
             # return ((1.0 - y) + (1.0 - x)) / 2.0
             return linear * (1.0 - y) + (1.0 - linear) * (1.0 - x)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        below = y < -size.y
+        lower = y < -size.y / 3.0
+        x = np.abs(x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_x = x / ((1.0 - (y + size.y) / (2.0 * size.y)) * size.x)
+            lower_y = -y - size.y / 3.0
+            frac_x = np.maximum(x / size.x, 2.0 / 3.0)
+            lower_relative_y = np.minimum(lower_y / (frac_x * 2.0 * size.y / 3.0), 1.0)
+            lower_linear = lower_y / (size.y * 2.0 / 3.0)
+            lower_linear = lower_linear ** 2
+            upper_y = y + size.y / 3.0
+            frac_x = (x / size.x) * 3.0 / 2.0
+            upper_relative_y = upper_y / ((1.0 - frac_x) * 4.0 * size.y / 3.0)
+            upper_linear = upper_y / (size.y * 4.0 / 3.0)
+            upper_linear = 1.0 - (1.0 - upper_linear) ** 2
+            relative_y = np.where(lower, lower_relative_y, upper_relative_y)
+            linear = np.where(lower, lower_linear, upper_linear)
+            linear = 1.0 - (1.0 - linear) ** 2
+            centrality = linear * (1.0 - relative_y) + (1.0 - linear) * (1.0 - relative_x)
+        return np.where(below, 0.0, centrality)
+
     @property
     def area(self):
         return 2.0 * self.size.x * self.size.y
@@ -279,12 +387,19 @@ class Pentagon(Shape):
     def copy(self):
         return Pentagon(size=(self.size.x * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return (offset.y >= -self.size.y and
                 (offset.y + self.size.y) >= ((abs(offset.x) - golden_ratio * self.size.x) / ((1.0 - golden_ratio) * self.size.x) * (golden_ratio * 2.0 * self.size.y)) and
                 (offset.y - (golden_ratio - 0.5) * 2.0 * self.size.y) <= ((1.0 - abs(offset.x) / self.size.x) * (1.0 - golden_ratio) * 2.0 * self.size.y))
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        return np.logical_and(np.logical_and(
+            y >= -size.y,
+            (y + size.y) >= ((np.abs(x) - golden_ratio * size.x) / ((1.0 - golden_ratio) * size.x) * (golden_ratio * 2.0 * size.y))),
+            (y - (golden_ratio - 0.5) * 2.0 * size.y) <= ((1.0 - np.abs(x) / size.x) * (1.0 - golden_ratio) * 2.0 * size.y))
+
+    def distance_point(self, offset):
         offset = Point(abs(offset.x), offset.y + self.size.y - golden_ratio * 2.0 * self.size.y)
         if offset.y < 0.0:
             y_length = golden_ratio * 2.0 * self.size.y
@@ -302,7 +417,27 @@ class Pentagon(Shape):
             size = Point((1.0 - linear) * self.size.x, linear * y_length)
             return (offset - size).positive().length()
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        x = np.abs(x)
+        y = y + size.y - golden_ratio * 2.0 * size.y
+        y_length = golden_ratio * 2.0 * size.y
+        bottom = np.maximum(-y - y_length, 0.0)
+        lower_x = x - golden_ratio * size.x
+        lower_y = -y
+        x_length = (1.0 - golden_ratio) * size.x
+        linear = np.minimum(np.maximum(lower_y - lower_x + x_length, 0.0) / (x_length + y_length), 1.0)
+        lower_x = np.maximum(lower_x - (1.0 - linear) * x_length, 0.0)
+        lower_y = np.maximum(lower_y - linear * y_length, 0.0)
+        lower = np.sqrt(lower_x * lower_x + lower_y * lower_y)
+        y_length = (1.0 - golden_ratio) * 2.0 * size.y
+        linear = np.minimum(np.maximum(y - x + size.x, 0.0) / (size.x + y_length), 1.0)
+        upper_x = np.maximum(x - (1.0 - linear) * size.x, 0.0)
+        upper_y = np.maximum(y - linear * y_length, 0.0)
+        upper = np.sqrt(upper_x * upper_x + upper_y * upper_y)
+        return np.where(y < 0.0, np.where(x < golden_ratio * size.x, bottom, lower), upper)
+
+    def centrality_point(self, offset):
         # return 0.0
         offset = Point(abs(offset.x), offset.y + self.size.y - golden_ratio * 2.0 * self.size.y)
         if offset.y < 0.0:
@@ -328,6 +463,28 @@ class Pentagon(Shape):
         # return max(offset.length() - self.size.x, 0.0)
         # return max((self.size.x - offset.length()) / self.size.x, 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        x = np.abs(x)
+        y = y + size.y - golden_ratio * 2.0 * size.y
+        bottom = np.maximum(np.minimum((size.x - x) / size.x, (size.y - np.abs(y)) / size.y), 0.0)
+        y_length = golden_ratio * 2.0 * size.y
+        lower_x = x - golden_ratio * size.x
+        lower_y = -y
+        x_length = (1.0 - golden_ratio) * size.x
+        linear = np.minimum(np.maximum(lower_y - lower_x + x_length, 0.0) / (x_length + y_length), 1.0)
+        size_x = (1.0 - linear) * x_length
+        size_y = linear * y_length
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lower = np.maximum(np.minimum((size_x - lower_x) / size_x, (size_y - lower_y) / size_y), 0.0)
+        y_length = (1.0 - golden_ratio) * 2.0 * size.y
+        linear = np.minimum(np.maximum(y - x + size.x, 0.0) / (size.x + y_length), 1.0)
+        size_x = (1.0 - linear) * size.x
+        size_y = linear * y_length
+        with np.errstate(divide='ignore', invalid='ignore'):
+            upper = np.maximum(np.minimum((size_x - x) / size_x, (size_y - y) / size_y), 0.0)
+        return np.where(y < 0.0, np.where(x < golden_ratio * size.x, bottom, lower), upper)
+
     @property
     def area(self):
         return (4.0 * golden_ratio * golden_ratio * self.size.x * self.size.y +
@@ -363,11 +520,17 @@ class Cross(Shape):
     def copy(self):
         return Cross(size=(self.size.x * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         offset = abs(offset)
         return offset <= self.size and not (offset - self.size.x / 3.0).positive() > 0.0
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        x = np.abs(x)
+        y = np.abs(y)
+        return np.logical_and(np.logical_and(x <= size.x, y <= size.y), np.logical_not(np.logical_and(x - size.x / 3.0 > 0.0, y - size.x / 3.0 > 0.0)))
+
+    def distance_point(self, offset):
         offset = abs(offset)
         if offset.x > offset.y:
             size = Point(self.size.x, self.size.y / 3.0)
@@ -375,7 +538,16 @@ class Cross(Shape):
             size = Point(self.size.x / 3.0, self.size.y)
         return (offset - size).positive().length()
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        x = np.abs(x)
+        y = np.abs(y)
+        horizontal = x > y
+        x = np.maximum(x - np.where(horizontal, size.x, size.x / 3.0), 0.0)
+        y = np.maximum(y - np.where(horizontal, size.y / 3.0, size.y), 0.0)
+        return np.sqrt(x * x + y * y)
+
+    def centrality_point(self, offset):
         offset = abs(offset)
         if offset.x > self.size.x / 3.0:
             size = Point(self.size.x, self.size.y / 3.0)
@@ -387,6 +559,15 @@ class Cross(Shape):
             size = Point(self.size.x / 3.0, self.size.y / 3.0 * 4.0)
         return max(((size - offset) / size).lower(), 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        x = np.abs(x)
+        y = np.abs(y)
+        conditions = (x > size.x / 3.0, y > size.y / 3.0, x > y)
+        size_x = np.select(conditions, (size.x, size.x / 3.0, size.x / 3.0 * 4.0), size.x / 3.0)
+        size_y = np.select(conditions, (size.y / 3.0, size.y, size.y / 3.0), size.y / 3.0 * 4.0)
+        return np.maximum(np.minimum((size_x - x) / size_x, (size_y - y) / size_y), 0.0)
+
     @property
     def area(self):
         return 20.0 * self.size.x * self.size.y / 9.0
@@ -421,15 +602,27 @@ class Circle(Shape):
     def copy(self):
         return Circle(size=(self.size.x * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return offset.length() <= self.size.x
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        return np.sqrt(x * x + y * y) <= size.x
+
+    def distance_point(self, offset):
         return max(offset.length() - self.size.x, 0.0)
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        return np.maximum(np.sqrt(x * x + y * y) - size.x, 0.0)
+
+    def centrality_point(self, offset):
         return max((self.size.x - offset.length()) / self.size.x, 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        return np.maximum((size.x - np.sqrt(x * x + y * y)) / size.x, 0.0)
+
     @property
     def area(self):
         return pi * self.size.x * self.size.y
@@ -465,24 +658,43 @@ class Semicircle(Shape):
     def copy(self):
         return Semicircle(size=(self.size.x * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         offset += Point(0.0, self.size.y)
         return offset.length() <= self.size.x and offset.y >= 0.0
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        y = y + size.y
+        return np.logical_and(np.sqrt(x * x + y * y) <= size.x, y >= 0.0)
+
+    def distance_point(self, offset):
         offset += Point(0.0, self.size.y)
         if offset.y < 0.0:
             return (abs(offset) - Point(self.size.x, 0.0)).positive().length()
         else:
             return max(offset.length() - self.size.x, 0.0)
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        y = y + size.y
+        below_x = np.maximum(np.abs(x) - size.x, 0.0)
+        below_y = np.maximum(np.abs(y), 0.0)
+        below = np.sqrt(below_x * below_x + below_y * below_y)
+        above = np.maximum(np.sqrt(x * x + y * y) - size.x, 0.0)
+        return np.where(y < 0.0, below, above)
+
+    def centrality_point(self, offset):
         offset += Point(0.0, self.size.y)
         if offset.y < 0.0:
             return 0.0
         else:
             return max((self.size.x - offset.length()) / self.size.x, 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        y = y + size.y
+        return np.where(y < 0.0, 0.0, np.maximum((size.x - np.sqrt(x * x + y * y)) / size.x, 0.0))
+
     @property
     def area(self):
         return pi * self.size.x * self.size.y
@@ -514,19 +726,46 @@ class Ellipse(Shape):
     def copy(self):
         return Ellipse(size=(self.size * 2.0))
 
-    def __contains__(self, offset):
+    def contains_point(self, offset):
         return (offset / self.size).length() <= 1.0
 
-    def distance(self, offset):
+    @staticmethod
+    def contains_grid(size, x, y):
+        x = x / size.x
+        y = y / size.y
+        return np.sqrt(x * x + y * y) <= 1.0
+
+    def distance_point(self, offset):
         offset = abs(offset) / self.size
         offset -= offset / offset.length()
         return (offset * self.size).positive().length()
 
-    def centrality(self, offset):
+    @staticmethod
+    def distance_grid(size, x, y):
+        x = np.abs(x) / size.x
+        y = np.abs(y) / size.y
+        length = np.sqrt(x * x + y * y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = np.maximum((x - x / length) * size.x, 0.0)
+            y = np.maximum((y - y / length) * size.y, 0.0)
+        # center offset is inside the ellipse
+        return np.where(length > 0.0, np.sqrt(x * x + y * y), 0.0)
+
+    def centrality_point(self, offset):
         offset = abs(offset) / self.size
         offset = offset / offset.length() - offset
         return max(offset.length(), 0.0)
 
+    @staticmethod
+    def centrality_grid(size, x, y):
+        x = np.abs(x) / size.x
+        y = np.abs(y) / size.y
+        length = np.sqrt(x * x + y * y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = x / length - x
+            y = y / length - y
+        return np.maximum(np.sqrt(x * x + y * y), 0.0)
+
     @property
     def area(self):
         return pi * self.size.x * self.size.y
@@ -568,3 +807,110 @@ Shape.shapes = dict(
     semicircle=Semicircle,
     ellipse=Ellipse
 )
+
+
+class MaskCache(object):
+
+    # Distance templates for quantized shape size (x and y, hence also distortion), rotation and
+    # sub-pixel phase of the center, with least-recently-used eviction under a memory budget.
+    # Templates are approximations of the exact distance fields, up to the quantization steps.
+
+    def __init__(self, size_step=0.005, rotation_step=(1.0 / 360.0), phase_steps=4, memory_budget=67108864):
+        assert isinstance(size_step, float) and size_step > 0.0
+        assert isinstance(rotation_step, float) and 0.0 < rotation_step <= 1.0
+        assert isinstance(phase_steps, int) and phase_steps >= 1
+        assert isinstance(memory_budget, int) and memory_budget > 0
+        self.size_step = size_step
+        self.rotation_step = rotation_step
+        self.num_rotations = int(round(1.0 / rotation_step))
+        self.phase_steps = phase_steps
+        self.memory_budget = memory_budget
+        self.templates = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def statistics(self):
+        requests = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_rate=(self.hits / requests if requests > 0 else 0.0), evictions=self.evictions, templates=len(self.templates), memory=self.memory)
+
+    def clear(self):
+        self.templates.clear()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def distance(self, shape, rotation, start, end, origin, pitch):
+        # distances at offsets i * pitch - origin for pixels start <= i < end, indexed as [y, x], or None if the window exceeds the template
+        symmetry = MaskCache.rotational_symmetry.get(shape.name, 1)
+        if symmetry == 0:
+            rotation = 0
+        else:
+            period = self.num_rotations // symmetry
+            rotation = int(round(rotation / self.rotation_step)) % period if period > 0 else 0
+        key = [type(shape), max(int(round(shape.size.x / self.size_step)), 1), max(int(round(shape.size.y / self.size_step)), 1), rotation]
+        pixel = list()
+        for n, (center, pitch_value) in enumerate(zip(origin, pitch)):
+            center /= pitch_value
+            center_pixel = int(floor(center))
+            phase = int(round((center - center_pixel) * self.phase_steps))
+            if phase == self.phase_steps:
+                center_pixel += 1
+                phase = 0
+            key.append(phase)
+            pixel.append(center_pixel)
+        key.extend(pitch)
+        key = tuple(key)
+
+        if key in self.templates:
+            self.hits += 1
+            radius_x, radius_y, template = self.templates.pop(key)
+            self.templates[key] = (radius_x, radius_y, template)
+        else:
+            self.misses += 1
+            radius_x, radius_y, template = self.template(*key)
+            self.templates[key] = (radius_x, radius_y, template)
+            self.memory += template.nbytes
+            while self.memory > self.memory_budget and len(self.templates) > 1:
+                _, (_, _, evicted) = self.templates.popitem(last=False)
+                self.memory -= evicted.nbytes
+                self.evictions += 1
+
+        x1 = int(start.x) - pixel[0] + radius_x
+        x2 = int(end.x) - pixel[0] + radius_x
+        y1 = int(start.y) - pixel[1] + radius_y
+        y2 = int(end.y) - pixel[1] + radius_y
+        if x1 < 0 or y1 < 0 or x2 > template.shape[1] or y2 > template.shape[0]:
+            return None
+        return template[y1: y2, x1: x2]
+
+    def template(self, shape_type, size_x, size_y, rotation, phase_x, phase_y, pitch_x, pitch_y):
+        size = Point(size_x * self.size_step, size_y * self.size_step)
+        rotation = rotation / self.num_rotations
+        # shape polygons are contained in the box spanned by size, plus margin for anti-aliasing and quantization
+        radius = size.length()
+        radius_x = int(ceil(radius / pitch_x)) + 2
+        radius_y = int(ceil(radius / pitch_y)) + 2
+        x = (np.arange(-radius_x, radius_x + 1) - phase_x / self.phase_steps) * pitch_x
+        y = (np.arange(-radius_y, radius_y + 1) - phase_y / self.phase_steps) * pitch_y
+        x, y = np.meshgrid(x, y)
+        rotation_sin = sin(-rotation * 2.0 * pi)
+        rotation_cos = cos(-rotation * 2.0 * pi)
+        rotated_x = x * rotation_cos - y * rotation_sin
+        rotated_y = x * rotation_sin + y * rotation_cos
+        return radius_x, radius_y, shape_type.distance_grid(size, rotated_x, rotated_y)
+
+
+# number of rotations mapping a shape onto itself around its center (0 for any rotation)
+MaskCache.rotational_symmetry = dict(
+    square=4,
+    rectangle=2,
+    cross=4,
+    circle=0,
+    ellipse=2
+)
+
+# disabled by default, as cached masks only approximate the exact distance fields
+Shape.mask_cache = None
@@ -1,4 +1,5 @@
 from __future__ import division
+from math import floor
 from random import choice, random
 import numpy as np
 from PIL import Image
@@ -9,7 +10,9 @@ from shapeworld.world.shape import WorldShape
 
 class World(Entity):
 
-    __slots__ = ('size', 'entities', 'shape', 'color', 'texture', 'center', 'rotation', 'rotation_sin', 'rotation_cos', 'relative_topleft', 'relative_bottomright', 'topleft', 'bottomright', 'meta')
+    __slots__ = ('size', 'entities', 'shape', 'color', 'texture', 'center', 'rotation', 'rotation_sin', 'rotation_cos', 'relative_topleft', 'relative_bottomright', 'topleft', 'bottomright', 'meta', 'entity_grid', 'num_indexed')
+
+    GRID_SIZE = 8
 
     def __init__(self, size, color):
         assert isinstance(size, int) and size > 0
@@ -22,6 +25,8 @@ class World(Entity):
         self.size = Point(size, size)
         self.entities = []
         self.meta = dict()
+        self.entity_grid = dict()
+        self.num_indexed = 0
 
     def __eq__(self, other):
         raise NotImplementedError
@@ -52,11 +57,14 @@ class World(Entity):
         return offset
 
     def __contains__(self, offset):
-        return offset in self.shape
+        return self.shape.__contains__(offset)
 
     def distance(self, offset):
         return self.shape.distance(offset)
 
+    def distance_grid(self, x, y):
+        return self.shape.distance_grid(self.shape.size, x, y)
+
     def draw(self, world_array, world_size, draw_fn=None):
         for entity in self.entities:
             entity.draw(world_array=world_array, world_size=world_size, draw_fn=draw_fn)
@@ -75,6 +83,30 @@ class World(Entity):
         else:
             return Point.random_instance(Point.zero, Point.one)
 
+    def grid_cells(self, entity):
+        grid_size = self.__class__.GRID_SIZE
+        x1 = min(max(int(floor(entity.topleft.x * grid_size)), 0), grid_size - 1)
+        y1 = min(max(int(floor(entity.topleft.y * grid_size)), 0), grid_size - 1)
+        x2 = min(max(int(floor(entity.bottomright.x * grid_size)), 0), grid_size - 1)
+        y2 = min(max(int(floor(entity.bottomright.y * grid_size)), 0), grid_size - 1)
+        return [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+    def overlapping(self, entity):
+        # indices of entities with overlapping bounding box, via the uniform grid index
+        if self.num_indexed > len(self.entities):
+            self.entity_grid = dict()
+            self.num_indexed = 0
+        while self.num_indexed < len(self.entities):
+            for cell in self.grid_cells(self.entities[self.num_indexed]):
+                self.entity_grid.setdefault(cell, list()).append(self.num_indexed)
+            self.num_indexed += 1
+        candidates = set()
+        for cell in self.grid_cells(entity):
+            candidates.update(self.entity_grid.get(cell, ()))
+        topleft = entity.topleft
+        bottomright = entity.bottomright
+        return [n for n in sorted(candidates) if not (bottomright.x < self.entities[n].topleft.x or topleft.x > self.entities[n].bottomright.x or bottomright.y < self.entities[n].topleft.y or topleft.y > self.entities[n].bottomright.y)]
+
     def add_entity(self, entity, collision_tolerance=0.0, collision_shade_difference=0.5, boundary_tolerance=0.0):
         entity.id = len(self.entities)
         if boundary_tolerance > 0.0:
@@ -83,18 +115,26 @@ class World(Entity):
         else:
             if self.not_collides(entity, resolution=self.size):
                 return False
+        # only entities with overlapping bounding box can collide
+        others = [self.entities[n] for n in self.overlapping(entity)]
         if collision_tolerance > 0.0:
-            for other in self.entities:
+            for other in others:
                 collision = entity.collides(other, ratio=True, symmetric=True, resolution=self.size)
                 if collision > collision_tolerance or (collision > 0.0 and entity.color == other.color and abs(entity.color.shade - other.color.shade) < collision_shade_difference):
                     # can't distinguish shapes of same color
-                    return False
+                    break
                 if other.overall_collision() > collision_tolerance:
-                    return False
-            if entity.overall_collision() > collision_tolerance:
-                return False
+                    break
+            else:
+                if entity.overall_collision() <= collision_tolerance:
+                    self.entities.append(entity)
+                    return True
+            # no collision entries for rejected entity
+            for other in others:
+                other.collisions.pop(entity.id, None)
+            return False
         else:
-            if any(entity.collides(other, resolution=self.size) for other in self.entities):
+            if any(entity.collides(other, resolution=self.size) for other in others):
                 return False
         self.entities.append(entity)
         return True
@@ -103,7 +143,9 @@ class World(Entity):
         contained = {n: set() for n in range(len(self.entities))}
         for n in range(len(self.entities)):
             entity1 = self.entities[n]
-            for k in range(n + 1, len(self.entities)):
+            for k in self.overlapping(entity1):
+                if k <= n:
+                    continue
                 entity2 = self.entities[k]
                 c1, c2 = entity1.collides(entity2, ratio=True, symmetric=False, resolution=self.size)
                 if c2 > c1:
@@ -112,6 +154,8 @@ class World(Entity):
                     contained[k].add(n)
         sort_indices = util.toposort(partial_order=contained)
         self.entities = [self.entities[n] for n in sort_indices]
+        self.entity_grid = dict()
+        self.num_indexed = 0
         for n, entity in enumerate(self.entities):
             entity.id = n
             entity.collisions = {sort_indices.index(i): c for i, c in entity.collisions.items()}
@@ -119,24 +163,51 @@ class World(Entity):
     def get_array(self, world_array=None, draw_fn=None):
         if draw_fn is None:
             color = self.color.get_color()
-            if color.any():
-                world_array = np.tile(A=np.array(object=color, dtype=np.float32), reps=(self.size.x, self.size.y, 1))
-            elif world_array is None:
+            if world_array is None:
                 world_array = np.zeros(shape=(self.size.y, self.size.x, 3), dtype=np.float32)
+            if color.any():
+                world_array[:] = color
         else:
             world_array = draw_fn(value=world_array)
         self.draw(world_array=world_array, world_size=self.size, draw_fn=draw_fn)
         return world_array
 
+    @staticmethod
+    def render_batch(worlds, out=None):
+        size = worlds[0].size
+        assert all(world.size == size for world in worlds)
+        if out is None:
+            out = np.zeros(shape=(len(worlds), size.y, size.x, 3), dtype=np.float32)
+        else:
+            assert out.shape == (len(worlds), size.y, size.x, 3)
+        for world, world_array in zip(worlds, out):
+            world_array[:] = world.color.get_color()
+        # the n-th entities of all worlds are drawn jointly, one call per shape type
+        for n in range(max(len(world.entities) for world in worlds)):
+            groups = dict()
+            for index, world in enumerate(worlds):
+                if n < len(world.entities):
+                    entity = world.entities[n]
+                    entities, indices = groups.setdefault(type(entity.shape), (list(), list()))
+                    entities.append(entity)
+                    indices.append(index)
+            for entities, indices in groups.values():
+                Entity.draw_batch(entities=entities, indices=indices, world_batch=out, world_size=size)
+        return out
+
     @staticmethod
     def get_image(world_array):
-        image = Image.fromarray(obj=(world_array * 255.0).astype(dtype=np.uint8), mode='RGB')
+        if world_array.dtype != np.uint8:
+            world_array = (world_array * 255.0).astype(dtype=np.uint8)
+        image = Image.fromarray(obj=world_array, mode='RGB')
         return image
 
     @staticmethod
-    def from_image(image):
-        world_array = np.array(object=image, dtype=np.float32) / 255.0
+    def from_image(image, dtype='float32'):
+        world_array = np.array(object=image, dtype=np.uint8)
         if world_array.shape[2] == 4:
             world_array = world_array[:, :, :3]
         assert world_array.shape[2] == 3
+        if dtype != 'uint8':
+            world_array = (world_array.astype(dtype=np.float32) / 255.0).astype(dtype=dtype, copy=False)
         return world_array
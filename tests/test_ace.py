@@ -0,0 +1,60 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+try:
+    import pydmrs
+except ImportError:
+    pydmrs = None
+
+
+# mimics the ACE parse protocol, one reading for sentences starting with 'n', none otherwise
+fake_ace = '''#!{executable}
+import sys
+for line in iter(sys.stdin.readline, ''):
+    sentence = line.rstrip('\\n')
+    if sentence.startswith('n'):
+        sys.stderr.write('NOTE: 1 readings, added 2 / 2 edges to chart (1 fully instantiated, 1 actives used, 1 passives used)\\tRAM: 10k\\n')
+        sys.stdout.write('SENT: ' + sentence + '\\n[ mrs ]\\n\\n\\n')
+    else:
+        sys.stderr.write('NOTE: 0 readings, added 2 / 2 edges to chart (1 fully instantiated, 1 actives used, 1 passives used)\\tRAM: 10k\\n')
+        sys.stdout.write('SKIP: ' + sentence + '\\n\\n\\n')
+    sys.stdout.flush()
+    sys.stderr.flush()
+'''
+
+
+@unittest.skipIf(pydmrs is None, 'pydmrs not installed')
+class AceParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.executable = os.path.join(self.directory, 'ace')
+        with open(self.executable, 'w') as filehandle:
+            filehandle.write(fake_ace.format(executable=sys.executable))
+        os.chmod(self.executable, os.stat(self.executable).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_hit_evicted_while_pending(self):
+        from shapeworld.analyzers.ace import Ace
+        ace = Ace(executable=self.executable, cache_size=4, max_pending=8)
+        first = ['n{}'.format(n) for n in range(8)]
+        self.assertTrue(all(parses is not None for parses in ace.parse(sentence_list=first)))
+        self.assertEqual(list(ace.parse_cache), ['n4', 'n5', 'n6', 'n7'])
+        # the misses are inserted into the cache before the pending hit is yielded
+        second = ['x{}'.format(n) for n in range(8)] + ['n4']
+        results = list(ace.parse(sentence_list=second))
+        self.assertEqual(len(results), 9)
+        self.assertTrue(all(parses is None for parses in results[:8]))
+        self.assertIsNotNone(results[8])
+        self.assertEqual(len(ace.parse_cache), 4)
+        for session in ace.parse_sessions:
+            session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
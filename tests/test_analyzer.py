@@ -0,0 +1,37 @@
+import copy
+import unittest
+try:
+    import pydmrs
+except ImportError:
+    pydmrs = None
+
+
+sentences = ['There is a red square.', 'A square is to the left of a circle.', 'Most shapes are red.', 'There are three squares.', 'A green shape is not a triangle.']
+
+
+@unittest.skipIf(pydmrs is None, 'pydmrs not installed')
+class DmrsAnalyzerTest(unittest.TestCase):
+
+    def test_memoized_analyses(self):
+        from shapeworld.analyzers import DmrsAnalyzer
+        from shapeworld.realizers.dmrs.dmrs import Dmrs
+        analyzer = DmrsAnalyzer(language='english')
+        num_analyzed = 0
+        for mrs_iter in analyzer.ace.parse(sentence_list=sentences):
+            for mrs in mrs_iter:
+                if mrs is None:
+                    continue
+                dmrs = mrs.convert_to(cls=Dmrs, copy_nodes=True)
+                # memoized analyses are shared between subgraphs, but need to yield the same captions
+                analyzer.memoize = True
+                memoized = [caption.model() for caption in analyzer.analyze2(dmrs=copy.deepcopy(dmrs))]
+                analyzer.memoize = False
+                unmemoized = [caption.model() for caption in analyzer.analyze2(dmrs=copy.deepcopy(dmrs))]
+                self.assertEqual(memoized, unmemoized)
+                num_analyzed += int(len(memoized) > 0)
+        self.assertGreater(num_analyzed, 0)
+        analyzer.ace.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
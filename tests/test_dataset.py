@@ -0,0 +1,472 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import warnings
+import zipfile
+import numpy as np
+try:
+    import pydmrs
+except ImportError:
+    pydmrs = None
+from shapeworld.dataset import Dataset, LoadedDataset, ParallelDataset, CaptionAgreementDataset
+from shapeworld.world import World
+
+
+num_shards = 3
+shard_size = 7
+
+
+class ToyDataset(Dataset):
+
+    type = 'agreement'
+    name = 'toy'
+
+    def __init__(self, alternatives=False, world_dtype='float32'):
+        if alternatives:
+            values = dict(world='world', world_model='model', caption='alternatives(language)', caption_length='alternatives(int)', agreement='alternatives(float)', alternatives='int')
+        else:
+            values = dict(world='world', world_model='model', agreement='float')
+        super(ToyDataset, self).__init__(values=values, world_size=8, vectors=dict(caption=4), vocabularies=dict(language={'': 0, 'a': 1, 'b': 2}), world_dtype=world_dtype)
+
+    def generate_shard(self, shard):
+        # instance ids are stored in the first pixel of the world and in the world model, worlds are exact in uint8
+        ids = [shard * shard_size + n for n in range(shard_size)]
+        worlds = np.random.randint(256, size=(shard_size, 8, 8, 3)).astype(np.float32)
+        worlds[:, 0, 0, :] = np.array(ids)[:, None]
+        generated = dict(world=(worlds / 255.0).astype(np.float32), world_model=[dict(id=n) for n in ids])
+        if 'alternatives' in self.values:
+            generated['alternatives'] = np.array([1 + n % 3 for n in ids])
+            generated['caption'] = [[np.array([1 + k % 2] * (k + 1) + [0] * (3 - k), dtype=np.int64) for k in range(1 + n % 3)] for n in ids]
+            generated['caption_length'] = [[k + 1 for k in range(1 + n % 3)] for n in ids]
+            generated['agreement'] = [[float(n) + k / 4.0 for k in range(1 + n % 3)] for n in ids]
+        else:
+            generated['agreement'] = np.array([float(n) for n in ids])
+        if self.world_dtype == 'uint8':
+            generated['world'] = np.round(generated['world'] * 255.0).astype(np.uint8)
+        return generated
+
+
+class FailingDataset(ToyDataset):
+
+    def __init__(self, num_batches):
+        super(FailingDataset, self).__init__()
+        self.num_batches = num_batches
+
+    def generate(self, n, mode=None, include_model=False, alternatives=False):
+        if self.num_batches == 0:
+            raise ValueError('no more batches')
+        self.num_batches -= 1
+        return self.generate_shard(shard=0)
+
+
+class RandomDataset(ToyDataset):
+
+    def generate(self, n, mode=None, include_model=False, alternatives=False):
+        # the world model records the size of the chunk the instance was generated in
+        return dict(agreement=np.random.uniform(size=n), world_model=[dict(chunk=n, index=k) for k in range(n)])
+
+
+class StubWorldGenerator(object):
+
+    world_size = 8
+
+    def __init__(self):
+        self.num_worlds = 0
+
+    def initialize(self, mode):
+        return True
+
+    def __call__(self):
+        world = World(size=self.world_size, color='black')
+        world.meta['id'] = self.num_worlds
+        self.num_worlds += 1
+        return world
+
+
+class StubCaption(object):
+
+    def __init__(self, world, number, correct):
+        self.world = world
+        self.number = number
+        self.correct = correct
+
+    def polish_notation(self, reverse=False):
+        return ['caption']
+
+    def model(self):
+        return dict(world=self.world, number=self.number, correct=self.correct)
+
+
+class StubCaptioner(object):
+
+    def __init__(self):
+        self.num_captions = 0
+        self.correct = None
+
+    def set_realizer(self, realizer):
+        pass
+
+    def pn_length(self):
+        return 2
+
+    def pn_symbols(self):
+        return {'caption'}
+
+    def pn_arity(self):
+        return dict(caption=0)
+
+    def initialize(self, mode, correct):
+        self.correct = correct
+        return True
+
+    def incorrect_possible(self):
+        return True
+
+    def __call__(self, world):
+        caption = StubCaption(world=world.meta['id'], number=self.num_captions, correct=self.correct)
+        self.num_captions += 1
+        return caption
+
+
+def stub_realizer(failing):
+    from shapeworld.realizers.realizer import CaptionRealizer
+
+    class StubRealizer(CaptionRealizer):
+
+        def __init__(self):
+            super(StubRealizer, self).__init__(language='english')
+            self.num_calls = 0
+
+        def realize(self, captions, return_failures=False):
+            # captions are realized as the digits of their number
+            self.num_calls += 1
+            return [None if failing(caption) else ' '.join(str(caption.number)) + ' caption' for caption in captions]
+
+        def caption_mrs(self, caption):
+            return None, 'mrs of caption {}'.format(caption.number)
+
+    return StubRealizer()
+
+
+def write_dataset(directory, shard_format=None, archive=None, alternatives=False, world_dtype='float32'):
+    dataset = ToyDataset(alternatives=alternatives, world_dtype=world_dtype)
+    for shard in range(num_shards):
+        path = '{}/shard{}'.format(directory, shard)
+        generated = dataset.generate_shard(shard=shard)
+        if shard_format == 'npy':
+            dataset.serialize_columns(path=path, generated=generated)
+        elif shard_format == 'chunked':
+            dataset.serialize_chunks(path=path, generated=generated, chunk_size=3, compression='zlib')
+        else:
+            dataset.serialize(path=path, generated=generated, archive=archive)
+    specification = dataset.specification()
+    specification.update(directory=directory, include_model=True)
+    if shard_format is not None:
+        specification['shard_format'] = shard_format
+    if archive is not None:
+        specification['archive'] = archive
+    return specification
+
+
+def instance_ids(batch):
+    # ids from the worlds and the world models, which need to agree
+    world_ids = np.round(np.asarray(batch['world'], dtype=np.float32)[:, 0, 0, 0] * (1.0 if batch['world'].dtype == np.uint8 else 255.0)).astype(np.int64)
+    model_ids = [model['id'] for model in batch['world_model']]
+    assert list(world_ids) == model_ids, (list(world_ids), model_ids)
+    return model_ids
+
+
+class LoadedDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_format(self, **kwargs):
+        specification = write_dataset(directory=self.directory, **kwargs)
+        all_ids = list(range(num_shards * shard_size))
+
+        # sequential sampling preserves the stored order and wraps around
+        dataset = LoadedDataset(specification=dict(specification), random_sampling=False)
+        ids = instance_ids(dataset.generate(n=(len(all_ids) + 5), include_model=True))
+        self.assertEqual(ids, all_ids + all_ids[:5])
+        dataset.close()
+
+        # random sampling, worlds and models stay aligned
+        dataset = LoadedDataset(specification=dict(specification), random_sampling=True, resident_shards=2, prefetch_shards=1)
+        for _ in range(5):
+            batch = dataset.generate(n=10, include_model=True)
+            ids = instance_ids(batch)
+            self.assertEqual(batch['agreement'].tolist(), [float(n) for n in ids])
+
+        # one epoch covers every instance once
+        ids = [n for batch in dataset.epoch(n=4, include_model=True) for n in instance_ids(batch)]
+        self.assertEqual(sorted(ids), all_ids)
+        dataset.close()
+        self.assertIsNone(dataset.shard_pool)
+        return specification
+
+    def test_legacy_format(self):
+        self.check_format()
+
+    def test_legacy_archive_format(self):
+        self.check_format(archive='zip')
+
+    def test_npy_format(self):
+        self.check_format(shard_format='npy')
+
+    def test_chunked_format(self):
+        specification = self.check_format(shard_format='chunked')
+        dataset = LoadedDataset(specification=dict(specification))
+        indices = [20, 0, 7, 8, 3]
+        self.assertEqual(instance_ids(dataset.get_instances(indices=indices, include_model=True)), indices)
+
+    def test_uint8_worlds(self):
+        specification = self.check_format(shard_format='npy', world_dtype='uint8')
+        dataset = LoadedDataset(specification=dict(specification))
+        self.assertEqual(dataset.generate(n=4)['world'].dtype, np.uint8)
+        float_dataset = LoadedDataset(specification=dict(specification), world_dtype='float32')
+        self.assertEqual(float_dataset.generate(n=4)['world'].dtype, np.float32)
+
+    def test_resident_shards_exceeding_shards(self):
+        specification = write_dataset(directory=self.directory, shard_format='npy')
+        for random_sampling in (True, False):
+            dataset = LoadedDataset(specification=dict(specification), random_sampling=random_sampling, resident_shards=(num_shards + 2), prefetch_shards=2)
+            for _ in range(4):
+                ids = instance_ids(dataset.generate(n=(num_shards * shard_size), include_model=True))
+                self.assertEqual(len(dataset.shard[None]), num_shards)
+                self.assertEqual(sorted(ids), list(range(num_shards * shard_size)))
+            ids = [n for batch in dataset.epoch(n=5, include_model=True) for n in instance_ids(batch)]
+            self.assertEqual(sorted(ids), list(range(num_shards * shard_size)))
+            dataset.close()
+
+    def test_alternatives_with_noise(self):
+        for shard_format in (None, 'npy', 'chunked'):
+            directory = '{}/{}'.format(self.directory, shard_format)
+            specification = write_dataset(directory=directory, shard_format=shard_format, alternatives=True)
+            dataset = LoadedDataset(specification=dict(specification), random_sampling=True, pixel_noise_stddev=0.1, shard_cache_size=(1 << 20))
+            worlds = np.zeros(shape=((num_shards * shard_size,) + dataset.world_shape()), dtype=np.float32)
+            for stored in LoadedDataset(specification=dict(specification)).epoch(n=8, include_model=True):
+                for world, model in zip(stored['world'], stored['world_model']):
+                    worlds[model['id']] = world
+            for _ in range(3):
+                batch = dataset.generate(n=8, include_model=True, alternatives=True)
+                ids = [model['id'] for model in batch['world_model']]
+                noise = batch['world'] - worlds[ids]
+                # truncated at two standard deviations, and clipped to the valid range
+                self.assertTrue(all(np.any(instance_noise != 0.0) for instance_noise in noise))
+                self.assertLessEqual(np.abs(noise).max(), 0.2 + 1e-6)
+                for n, index in enumerate(ids):
+                    self.assertEqual(batch['alternatives'][n], 1 + index % 3)
+                    self.assertEqual(batch['agreement'][n], [float(index) + k / 4.0 for k in range(1 + index % 3)])
+                    self.assertEqual([caption.tolist() for caption in batch['caption'][n]], [[1 + k % 2] * (k + 1) + [0] * (3 - k) for k in range(1 + index % 3)])
+                    # alternatives are copies, so modifying them does not alter loaded shards
+                    batch['caption'][n][0][0] = -1
+            # neither noise nor modifications are accumulated in the cached shards
+            dataset.pixel_noise_stddev = None
+            batch = dataset.generate(n=(num_shards * shard_size), include_model=True, alternatives=True)
+            ids = [model['id'] for model in batch['world_model']]
+            self.assertEqual(np.abs(batch['world'] - worlds[ids]).max(), 0.0)
+            self.assertTrue(all(caption[0][0] != -1 for caption in batch['caption']))
+            # one epoch covers every alternative of every instance once
+            pairs = list()
+            for batch in dataset.epoch(n=5, include_model=True):
+                pairs.extend((model['id'], agreement) for model, agreement in zip(batch['world_model'], batch['agreement']))
+            self.assertEqual(sorted(pairs), [(n, float(n) + k / 4.0) for n in range(num_shards * shard_size) for k in range(1 + n % 3)])
+
+
+class SerializeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def archive_contents(self, archive, encode_workers):
+        dataset = ToyDataset(alternatives=True)
+        np.random.seed(0)
+        generated = dataset.generate_shard(shard=0)
+        path = '{}/workers{}/shard'.format(self.directory, encode_workers)
+        dataset.serialize(path=path, generated=generated, archive=archive, encode_workers=encode_workers)
+        # members and their bytes, zip timestamps aside
+        if archive is None:
+            contents = list()
+            for filename in sorted(os.listdir(path)):
+                with open(os.path.join(path, filename), 'rb') as filehandle:
+                    contents.append((filename, filehandle.read()))
+            return contents
+        with zipfile.ZipFile(path + '.zip', 'r') as zip_file:
+            return [(info.filename, zip_file.read(info)) for info in zip_file.infolist()]
+
+    def test_encode_workers(self):
+        for archive in (None, 'zip'):
+            contents = self.archive_contents(archive=archive, encode_workers=1)
+            self.assertTrue(any(filename.startswith('world') for filename, _ in contents))
+            self.assertEqual(self.archive_contents(archive=archive, encode_workers=4), contents)
+
+    def test_encode_pool_shutdown(self):
+        dataset = ToyDataset()
+        generated = dataset.generate_shard(shard=0)
+        generated['unknown'] = generated['agreement']
+        num_threads = threading.active_count()
+        # an encode pool left running is only terminated when garbage-collected, with a warning
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertRaises(KeyError, dataset.serialize, path='{}/shard'.format(self.directory), generated=generated, encode_workers=4)
+            gc.collect()
+        self.assertFalse(any(issubclass(warning.category, ResourceWarning) for warning in caught))
+        self.assertEqual(threading.active_count(), num_threads)
+
+
+@unittest.skipIf(pydmrs is None, 'pydmrs not installed')
+class CaptionAgreementDatasetTest(unittest.TestCase):
+
+    def create_dataset(self, failing, captions_per_instance=1):
+        return CaptionAgreementDataset(world_generator=StubWorldGenerator(), world_captioner=StubCaptioner(), caption_size=4, vocabulary=sorted(list('0123456789') + ['caption']), caption_realizer=stub_realizer(failing=failing), captions_per_instance=captions_per_instance)
+
+    def check_batch(self, dataset, batch, n, captions_per_instance):
+        id2word = {index: word for word, index in dataset.vocabularies['language'].items()}
+        for i in range(n):
+            if captions_per_instance > 1:
+                self.assertEqual(batch['alternatives'][i], captions_per_instance)
+                caption_models = batch['caption_model'][i]
+                agreements = batch['agreement'][i]
+                captions = batch['caption'][i]
+                caption_lengths = batch['caption_length'][i]
+            else:
+                caption_models = [batch['caption_model'][i]]
+                agreements = [batch['agreement'][i]]
+                captions = [batch['caption'][i]]
+                caption_lengths = [batch['caption_length'][i]]
+            # resampled instances are reset, so exactly one value per alternative remains
+            for values in (caption_models, agreements, captions, caption_lengths, batch['caption_pn_length'][i] if captions_per_instance > 1 else [None]):
+                self.assertEqual(len(values), captions_per_instance)
+            for caption_model, agreement, caption, caption_length in zip(caption_models, agreements, captions, caption_lengths):
+                self.assertEqual(caption_model['world'], batch['world_model'][i]['meta']['id'])
+                self.assertEqual(agreement, float(caption_model['correct']))
+                words = [id2word[index] for index in caption[:caption_length]]
+                self.assertEqual(words, list(str(caption_model['number'])) + ['caption'])
+
+    def test_resampling(self):
+        failing = {1, 4, 5, 9}
+        for captions_per_instance in (1, 2):
+            dataset = self.create_dataset(failing=(lambda caption: caption.number in failing), captions_per_instance=captions_per_instance)
+            batch = dataset.generate(n=5, include_model=True, alternatives=True)
+            self.check_batch(dataset=dataset, batch=batch, n=5, captions_per_instance=captions_per_instance)
+            caption_numbers = [model['number'] for models in batch['caption_model'] for model in (models if captions_per_instance > 1 else [models])]
+            self.assertTrue(failing.isdisjoint(caption_numbers))
+            # every sampled caption is realized once
+            num_captions = dataset.world_captioner.num_captions
+            self.assertEqual(dataset.realization_statistics()['realizations'], num_captions)
+            self.assertEqual(dataset.realization_statistics()['failures'], len([number for number in failing if number < num_captions]))
+            self.assertGreater(dataset.caption_realizer.num_calls, 1)
+
+    def test_max_realization_rounds(self):
+        # one of the two captions of every instance fails to be realized
+        dataset = self.create_dataset(failing=(lambda caption: caption.number % 2 == 1), captions_per_instance=2)
+        with self.assertRaises(Exception) as context:
+            dataset.generate(n=4, include_model=True, alternatives=True)
+        self.assertIn('of 4 instances after {} rounds'.format(CaptionAgreementDataset.MAX_REALIZATION_ROUNDS), str(context.exception))
+        self.assertIn('mrs of caption', str(context.exception))
+        self.assertEqual(dataset.caption_realizer.num_calls, CaptionAgreementDataset.MAX_REALIZATION_ROUNDS)
+
+
+class DatasetIteratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.specification = write_dataset(directory=self.directory, shard_format='npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sequential_iterator(self):
+        for prefetch in (0, 2):
+            dataset = LoadedDataset(specification=dict(self.specification), random_sampling=False)
+            iterator = dataset.iterate(n=4, include_model=True, iterations=4, prefetch=prefetch)
+            # a single producer continues the stored order
+            self.assertEqual([n for batch in iterator for n in instance_ids(batch)], list(range(16)))
+            self.assertEqual(iterator.processes, [])
+            self.assertIsNone(iterator.queue)
+        dataset = LoadedDataset(specification=dict(self.specification), random_sampling=False)
+        self.assertRaises(AssertionError, dataset.iterate, n=4, workers=2)
+
+    def test_parallel_iterator(self):
+        dataset = LoadedDataset(specification=dict(self.specification), random_sampling=True)
+        iterator = dataset.iterate(n=4, include_model=True, iterations=6, prefetch=2, workers=2)
+        num_batches = 0
+        for batch in iterator:
+            self.assertEqual(len(iterator.processes), 2)
+            self.assertTrue(all(0 <= n < num_shards * shard_size for n in instance_ids(batch)))
+            num_batches += 1
+        self.assertEqual(num_batches, 6)
+        self.assertEqual(iterator.processes, [])
+        self.assertEqual(iterator.statistics()['batches'], 6)
+
+    def test_queue_shutdown(self):
+        dataset = LoadedDataset(specification=dict(self.specification), random_sampling=True)
+        iterator = dataset.iterate(n=4, prefetch=1, workers=2)
+        next(iterator)
+        # producers blocked on the full queue are stopped as well
+        processes = list(iterator.processes)
+        iterator.close()
+        self.assertFalse(any(process.is_alive() for process in processes))
+        self.assertIsNone(iterator.queue)
+        self.assertEqual(iterator.processes, [])
+        # producers are restarted on the next batch
+        next(iterator)
+        self.assertEqual(len(iterator.processes), 2)
+        iterator.close()
+
+    def test_error_forwarding(self):
+        for workers in (0, 1):
+            iterator = FailingDataset(num_batches=2).iterate(n=4, prefetch=1, workers=workers)
+            next(iterator)
+            next(iterator)
+            with self.assertRaises(Exception) as context:
+                next(iterator)
+            self.assertIn('no more batches', str(context.exception))
+            self.assertEqual(iterator.processes, [])
+
+
+class ParallelDatasetTest(unittest.TestCase):
+
+    def test_chunks(self):
+        dataset = ParallelDataset(dataset=RandomDataset(), workers=3, seed=0)
+        for n in (1, 3, 8):
+            batch = dataset.generate(n=n, include_model=True)
+            self.assertEqual(batch['agreement'].shape, (n,))
+            # chunks differ by at most one instance, and are concatenated in order
+            chunks = [n // min(n, 3) + (1 if k < n % min(n, 3) else 0) for k in range(min(n, 3))]
+            self.assertEqual(batch['world_model'], [dict(chunk=chunk, index=k) for chunk in chunks for k in range(chunk)])
+        dataset.close()
+        self.assertIsNone(dataset.pool)
+
+    def test_seed(self):
+        batches = list()
+        for seed in (0, 0, 1):
+            dataset = ParallelDataset(dataset=RandomDataset(), workers=2, seed=seed)
+            batches.append([dataset.generate(n=5)['agreement'] for _ in range(2)])
+            dataset.close()
+        # the same seed reproduces the same batches, irrespective of worker scheduling
+        self.assertTrue(all(np.array_equal(batch1, batch2) for batch1, batch2 in zip(batches[0], batches[1])))
+        self.assertFalse(np.array_equal(batches[0][0], batches[0][1]))
+        self.assertFalse(np.array_equal(batches[0][0], batches[2][0]))
+
+    def test_loaded_dataset(self):
+        directory = tempfile.mkdtemp()
+        try:
+            dataset = LoadedDataset(specification=write_dataset(directory=directory, shard_format='npy'))
+            self.assertRaises(AssertionError, ParallelDataset, dataset=dataset, workers=2)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import unittest
+try:
+    import pydmrs
+except ImportError:
+    pydmrs = None
+
+
+readme_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'shapeworld', 'realizers', 'dmrs', 'languages', 'README.md')
+
+
+def readme_mrs_strings():
+    # MRS code blocks of the grammar walkthrough, as parsed by ACE
+    with open(readme_path, 'r') as filehandle:
+        blocks = filehandle.read().split('```')[1::2]
+    return [' '.join(block.split()) for block in blocks if block.strip().startswith('[') and 'RELS:' in block]
+
+
+e_pres = ('e', {'sf': 'prop', 'tense': 'pres', 'mood': 'indicative', 'perf': '-', 'prog': '-'})
+e_untensed = ('e', {'sf': 'prop', 'tense': 'untensed', 'mood': 'indicative', 'perf': '-', 'prog': '-'})
+
+# outputs of the original character-level loader
+readme_expected = (
+    {'ltop': ('h0', None), 'index': ('e2', None)},
+    [
+        ('_be_v_there', None, None, {'lbl': ('h1', None), 'arg0': ('e2', e_pres), 'arg1': ('x4', None)}),
+        ('udef_q', None, None, {'lbl': ('h5', None), 'arg0': ('x4', None), 'rstr': ('h6', None), 'body': ('h7', None)}),
+        ('card', None, None, {'lbl': ('h8', None), 'carg': '"3"', 'arg0': ('e10', e_untensed), 'arg1': ('x4', None)}),
+        ('_square_n_of', None, None, {'lbl': ('h8', None), 'arg0': ('x4', ('x', {'pers': '3', 'num': 'pl', 'gend': 'n', 'ind': '+'})), 'arg1': ('i11', None)})
+    ],
+    ['h0', 'qeq', 'h1', 'h6', 'qeq', 'h8'],
+    []
+)
+
+fixtures = [
+    (
+        '[ TOP: h0 INDEX: e2 [ e SF: prop TENSE: pres MOOD: indicative PROG: - PERF: - ] RELS: < [ _be_v_id<10:12> LBL: h1 ARG0: e2 ARG1: x4 [ x PERS: 3 NUM: sg IND: + ] ARG2: x5 ] [ named<0:5> LBL: h6 CARG: "Kim Lee" ARG0: x4 ] [ "_wug/NN_u_unknown_rel"<13:16> LBL: h7 ARG0: x5 ] > HCONS: < h0 qeq h1 > ICONS: < e2 [ e SF: prop ] topic x4 > ]',
+        (
+            {'top': ('h0', None), 'index': ('e2', e_pres)},
+            [
+                ('_be_v_id', 10, 12, {'lbl': ('h1', None), 'arg0': ('e2', None), 'arg1': ('x4', ('x', {'pers': '3', 'num': 'sg', 'ind': '+'})), 'arg2': ('x5', None)}),
+                ('named', 0, 5, {'lbl': ('h6', None), 'carg': '"Kim Lee"', 'arg0': ('x4', None)}),
+                ('"_wug/NN_u_unknown_rel"', 13, 16, {'lbl': ('h7', None), 'arg0': ('x5', None)})
+            ],
+            ['h0', 'qeq', 'h1'],
+            ['e2', 'topic', 'x4']
+        )
+    ),
+    (
+        '[ LTOP: h0 INDEX: e2 RELS: < > HCONS: < > ]',
+        ({'ltop': ('h0', None), 'index': ('e2', None)}, [], [], None)
+    )
+]
+
+
+@unittest.skipIf(pydmrs is None, 'pydmrs not installed')
+class MrsLoadTest(unittest.TestCase):
+
+    def test_tokenizer_matches_original_loader(self):
+        from shapeworld.analyzers.mrs_load import _tokenize_mrs
+        strings = readme_mrs_strings()
+        self.assertEqual(len(strings), 1)
+        self.assertEqual(_tokenize_mrs(strings[0]), readme_expected)
+        for string, expected in fixtures:
+            self.assertEqual(_tokenize_mrs(string), expected)
+
+    def test_baseline_scanner_agrees(self):
+        # the benchmark compares against the character-level scanner, which needs to produce the same structures
+        from shapeworld.analyzers.mrs_load import _tokenize_mrs
+        from shapeworld.analyzers.mrs_scan_benchmark import _scan_mrs
+        for string in readme_mrs_strings() + [string for string, _ in fixtures]:
+            self.assertEqual(_scan_mrs(string), _tokenize_mrs(string))
+
+    def test_read_readme_mrs(self):
+        from shapeworld.analyzers.mrs_load import read_mrs
+        mrs = read_mrs(readme_mrs_strings()[0])
+        self.assertTrue(mrs.valid())
+        self.assertEqual(str(mrs.index.pred), '_be_v_there')
+
+
+if __name__ == '__main__':
+    unittest.main()
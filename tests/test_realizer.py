@@ -0,0 +1,89 @@
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+try:
+    import pydmrs
+except ImportError:
+    pydmrs = None
+
+
+# mimics ACE generation: realized for MRS starting with 'ok', 0 results with a SKIP line and without
+# an empty line for 'fail', and terminated process for 'crash'
+fake_ace = '''#!{executable}
+import sys
+for line in iter(sys.stdin.readline, ''):
+    mrs = line.rstrip('\\n')
+    if mrs.startswith('ok'):
+        sys.stdout.write('realized ' + mrs + '\\n\\n')
+        sys.stdout.flush()
+        sys.stderr.write('NOTE: 4 passive, 2 active edges in final generation chart; built 4 passives total. [1 results]\\n')
+    elif mrs.startswith('fail'):
+        sys.stdout.write('SKIP: ' + mrs + '\\n')
+        sys.stdout.flush()
+        sys.stderr.write('NOTE: 0 passive, 0 active edges in final generation chart; built 0 passives total. [0 results]\\n')
+    else:
+        sys.stderr.write('ERROR: invalid predicate\\n')
+        sys.exit(1)
+    sys.stderr.flush()
+'''
+
+successful_regex = re.compile(pattern=r'^NOTE: [0-9]+ passive, [0-9]+ active edges in final generation chart; built [0-9]+ passives total. \[[1-9][0-9]* results\]$')
+unsuccessful_regex = re.compile(pattern=r'^NOTE: [0-9]+ passive, [0-9]+ active edges in final generation chart; built [0-9]+ passives total. \[0 results\]$')
+
+
+@unittest.skipIf(pydmrs is None, 'pydmrs not installed')
+class AceGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.executable = os.path.join(self.directory, 'ace')
+        with open(self.executable, 'w') as filehandle:
+            filehandle.write(fake_ace.format(executable=sys.executable))
+        os.chmod(self.executable, os.stat(self.executable).st_mode | stat.S_IEXEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_results(self, mrs_list, results):
+        self.assertEqual(len(results), len(mrs_list))
+        for mrs, (realization, notes) in zip(mrs_list, results):
+            if mrs.startswith('ok'):
+                self.assertEqual(realization, 'realized ' + mrs)
+                self.assertTrue(successful_regex.match(notes[-1]))
+            else:
+                self.assertIsNone(realization)
+
+    def test_generator(self):
+        from shapeworld.realizers.dmrs.realizer import AceGenerator
+        generator = AceGenerator(ace_path=self.executable, grammar_path='grammar.dat')
+        mrs_list = ['ok0', 'fail1', 'ok2', 'fail3', 'fail4', 'ok5']
+        self.check_results(mrs_list, generator.generate(mrs_list=mrs_list, successful_regex=successful_regex, unsuccessful_regex=unsuccessful_regex))
+        self.assertEqual(generator.num_restarts, 0)
+        # the process is kept for subsequent calls, and restarted after a crash on the remaining items
+        mrs_list = ['ok6', 'crash7', 'ok8', 'fail9', 'ok10']
+        results = generator.generate(mrs_list=mrs_list, successful_regex=successful_regex, unsuccessful_regex=unsuccessful_regex)
+        self.check_results(mrs_list, results)
+        self.assertIn('ERROR: ACE process terminated', results[1][1])
+        self.assertEqual(generator.num_restarts, 1)
+        generator.close()
+
+    def test_generator_pool(self):
+        from shapeworld.realizers.dmrs.realizer import AceGeneratorPool
+        pool = AceGeneratorPool(ace_path=self.executable, grammar_path='grammar.dat', num_processes=3)
+        mrs_list = ['ok{}'.format(n) if n % 4 else 'fail{}'.format(n) for n in range(11)]
+        mrs_list[6] = 'crash6'
+        # shards are realized concurrently, and results returned in input order
+        self.check_results(mrs_list, pool.generate(mrs_list=mrs_list, successful_regex=successful_regex, unsuccessful_regex=unsuccessful_regex))
+        self.assertEqual(len(pool.generators), 3)
+        self.assertEqual(pool.num_restarts, 1)
+        mrs_list = ['ok0', 'ok1']
+        self.check_results(mrs_list, pool.generate(mrs_list=mrs_list, successful_regex=successful_regex, unsuccessful_regex=unsuccessful_regex))
+        pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import random
+import unittest
+import numpy as np
+from shapeworld.world import Point, PointArray, Entity
+from shapeworld.world import World
+from shapeworld.world.shape import Shape, WorldShape
+
+
+class PointArrayTest(unittest.TestCase):
+
+    def test_point_operands(self):
+        points = PointArray.from_points([Point(0.1, 0.2), Point(0.3, -0.4), Point(-0.5, 0.0)])
+        point = Point(1.0, 2.0)
+        for result, expected in ((point + points, [(p.x + 1.0, p.y + 2.0) for p in points]), (point - points, [(1.0 - p.x, 2.0 - p.y) for p in points]), (points - point, [(p.x - 1.0, p.y - 2.0) for p in points]), (point * points, [(p.x, p.y * 2.0) for p in points])):
+            self.assertIsInstance(result, PointArray)
+            self.assertTrue(np.allclose(result.array, expected))
+
+
+class ShapeTest(unittest.TestCase):
+
+    def test_grid_matches_points(self):
+        random.seed(0)
+        np.random.seed(0)
+        offsets = PointArray(np.random.uniform(low=-0.6, high=0.6, size=(500, 2)))
+        shapes = [WorldShape()] + [Shape.random_instance(size_range=(0.2, 0.9), distortion_range=(2.0, 3.0), shape=name) for name in Shape.get_shapes()]
+        for shape in shapes:
+            # point arrays are dispatched to the grid methods, single points to the point methods
+            contains = shape.__contains__(offsets)
+            self.assertEqual(contains.tolist(), [offset in shape for offset in offsets], shape.name)
+            self.assertTrue(np.allclose(shape.distance(offsets), [shape.distance(offset) for offset in offsets]), shape.name)
+            if shape.name != 'worldshape':
+                # centrality is only defined within the shape
+                inside = offsets[np.nonzero(contains)[0]]
+                self.assertTrue(np.allclose(shape.centrality(inside), [shape.centrality(offset) for offset in inside]), shape.name)
+
+    def test_areas(self):
+        self.assertTrue(Shape.test())
+
+
+def pixel_collision(entity1, entity2, topleft, bottomright, resolution, not_collides, ratio):
+    # per-pixel loop of the original implementation, as reference for the vectorized distance masks
+    average_resolution = 0.5 * (resolution.x + resolution.y)
+    granularity = 1.0 / resolution.x / resolution.y
+    min_distance = 1.0 / average_resolution
+    collision = 0.0
+    for _, point in Point.range(topleft * resolution, bottomright * resolution, resolution):
+        distance1 = entity1.distance(point - entity1.center)
+        distance2 = entity2.distance(point - entity2.center)
+        if ratio:
+            if not_collides:
+                distance1 = min(average_resolution * distance1, 1.0)
+            else:
+                distance1 = max(1.0 - average_resolution * distance1, 0.0)
+            distance2 = max(1.0 - average_resolution * distance2, 0.0)
+            average_distance = 0.5 * (distance1 + distance2)
+            if average_distance > 0.95:
+                collision += granularity * average_distance
+        elif (distance1 > min_distance if not_collides else distance1 <= min_distance) and distance2 <= min_distance:
+            return True
+    if ratio:
+        return (collision / entity1.shape.area, collision / entity2.shape.area)
+
+
+class EntityTest(unittest.TestCase):
+
+    def test_collisions_match_pixel_loop(self):
+        random.seed(0)
+        resolution = Point(40, 40)
+        num_overlapping = 0
+        for _ in range(60):
+            center = Point(random.uniform(0.3, 0.7), random.uniform(0.3, 0.7))
+            entity1 = Entity.random_instance(center=center, rotation=True, size_range=(0.1, 0.4), distortion_range=(2.0, 3.0), shade_range=0.4, shapes=Shape.get_shapes(), colors=('red', 'green', 'blue'), textures=('solid',))
+            entity2 = Entity.random_instance(center=(center + Point(random.uniform(-0.2, 0.2), random.uniform(-0.2, 0.2))), rotation=True, size_range=(0.1, 0.4), distortion_range=(2.0, 3.0), shade_range=0.4, shapes=Shape.get_shapes(), colors=('red', 'green', 'blue'), textures=('solid',))
+            entity1.id = 0
+            entity2.id = 1
+            topleft, bottomright = entity1.topleft.max(entity2.topleft), entity1.bottomright.min(entity2.bottomright)
+            if topleft.x <= bottomright.x and topleft.y <= bottomright.y:
+                num_overlapping += 1
+                for ratio in (False, True):
+                    entity1.collisions = dict()
+                    entity2.collisions = dict()
+                    collides = entity1.collides(entity2, ratio=ratio, resolution=resolution)
+                    expected = pixel_collision(entity1, entity2, topleft, bottomright, resolution, not_collides=False, ratio=ratio)
+                    if ratio:
+                        self.assertAlmostEqual(collides[0], expected[0], places=12)
+                        self.assertAlmostEqual(collides[1], expected[1], places=12)
+                    else:
+                        self.assertEqual(bool(collides), bool(expected))
+            # not_collides evaluates the bounding box of the smaller entity, unless it contains the other
+            if not (entity1.topleft.x < entity2.topleft.x and entity1.topleft.y < entity2.topleft.y and entity1.bottomright.x > entity2.bottomright.x and entity1.bottomright.y > entity2.bottomright.y):
+                smaller = entity1 if entity1.bottomright.distance(entity1.topleft) < entity2.bottomright.distance(entity2.topleft) else entity2
+                for ratio in (False, True):
+                    not_collides = entity1.not_collides(entity2, ratio=ratio, resolution=resolution)
+                    expected = pixel_collision(entity1, entity2, smaller.topleft, smaller.bottomright, resolution, not_collides=True, ratio=ratio)
+                    if ratio:
+                        self.assertAlmostEqual(not_collides[0], expected[0], places=12)
+                        self.assertAlmostEqual(not_collides[1], expected[1], places=12)
+                    else:
+                        self.assertEqual(bool(not_collides), bool(expected))
+        self.assertGreater(num_overlapping, 30)
+
+
+class WorldTest(unittest.TestCase):
+
+    def test_render_batch(self):
+        random.seed(0)
+        worlds = list()
+        for num_entities in (3, 0, 1, 5, 2):
+            world = World(size=32, color=random.choice(('black', 'white', 'gray')))
+            for n in range(num_entities):
+                center = Point(random.uniform(0.1, 0.9), random.uniform(0.1, 0.9))
+                entity = Entity.random_instance(center=center, rotation=True, size_range=(0.1, 0.4), distortion_range=(2.0, 3.0), shade_range=0.4, shapes=Shape.get_shapes(), colors=('red', 'green', 'blue', 'yellow'), textures=('solid',))
+                entity.id = n
+                world.entities.append(entity)
+            worlds.append(world)
+        # entities are drawn jointly per entity index, so worlds with fewer entities are skipped in later rounds
+        batch = World.render_batch(worlds=worlds)
+        self.assertEqual(batch.shape, (5, 32, 32, 3))
+        for world, world_array in zip(worlds, batch):
+            self.assertTrue(np.allclose(world_array, world.get_array(), atol=1e-6))
+        out = np.ones(shape=(5, 32, 32, 3), dtype=np.float32)
+        self.assertIs(World.render_batch(worlds=worlds, out=out), out)
+        self.assertTrue(np.array_equal(out, batch))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,6 +29,8 @@ if __name__ == '__main__':
     parser.add_argument('-q', '--query', default=None, help='Additional values to query (separated by commas)')
     parser.add_argument('-T', '--tf-records', action='store_true', help='Use TensorFlow records')
     parser.add_argument('-F', '--features', action='store_true', help='Use image features (conv4 of resnet_v2_101) instead of raw image')
+    parser.add_argument('--prefetch', type=int, default=0, help='Number of batches to prefetch in background processes')
+    parser.add_argument('--workers', type=int, default=0, help='Number of background processes generating batches')
 
     parser.add_argument('--model-dir', default=None, help='TensorFlow model directory, storing the model computation graph and parameters')
     parser.add_argument('--save-frequency', type=int, default=3, help='Save frequency (in hours)')
@@ -258,9 +260,11 @@ if __name__ == '__main__':
                     n = 0
 
         else:
+            train_batches = dataset.iterate(n=args.batch_size, mode='train', prefetch=args.prefetch, workers=args.workers)
+
             for iteration in range(iteration_start, iteration_end + 1):
-                generated = dataset.generate(n=args.batch_size, mode='train')
-                model(data=generated, optimize=True, summarize=True, dropout=dropout)
+                generated = next(train_batches)
+                model(data=dataset.float_worlds(batch=generated), optimize=True, summarize=True, dropout=dropout)
 
                 if iteration % args.evaluation_frequency == 0 or iteration == 1 or iteration == args.evaluation_frequency // 2 or iteration == iteration_end:
                     train = {name: 0.0 for name in query}
@@ -268,14 +272,15 @@ if __name__ == '__main__':
 
                     if args.evaluation_iterations > 0:
                         for _ in range(args.evaluation_iterations):
-                            generated = dataset.generate(n=args.batch_size, mode='train')
-                            queried = model(query=query, data=generated)
+                            generated = next(train_batches)
+                            queried = model(query=query, data=dataset.float_worlds(batch=generated))
                             train = {name: value + queried[name] for name, value in train.items()}
                         train = {name: value / args.evaluation_iterations for name, value in train.items()}
 
-                        for _ in range(args.evaluation_iterations):
-                            generated = dataset.generate(n=args.batch_size, mode='validation')
-                            queried = model(query=query, data=generated)
+                        # validation producers only run during evaluation, and are shut down once exhausted
+                        validation_batches = dataset.iterate(n=args.batch_size, mode='validation', iterations=args.evaluation_iterations, prefetch=args.prefetch, workers=args.workers)
+                        for generated in validation_batches:
+                            queried = model(query=query, data=dataset.float_worlds(batch=generated))
                             validation = {name: value + queried[name] for name, value in validation.items()}
                         validation = {name: value / args.evaluation_iterations for name, value in validation.items()}
 
@@ -302,6 +307,9 @@ if __name__ == '__main__':
                         for name in query:
                             sys.stdout.write('{}={:.3f} '.format(name, validation[name]))
                         sys.stdout.write(' (time per evaluation iteration: {})'.format(str(after - before).split('.')[0]))
+                        if args.workers > 0 or args.prefetch > 0:
+                            statistics = train_batches.statistics(reset=True)
+                            sys.stdout.write(' (queue depth: {:.1f} mean, {} max, blocked: {:.1f}s)'.format(statistics['mean_queue_depth'], statistics['max_queue_depth'], statistics['wait_time']))
 
                     time_since_save += (after - before)
                     if args.model_dir is not None and (time_since_save.seconds > args.save_frequency * 60 * 60 or iteration == iteration_end):
@@ -315,6 +323,8 @@ if __name__ == '__main__':
                         sys.stdout.flush()
                     before = datetime.now()
 
+            train_batches.close()
+
     if args.verbosity >= 1:
         sys.stdout.write('\n{} model training finished\n'.format(datetime.now().strftime('%H:%M:%S')))
         sys.stdout.flush()